@@ -72,6 +72,11 @@ DEFAULT_ADMIN_EMAIL = os.getenv('DEFAULT_ADMIN_EMAIL', 'admin@smartevents.local'
 # Initialize database tables
 with app.app_context():
     db.create_all()
+
+    # Apply column/index additions to databases created by older versions.
+    from utils.schema_upgrades import upgrade_schema
+    upgrade_schema()
+
     for type_name, description, access_level, color_code in DEFAULT_PASS_TYPES:
         exists = PassType.query.filter_by(type_name=type_name).first()
         if exists:
@@ -119,6 +124,23 @@ with app.app_context():
 
     db.session.commit()
 
+    # Warm the /validate hot-path caches for active events.
+    from utils.credential_index import warm_credential_index
+    from utils.gate_access import warm_gate_access
+    from utils.code_filter import warm_code_filter
+    warm_code_filter()
+    warm_credential_index()
+    warm_gate_access()
+
+# Optional write-behind pipeline for scan audit logs (SCAN_LOG_WRITE_BEHIND=True).
+from utils.scan_log_writer import init_scan_log_writer
+init_scan_log_writer(app)
+
+# Background drain of staged offline sync uploads (OFFLINE_SYNC_WORKER=True under a
+# WSGI server; python app.py always starts it, scripts importing the app never do).
+from utils.offline_queue import init_offline_queue_worker
+init_offline_queue_worker(app)
+
 login_manager = LoginManager(app)
 login_manager.login_view = 'auth.login'  # FIXED: Added 'auth.' prefix
 login_manager.login_message = 'Please log in to access this page.'
@@ -233,4 +255,6 @@ if __name__ == '__main__':
     os.makedirs(os.path.join(static_root, 'barcodes'), exist_ok=True)
     os.makedirs(os.path.join(static_root, 'uploads'), exist_ok=True)
 
+    init_offline_queue_worker(app, enabled=True)
+
     app.run(debug=os.getenv('DEBUG', 'False') == 'True', host='0.0.0.0', port=5000)
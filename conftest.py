@@ -0,0 +1,104 @@
+import os
+import tempfile
+import uuid
+from datetime import date, datetime, time, timedelta
+
+import pytest
+
+# Point the app at a throwaway database before any test imports it.
+_db_dir = tempfile.mkdtemp(prefix='event-ticket-tests-')
+os.environ.setdefault('DATABASE_PATH', os.path.join(_db_dir, 'test.db'))
+os.environ.setdefault('SECRET_KEY', 'test')
+
+from app import app, db  # noqa: E402
+from models import (Event, EventPass, EventScannerAssignment, Gate, GateAccessRule, PassType, Ticket,  # noqa: E402
+                    TicketBatch, User)
+from utils import scan_rate_limit  # noqa: E402
+from utils.credential_index import warm_credential_index  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def scan_event():
+    """
+    One event with three gates, plus a second event:
+    - open_gate: General, no access rules (every pass type)
+    - vip_gate: VIP, only the VIP pass type
+    - other_gate: a gate of the other event
+    The security user is assigned to open_gate only.
+    """
+    app.config['TESTING'] = True
+    with app.app_context():
+        organizer = User(username='scan-organizer', email='scan-organizer@example.com', password_hash='hash',
+                         full_name='Scan Organizer', role='organizer')
+        security = User(username='scan-security', email='scan-security@example.com', password_hash='hash',
+                        full_name='Scan Security', role='security')
+        db.session.add_all([organizer, security])
+        db.session.commit()
+        event = Event(event_name='Scan Pipeline Event', event_date=date.today(), event_time=time(18, 0),
+                      location='Hall', total_capacity=1000, organizer_id=organizer.id)
+        other_event = Event(event_name='Other Event', event_date=date.today(), event_time=time(18, 0),
+                            location='Annex', total_capacity=1000, organizer_id=organizer.id)
+        db.session.add_all([event, other_event])
+        db.session.commit()
+        vip = PassType.query.filter_by(type_name='VIP').first()
+        participant = PassType.query.filter_by(type_name='Participant').first()
+        open_gate = Gate(event_id=event.id, gate_name='Main', gate_type='General', is_active=True)
+        vip_gate = Gate(event_id=event.id, gate_name='VIP Lounge', gate_type='VIP', is_active=True)
+        other_gate = Gate(event_id=other_event.id, gate_name='Annex', gate_type='General', is_active=True)
+        batch = TicketBatch(event_id=event.id, batch_name='Door', seat_count=100)
+        db.session.add_all([open_gate, vip_gate, other_gate, batch])
+        db.session.commit()
+        db.session.add(GateAccessRule(gate_id=vip_gate.id, pass_type_id=vip.id, can_access=True))
+        db.session.add(EventScannerAssignment(event_id=event.id, scanner_user_id=security.id,
+                                              gate_id=open_gate.id, assigned_by_user_id=organizer.id))
+        db.session.commit()
+        return {
+            'user_id': organizer.id, 'security_id': security.id,
+            'event_id': event.id, 'other_event_id': other_event.id,
+            'gate_id': open_gate.id, 'vip_gate_id': vip_gate.id, 'other_gate_id': other_gate.id,
+            'batch_id': batch.id, 'pass_type_id': participant.id, 'vip_pass_type_id': vip.id,
+        }
+
+
+@pytest.fixture(autouse=True)
+def _fresh_rate_limits():
+    # Buckets are process-wide; every test starts with full budgets.
+    scan_rate_limit._buckets.clear()
+    yield
+
+
+def login(user_id):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(user_id)
+        sess['_fresh'] = True
+    return client
+
+
+def make_pass(scan_event, pass_type_id=None, event_id=None, **fields):
+    """Issue a pass valid for a day and index it; returns its pass code."""
+    event_id = event_id or scan_event['event_id']
+    code = fields.pop('pass_code', None) or f'EVT{event_id:04d}-PAR-{uuid.uuid4().hex[:6].upper()}-1'
+    with app.app_context():
+        fields.setdefault('encrypted_data', code)
+        fields.setdefault('participant_name', 'Guest')
+        fields.setdefault('expires_at', datetime.utcnow() + timedelta(days=1))
+        event_pass = EventPass(event_id=event_id, pass_type_id=pass_type_id or scan_event['pass_type_id'],
+                               pass_code=code, **fields)
+        db.session.add(event_pass)
+        db.session.commit()
+        warm_credential_index()
+    return code
+
+
+def make_ticket(scan_event):
+    """Issue a batch ticket and index it; returns (ticket_id, ticket_code, barcode)."""
+    ticket_code = uuid.uuid4().hex[:8].upper()
+    barcode = f'TICKET-{scan_event["event_id"]}-{scan_event["batch_id"]}-{uuid.uuid4().hex[:10]}'
+    with app.app_context():
+        ticket = Ticket(batch_id=scan_event['batch_id'], ticket_code=ticket_code, barcode=barcode)
+        db.session.add(ticket)
+        db.session.commit()
+        ticket_id = ticket.id
+        warm_credential_index()
+    return ticket_id, ticket_code, barcode
@@ -61,7 +61,9 @@ CREATE TABLE IF NOT EXISTS event_passes (
     event_id INT NOT NULL,
     pass_type_id INT NOT NULL,
     pass_code VARCHAR(255) UNIQUE NOT NULL,
+    pass_code_key VARCHAR(255) NULL,
     encrypted_data TEXT NOT NULL,
+    encrypted_data_digest CHAR(64) NULL,
     participant_name VARCHAR(100) NOT NULL,
     participant_email VARCHAR(100),
     participant_phone VARCHAR(20),
@@ -74,6 +76,8 @@ CREATE TABLE IF NOT EXISTS event_passes (
     FOREIGN KEY (event_id) REFERENCES events(id) ON DELETE CASCADE,
     FOREIGN KEY (pass_type_id) REFERENCES pass_types(id),
     INDEX idx_pass_code (pass_code),
+    UNIQUE INDEX ix_event_passes_pass_code_key (pass_code_key),
+    INDEX ix_event_passes_encrypted_data_digest (encrypted_data_digest),
     INDEX idx_event (event_id),
     INDEX idx_participant_email (participant_email)
 );
@@ -136,6 +140,8 @@ CREATE TABLE IF NOT EXISTS tickets (
     batch_id INT NOT NULL,
     ticket_code VARCHAR(255) UNIQUE NOT NULL,
     barcode VARCHAR(255) UNIQUE NOT NULL,
+    ticket_code_key VARCHAR(255) NULL,
+    barcode_key VARCHAR(255) NULL,
     status ENUM('available', 'used', 'expired') DEFAULT 'available',
     promotion_id INT,
     price FLOAT DEFAULT 0.0,
@@ -145,7 +151,9 @@ CREATE TABLE IF NOT EXISTS tickets (
     FOREIGN KEY (batch_id) REFERENCES ticket_batches(id) ON DELETE CASCADE,
     FOREIGN KEY (promotion_id) REFERENCES promotions(id),
     INDEX idx_batch (batch_id),
-    INDEX idx_ticket_code (ticket_code)
+    INDEX idx_ticket_code (ticket_code),
+    UNIQUE INDEX ix_tickets_ticket_code_key (ticket_code_key),
+    UNIQUE INDEX ix_tickets_barcode_key (barcode_key)
 );
 
 -- System Settings Table
@@ -322,3 +330,77 @@ ADD COLUMN IF NOT EXISTS scanned_gate VARCHAR(100) AFTER scanned_by;
 ALTER TABLE tickets 
 ADD CONSTRAINT fk_tickets_ticket_type 
 FOREIGN KEY (ticket_type_id) REFERENCES ticket_types(id) ON DELETE SET NULL;
+
+-- Canonical (trimmed, uppercased) lookup keys for scanned codes
+ALTER TABLE event_passes
+ADD COLUMN IF NOT EXISTS pass_code_key VARCHAR(255) NULL AFTER pass_code;
+ALTER TABLE tickets
+ADD COLUMN IF NOT EXISTS ticket_code_key VARCHAR(255) NULL AFTER barcode,
+ADD COLUMN IF NOT EXISTS barcode_key VARCHAR(255) NULL AFTER ticket_code_key;
+
+UPDATE event_passes SET pass_code_key = UPPER(TRIM(pass_code)) WHERE pass_code_key IS NULL;
+UPDATE tickets SET ticket_code_key = UPPER(TRIM(ticket_code)) WHERE ticket_code_key IS NULL;
+UPDATE tickets SET barcode_key = UPPER(TRIM(barcode)) WHERE barcode_key IS NULL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS ix_event_passes_pass_code_key ON event_passes (pass_code_key);
+CREATE UNIQUE INDEX IF NOT EXISTS ix_tickets_ticket_code_key ON tickets (ticket_code_key);
+CREATE UNIQUE INDEX IF NOT EXISTS ix_tickets_barcode_key ON tickets (barcode_key);
+
+-- Indexed SHA-256 digest of encrypted_data for legacy payload lookups
+ALTER TABLE event_passes
+ADD COLUMN IF NOT EXISTS encrypted_data_digest CHAR(64) NULL AFTER encrypted_data;
+
+UPDATE event_passes SET encrypted_data_digest = SHA2(encrypted_data, 256) WHERE encrypted_data_digest IS NULL;
+
+CREATE INDEX IF NOT EXISTS ix_event_passes_encrypted_data_digest ON event_passes (encrypted_data_digest);
+
+-- Decoded legacy QR payloads (filled by migrate_legacy_payloads.py)
+CREATE TABLE IF NOT EXISTS legacy_pass_aliases (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    payload_digest CHAR(64) NOT NULL,
+    pass_id INT NOT NULL,
+    source ENUM('json', 'fernet') NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (pass_id) REFERENCES event_passes(id) ON DELETE CASCADE,
+    UNIQUE INDEX ix_legacy_pass_aliases_payload_digest (payload_digest),
+    INDEX ix_legacy_pass_aliases_pass_id (pass_id)
+);
+
+-- Change tracking for offline delta bundles (?since=<cursor>)
+ALTER TABLE event_passes
+ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP;
+ALTER TABLE tickets
+ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP;
+ALTER TABLE gates
+ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP;
+ALTER TABLE gate_access_rules
+ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP;
+
+UPDATE event_passes SET updated_at = COALESCE(created_at, CURRENT_TIMESTAMP) WHERE updated_at IS NULL;
+UPDATE tickets SET updated_at = COALESCE(scanned_at, created_at, CURRENT_TIMESTAMP) WHERE updated_at IS NULL;
+UPDATE gates SET updated_at = COALESCE(created_at, CURRENT_TIMESTAMP) WHERE updated_at IS NULL;
+UPDATE gate_access_rules SET updated_at = COALESCE(created_at, CURRENT_TIMESTAMP) WHERE updated_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS ix_event_passes_updated_at ON event_passes (updated_at);
+CREATE INDEX IF NOT EXISTS ix_tickets_updated_at ON tickets (updated_at);
+CREATE INDEX IF NOT EXISTS ix_gates_updated_at ON gates (updated_at);
+CREATE INDEX IF NOT EXISTS ix_gate_access_rules_updated_at ON gate_access_rules (updated_at);
+
+-- Offline sync uploads are staged in offline_validation_queue and drained in the background
+ALTER TABLE offline_validation_queue
+ADD COLUMN IF NOT EXISTS gate_access_granted BOOLEAN DEFAULT TRUE AFTER gate_id,
+ADD COLUMN IF NOT EXISTS gate_access_message TEXT AFTER gate_access_granted,
+ADD COLUMN IF NOT EXISTS ip_address VARCHAR(45) AFTER gate_access_message,
+ADD COLUMN IF NOT EXISTS upload_id VARCHAR(32) NULL,
+ADD COLUMN IF NOT EXISTS item_index INT NULL,
+ADD COLUMN IF NOT EXISTS uploaded_by INT NULL,
+ADD COLUMN IF NOT EXISTS attempts INT DEFAULT 0,
+ADD COLUMN IF NOT EXISTS last_error TEXT,
+ADD COLUMN IF NOT EXISTS claimed_by VARCHAR(32) NULL,
+ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP NULL;
+
+CREATE INDEX IF NOT EXISTS ix_offline_validation_queue_upload_id ON offline_validation_queue (upload_id);
+
+-- Code filter catch-up re-reads recently created passes and tickets
+CREATE INDEX IF NOT EXISTS ix_event_passes_created_at ON event_passes (created_at);
+CREATE INDEX IF NOT EXISTS ix_tickets_created_at ON tickets (created_at);
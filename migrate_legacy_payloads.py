@@ -0,0 +1,19 @@
+"""
+One-off job: decode legacy JSON / Fernet QR payloads into legacy_pass_aliases.
+
+    ENCRYPTION_KEY=... python migrate_legacy_payloads.py
+
+Afterwards set LEGACY_DECRYPT_FALLBACK=False to drop the per-scan decrypt path.
+"""
+from app import app
+from utils.legacy_payloads import load_legacy_cipher, migrate_legacy_payloads
+
+with app.app_context():
+    if load_legacy_cipher() is None:
+        print("ENCRYPTION_KEY not set: only plain JSON payloads will be migrated")
+    stats = migrate_legacy_payloads()
+    print(
+        f"Scanned {stats['scanned']} legacy payloads: {stats['aliases']} aliases created, "
+        f"{stats['existing']} already present, {stats['undecodable']} undecodable, "
+        f"{stats['unresolved']} pointing at missing passes"
+    )
@@ -1,6 +1,21 @@
 from database import db
 from flask_login import UserMixin
+from sqlalchemy.orm import validates
 from datetime import datetime
+import hashlib
+
+
+def canonical_code(value):
+    """Canonical lookup key for scanned pass/ticket codes (trimmed + uppercased)."""
+    value = (value or '').strip().upper()
+    return value or None
+
+
+def payload_digest(value):
+    """Fixed-width SHA-256 hex digest used to index long payloads (e.g. encrypted_data)."""
+    if value is None:
+        return None
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()
 
 
 # ================= USER MODEL =================
@@ -79,7 +94,9 @@ class EventPass(db.Model):
     pass_type_id = db.Column(db.Integer, db.ForeignKey('pass_types.id'), nullable=False)
 
     pass_code = db.Column(db.String(255), unique=True, nullable=False)
+    pass_code_key = db.Column(db.String(255), unique=True, index=True)  # canonical_code(pass_code)
     encrypted_data = db.Column(db.Text, nullable=False)
+    encrypted_data_digest = db.Column(db.String(64), index=True)  # payload_digest(encrypted_data)
 
     participant_name = db.Column(db.String(100), nullable=False)
     participant_email = db.Column(db.String(100))
@@ -91,22 +108,54 @@ class EventPass(db.Model):
     is_validated = db.Column(db.Boolean, default=False)
     validation_count = db.Column(db.Integer, default=0)
 
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # code filter catch-up
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)  # offline delta cursor
     expires_at = db.Column(db.DateTime)
 
     validation_logs = db.relationship('ValidationLog', backref='pass_obj', lazy=True, cascade='all, delete-orphan')
 
+    @validates('pass_code')
+    def _sync_pass_code_key(self, key, value):
+        self.pass_code_key = canonical_code(value)
+        return value
+
+    @validates('encrypted_data')
+    def _sync_encrypted_data_digest(self, key, value):
+        self.encrypted_data_digest = payload_digest(value)
+        return value
+
     def __repr__(self):
         return f'<EventPass {self.pass_code}>'
 
 
+# ================= LEGACY PASS ALIAS =================
+
+class LegacyPassAlias(db.Model):
+    """Digest of a decoded legacy QR payload (plain JSON / Fernet) -> pass it resolves to."""
+    __tablename__ = 'legacy_pass_aliases'
+
+    id = db.Column(db.Integer, primary_key=True)
+    payload_digest = db.Column(db.String(64), unique=True, nullable=False, index=True)
+    pass_id = db.Column(db.Integer, db.ForeignKey('event_passes.id'), nullable=False, index=True)
+    source = db.Column(db.Enum('json', 'fernet', name='legacy_payload_sources'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    pass_obj = db.relationship(
+        'EventPass',
+        backref=db.backref('legacy_aliases', lazy=True, cascade='all, delete-orphan')
+    )
+
+    def __repr__(self):
+        return f'<LegacyPassAlias {self.source} -> {self.pass_id}>'
+
+
 # ================= VALIDATION LOG =================
 
 class ValidationLog(db.Model):
     __tablename__ = 'validation_logs'
 
     id = db.Column(db.Integer, primary_key=True)
-    pass_id = db.Column(db.Integer, db.ForeignKey('event_passes.id'), nullable=False)
+    pass_id = db.Column(db.Integer, db.ForeignKey('event_passes.id'), nullable=False, index=True)
     validator_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
 
     validation_time = db.Column(db.DateTime, default=datetime.utcnow)
@@ -196,6 +245,7 @@ class TicketBatch(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     tickets = db.relationship('Ticket', backref='batch', lazy=True)
+    event = db.relationship('Event', lazy=True)
     
     def __repr__(self):
         return f'<TicketBatch {self.batch_name}>'
@@ -228,12 +278,20 @@ class Ticket(db.Model):
     batch_id = db.Column(db.Integer, db.ForeignKey('ticket_batches.id'), nullable=False)
     ticket_code = db.Column(db.String(255), unique=True, nullable=False)
     barcode = db.Column(db.String(255), unique=True, nullable=False)
+    ticket_code_key = db.Column(db.String(255), unique=True, index=True)  # canonical_code(ticket_code)
+    barcode_key = db.Column(db.String(255), unique=True, index=True)  # canonical_code(barcode)
     status = db.Column(db.Enum('available', 'used', 'expired', name='ticket_status'), default='available')
     promotion_id = db.Column(db.Integer, db.ForeignKey('promotions.id'))
     price = db.Column(db.Float, default=0.0)
     scanned_by = db.Column(db.String(100))
     scanned_at = db.Column(db.DateTime)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # code filter catch-up
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)  # offline delta cursor
+
+    @validates('ticket_code', 'barcode')
+    def _sync_code_keys(self, key, value):
+        setattr(self, f'{key}_key', canonical_code(value))
+        return value
     
     def __repr__(self):
         return f'<Ticket {self.ticket_code}>'
@@ -250,6 +308,7 @@ class Gate(db.Model):
     gate_description = db.Column(db.Text)
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)  # offline delta cursor
     
     access_rules = db.relationship('GateAccessRule', backref='gate', lazy=True, cascade='all, delete-orphan')
     validation_logs = db.relationship('GateValidationLog', backref='gate', lazy=True, cascade='all, delete-orphan')
@@ -267,6 +326,7 @@ class GateAccessRule(db.Model):
     pass_type_id = db.Column(db.Integer, db.ForeignKey('pass_types.id'), nullable=False)
     can_access = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)  # offline delta cursor
 
     # Enables template access like rule.pass_type.type_name
     pass_type = db.relationship('PassType', backref=db.backref('gate_rules', lazy=True))
@@ -391,10 +451,22 @@ class OfflineValidationQueue(db.Model):
     validation_status = db.Column(db.Enum('success', 'failed', 'duplicate', name='offline_validation_status'), nullable=False)
     validation_message = db.Column(db.Text)
     gate_id = db.Column(db.Integer)
+    gate_access_granted = db.Column(db.Boolean, default=True)
+    gate_access_message = db.Column(db.Text)
+    ip_address = db.Column(db.String(45))
     validation_time = db.Column(db.DateTime, nullable=False)
-    sync_status = db.Column(db.Enum('pending', 'synced', 'failed', name='sync_status'), default='pending')
+    sync_status = db.Column(db.Enum('pending', 'synced', 'failed', name='sync_status'), default='pending', index=True)
     synced_at = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Upload bookkeeping for the background drain (utils/offline_queue.py)
+    upload_id = db.Column(db.String(32), index=True)
+    item_index = db.Column(db.Integer)
+    uploaded_by = db.Column(db.Integer)
+    attempts = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.Text)
+    claimed_by = db.Column(db.String(32))
+    claimed_at = db.Column(db.DateTime)
     
     def __repr__(self):
         return f'<OfflineValidationQueue {self.pass_code} - {self.sync_status}>'
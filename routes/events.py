@@ -5,6 +5,9 @@ from models import Event, EventPass, User, Gate, EventScannerAssignment, EventSc
 from datetime import datetime, timedelta
 from typing import Optional
 from utils.capacity import get_event_capacity_snapshot
+from utils.credential_index import drop_event as drop_event_credentials, index_event as index_event_credentials
+from utils.scanner_access import invalidate_gate_scope
+from utils.gate_sessions import revoke_gate_sessions
 
 events_bp = Blueprint('events', __name__)
 
@@ -215,12 +218,17 @@ def delete_event(event_id):
             event.status = "cancelled"
             event.event_description = mark_deleted_description(event.event_description, now)
             db.session.commit()
+            drop_event_credentials(event_id)
+            revoke_gate_sessions(event_id=event_id)
 
             flash(f'Event moved to Recycle Bin (has {pass_count} passes). You can restore within 30 days.', 'warning')
             return redirect(url_for('dashboard.events'))
 
         db.session.delete(event)
         db.session.commit()
+        drop_event_credentials(event_id)
+        invalidate_gate_scope(event_id=event_id)
+        revoke_gate_sessions(event_id=event_id)
 
         flash('Event deleted permanently (no passes existed).', 'success')
         return redirect(url_for('dashboard.events'))
@@ -278,6 +286,7 @@ def restore_event(event_id):
         event.status = "active"
         event.event_description = remove_deleted_marker(event.event_description)
         db.session.commit()
+        index_event_credentials(event_id)
 
         flash('Event restored successfully!', 'success')
         return redirect(url_for('dashboard.events'))
@@ -304,6 +313,9 @@ def purge_event(event_id):
 
         db.session.delete(event)
         db.session.commit()
+        drop_event_credentials(event_id)
+        invalidate_gate_scope(event_id=event_id)
+        revoke_gate_sessions(event_id=event_id)
 
         flash('Event permanently deleted.', 'success')
         return redirect(url_for('events.recycle_bin'))
@@ -519,8 +531,11 @@ def remove_scanner_assignment(event_id, assignment_id):
         flash('Assignment does not belong to this event.', 'danger')
         return redirect(url_for('events.manage_scanners', event_id=event_id))
 
+    scanner_user_id = assignment.scanner_user_id
     db.session.delete(assignment)
     db.session.commit()
+    invalidate_gate_scope(user_id=scanner_user_id, event_id=event_id)
+    revoke_gate_sessions(user_id=scanner_user_id, event_id=event_id)
     flash('Scanner assignment removed.', 'success')
     return redirect(url_for('events.manage_scanners', event_id=event_id))
 
@@ -631,6 +646,7 @@ def accept_scanner_invite(invite_id):
     invite.status = 'accepted'
     invite.responded_at = datetime.utcnow()
     db.session.commit()
+    invalidate_gate_scope(user_id=current_user.id, event_id=invite.event_id)
 
     flash('Scanner invite accepted. You now have scanning access for the assigned scope.', 'success')
     return redirect(url_for('events.my_scanner_invites'))
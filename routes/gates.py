@@ -1,15 +1,28 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, make_response
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, make_response, Response
 from database import db
 from models import (
     Event, Gate, GateAccessRule, PassType,
-    EventPass, ValidationLog, GateValidationLog,
+    EventPass,
     TicketGateValidationLog,
     EventScannerAssignment, EventScannerInvite, OfflineValidationQueue, RealtimeAlert, DuplicateAlertSetting
 )
 from flask_login import login_required, current_user
 from datetime import datetime
 import json
-from utils.scanner_access import get_scannable_active_gates
+import math
+from utils.scanner_access import get_scannable_active_gates, invalidate_gate_scope, user_can_scan_event
+from utils.gate_access import get_gate_access, refresh_gate, forget_gate
+from utils.live_feed import alert_payload, publish_alert_acknowledged, subscribe, stream
+from utils.duplicate_detector import invalidate_duplicate_settings
+from utils.gate_sessions import revoke_gate_sessions
+from utils.offline_sync import OFFLINE_SYNC_MAX_ITEMS
+from utils.offline_queue import (
+    drain_offline_queue, enqueue_offline_upload, offline_upload_status, offline_worker_enabled
+)
+from utils.consumed_feed import CONSUMED_FEED_MAX_WAIT_SECONDS, CONSUMED_FEED_POLL_SECONDS, poll_consumed
+from utils.offline_bundle import (
+    OFFLINE_BUNDLE_FORMATS, build_offline_bundle, build_offline_delta, offline_cursor, ticket_hash_set
+)
 
 bp = Blueprint('gates', __name__, url_prefix='/gates')
 
@@ -168,7 +181,9 @@ def create_gate(event_id):
         )
         db.session.add(rule)
 
+    gate_id = gate.id
     db.session.commit()
+    refresh_gate(gate_id)
     flash(f'Gate "{gate.gate_name}" created successfully!', 'success')
     return redirect(url_for('gates.event_gates', event_id=event_id))
 
@@ -210,6 +225,7 @@ def update_gate(gate_id):
     gate.gate_type = gate_type
     gate.gate_description = request.form.get('gate_description')
     gate.is_active = (request.form.get('is_active') == 'on')
+    gate_deactivated = not gate.is_active
 
     # Update access rules
     GateAccessRule.query.filter_by(gate_id=gate_id).delete()
@@ -234,6 +250,9 @@ def update_gate(gate_id):
         db.session.add(rule)
 
     db.session.commit()
+    refresh_gate(gate_id)
+    if gate_deactivated:
+        revoke_gate_sessions(gate_id=gate_id)
     flash(f'Gate "{gate.gate_name}" updated successfully!', 'success')
     return redirect(url_for('gates.event_gates', event_id=gate.event_id))
 
@@ -256,6 +275,9 @@ def delete_gate(gate_id):
     EventScannerAssignment.query.filter_by(gate_id=gate_id).delete(synchronize_session=False)
     db.session.delete(gate)
     db.session.commit()
+    forget_gate(gate_id)
+    invalidate_gate_scope(event_id=event_id)
+    revoke_gate_sessions(gate_id=gate_id)
 
     flash(f'Gate "{gate.gate_name}" deleted successfully!', 'success')
     return redirect(url_for('gates.event_gates', event_id=event_id))
@@ -264,11 +286,13 @@ def delete_gate(gate_id):
 @bp.route('/api/check-access/<int:gate_id>/<int:pass_type_id>')
 @login_required
 def check_gate_access(gate_id, pass_type_id):
-    """Check if a pass type can access a gate"""
-    rule = GateAccessRule.query.filter_by(gate_id=gate_id, pass_type_id=pass_type_id).first()
+    """Check if a pass type can access a gate (same compiled rules as the scanner)"""
+    gate_access = get_gate_access(gate_id)
+    can_access = bool(gate_access and gate_access.check(pass_type_id)[0])
 
     return jsonify({
-        'can_access': rule.can_access if rule else False,
+        'can_access': can_access,
+        'unrestricted': bool(gate_access and gate_access.unrestricted),
         'gate_id': gate_id,
         'pass_type_id': pass_type_id
     })
@@ -286,6 +310,23 @@ def download_offline_database(event_id):
     if current_user.role != 'admin' and event.organizer_id != current_user.id:
         return make_response("Not authorized", 403)
 
+    # Taken before any reads: the next ?since= starts here (minus the overlap window).
+    cursor = offline_cursor()
+
+    # ?format=columnar|sqlite: compact gzipped bundle; default stays the legacy JSON.
+    bundle_format = (request.args.get('format') or 'json').lower()
+    if bundle_format not in OFFLINE_BUNDLE_FORMATS and bundle_format != 'json':
+        return jsonify({
+            'success': False,
+            'message': f"Unknown format. Use one of: json, {', '.join(OFFLINE_BUNDLE_FORMATS)}"
+        }), 400
+
+    since = request.args.get('since')
+    if since is not None:
+        return _offline_delta_response(event, since, cursor, bundle_format)
+    if bundle_format in OFFLINE_BUNDLE_FORMATS:
+        return _offline_bundle_response(event, bundle_format, cursor)
+
     passes = EventPass.query.filter_by(event_id=event_id).all()
     gates = Gate.query.filter_by(event_id=event_id).all()
 
@@ -300,7 +341,9 @@ def download_offline_database(event_id):
         'passes': [],
         'gates': [],
         'pass_types': {},
-        'download_time': datetime.utcnow().isoformat()
+        'tickets': ticket_hash_set(event_id),
+        'download_time': datetime.utcnow().isoformat(),
+        'cursor': cursor
     }
 
     for pass_obj in passes:
@@ -333,68 +376,155 @@ def download_offline_database(event_id):
         f'attachment; filename=offline_db_event_{event_id}_{datetime.now().strftime("%Y%m%d%H%M%S")}.json'
     )
     response.headers['Content-Type'] = 'application/json'
+    response.headers['X-Offline-Cursor'] = str(cursor)
 
     return response
 
 
+def _offline_bundle_response(event, bundle_format, cursor):
+    body, content_hash, filename = build_offline_bundle(event, bundle_format)
+    etag = f'"{content_hash}"'
+    if etag in request.headers.get('If-None-Match', ''):
+        response = make_response('', 304)
+    else:
+        response = make_response(body)
+        response.headers['Content-Type'] = 'application/gzip'
+        response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    response.headers['ETag'] = etag
+    response.headers['X-Content-SHA256'] = content_hash
+    response.headers['X-Bundle-Generated-At'] = datetime.utcnow().isoformat()
+    # Kept out of the body so unchanged data keeps its ETag.
+    response.headers['X-Offline-Cursor'] = str(cursor)
+    return response
+
+
+def _offline_delta_response(event, since, cursor, bundle_format):
+    if bundle_format == 'sqlite':
+        return jsonify({'success': False, 'message': 'since is not supported for sqlite bundles; use json or columnar'}), 400
+    try:
+        body, content_type = build_offline_delta(event, since, cursor, bundle_format)
+    except (ValueError, OverflowError):
+        return jsonify({'success': False, 'message': 'since must be a cursor from a previous download'}), 400
+
+    response = make_response(body)
+    response.headers['Content-Type'] = content_type
+    response.headers['X-Offline-Cursor'] = str(cursor)
+    return response
+
+
 @bp.route('/offline/sync', methods=['POST'])
 @login_required
 def sync_offline_validations():
-    """Sync offline validation logs back to server"""
-    data = request.get_json()
+    """
+    Sync offline validation logs and return per-item results. Clients may opt in
+    to an async response (?async=1 or Prefer: respond-async): if a background
+    worker is running, the upload is only staged and 202 returns its status_url.
+    """
+    data = request.get_json(silent=True)
 
-    if not data or 'validations' not in data:
+    if not data or not isinstance(data.get('validations'), list):
         return jsonify({'success': False, 'message': 'No validation data provided'}), 400
 
-    synced_count = 0
-    failed_count = 0
-
-    for validation_data in data['validations']:
-        try:
-            pass_obj = EventPass.query.filter_by(pass_code=validation_data['pass_code']).first()
-
-            if not pass_obj:
-                failed_count += 1
-                continue
-
-            validation_log = ValidationLog(
-                pass_id=pass_obj.id,
-                validator_id=validation_data.get('validator_id', current_user.id),
-                validation_time=datetime.fromisoformat(validation_data['validation_time']),
-                validation_status=validation_data['validation_status'],
-                validation_message=validation_data.get('validation_message'),
-                ip_address=validation_data.get('ip_address', request.remote_addr)
-            )
-            db.session.add(validation_log)
-            db.session.flush()
-
-            if 'gate_id' in validation_data:
-                gate_log = GateValidationLog(
-                    validation_log_id=validation_log.id,
-                    gate_id=validation_data['gate_id'],
-                    gate_access_granted=validation_data.get('gate_access_granted', True),
-                    gate_access_message=validation_data.get('gate_access_message')
-                )
-                db.session.add(gate_log)
-
-            if validation_data['validation_status'] == 'success':
-                pass_obj.is_validated = True
-                pass_obj.validation_count += 1
-
-            synced_count += 1
-
-        except Exception as e:
-            failed_count += 1
-            print(f"Error syncing validation: {str(e)}")
-
-    db.session.commit()
+    validations = data['validations']
+    if len(validations) > OFFLINE_SYNC_MAX_ITEMS:
+        return jsonify({
+            'success': False,
+            'message': f'Too many validations in one upload (max {OFFLINE_SYNC_MAX_ITEMS})'
+        }), 413
+
+    wants_async = request.args.get('async') == '1' or 'respond-async' in request.headers.get('Prefer', '')
+    inline = not (wants_async and offline_worker_enabled())
+    upload_id, results = enqueue_offline_upload(
+        validations, current_user.id, request.remote_addr, wake=not inline
+    )
+    status_url = url_for('gates.offline_sync_status', upload_id=upload_id)
+
+    if not inline:
+        rejected = [r for r in results if r is not None]
+        return jsonify({
+            'success': True,
+            'upload_id': upload_id,
+            'queued': len(validations) - len(rejected),
+            'rejected': len(rejected),
+            'results': rejected,
+            'status_url': status_url,
+            'message': f'Queued {len(validations) - len(rejected)} validations for sync'
+        }), 202
+
+    while True:
+        drained = drain_offline_queue(upload_id=upload_id)
+        if not drained:
+            break
+        for result in drained.values():
+            results[result['index']] = result
+    for index, result in enumerate(results):
+        if result is None:
+            # Picked up by another worker meanwhile; see status_url.
+            results[index] = {'index': index, 'status': 'queued'}
+
+    synced_count = sum(1 for r in results if r['status'] == 'synced')
+    duplicate_count = sum(1 for r in results if r['status'] == 'duplicate')
+    queued_count = sum(1 for r in results if r['status'] == 'queued')
+    failed_count = len(results) - synced_count - duplicate_count - queued_count
 
     return jsonify({
         'success': True,
+        'upload_id': upload_id,
         'synced': synced_count,
+        'duplicates': duplicate_count,
         'failed': failed_count,
-        'message': f'Synced {synced_count} validations, {failed_count} failed'
+        'queued': queued_count,
+        'status_url': status_url,
+        'message': f'Synced {synced_count} validations, {duplicate_count} duplicates, {failed_count} failed',
+        'results': results
+    })
+
+
+@bp.route('/offline/sync/<upload_id>', methods=['GET'])
+@login_required
+def offline_sync_status(upload_id):
+    """Progress of a staged offline upload"""
+    status = offline_upload_status(upload_id)
+    if status is None:
+        return jsonify({'success': False, 'message': 'Unknown upload'}), 404
+    if current_user.role != 'admin' and status['uploaded_by'] != current_user.id:
+        return jsonify({'success': False, 'message': 'Not authorized'}), 403
+
+    return jsonify(dict(status, success=True))
+
+
+@bp.route('/offline/consumed/<int:event_id>', methods=['GET'])
+@login_required
+def consumed_feed(event_id):
+    """
+    Long-poll for passes and tickets consumed since ?since=<cursor> (from the
+    offline download or the previous poll), waiting up to ?timeout= seconds.
+    """
+    event = Event.query.get_or_404(event_id)
+    if not user_can_scan_event(current_user, event):
+        return jsonify({'success': False, 'message': 'Not authorized for this event'}), 403
+
+    since = request.args.get('since')
+    try:
+        timeout = float(request.args.get('timeout', CONSUMED_FEED_MAX_WAIT_SECONDS))
+        cursor, pass_ids, tickets, busy = poll_consumed(event_id, since, timeout)
+    except (TypeError, ValueError, OverflowError):
+        return jsonify({'success': False, 'message': 'since must be a cursor and timeout a number of seconds'}), 400
+
+    response = jsonify({
+        'success': True,
+        'event_id': event_id,
+        'since': int(since),
+        'cursor': cursor,
+        'passes': pass_ids,
+        'tickets': tickets,
     })
+    response.headers['X-Offline-Cursor'] = str(cursor)
+    response.headers['Cache-Control'] = 'no-store'
+    if busy:
+        # Answered without waiting: ask the client not to re-poll straight away.
+        response.headers['Retry-After'] = str(max(1, math.ceil(CONSUMED_FEED_POLL_SECONDS)))
+    return response
 
 
 # =========================
@@ -408,21 +538,30 @@ def get_alerts(event_id):
         is_acknowledged=False
     ).order_by(RealtimeAlert.created_at.desc()).limit(50).all()
 
-    alert_list = []
-    for alert in alerts:
-        alert_list.append({
-            'id': alert.id,
-            'type': alert.alert_type,
-            'message': alert.alert_message,
-            'severity': alert.severity,
-            'created_at': alert.created_at.isoformat(),
-            'pass_id': alert.pass_id,
-            'gate_id': alert.gate_id
-        })
+    alert_list = [alert_payload(alert) for alert in alerts]
 
     return jsonify({'alerts': alert_list})
 
 
+@bp.route('/alerts/<int:event_id>/stream')
+@login_required
+def stream_alerts(event_id):
+    """Server-sent events: new alerts, acknowledgements and scan outcomes of an event."""
+    event = Event.query.get_or_404(event_id)
+    if not user_can_scan_event(current_user, event):
+        return jsonify({'success': False, 'message': 'Not authorized for this event'}), 403
+
+    q = subscribe(event_id)
+    if q is None:
+        # Too many open streams in this worker; the dashboard falls back to polling.
+        return jsonify({'success': False, 'message': 'Live feed is at capacity'}), 503
+
+    return Response(stream(event_id, q), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+
 @bp.route('/alerts/acknowledge/<int:alert_id>', methods=['POST'])
 @login_required
 def acknowledge_alert(alert_id):
@@ -431,8 +570,10 @@ def acknowledge_alert(alert_id):
     alert.is_acknowledged = True
     alert.acknowledged_by = current_user.id
     alert.acknowledged_at = datetime.utcnow()
+    event_id = alert.event_id
 
     db.session.commit()
+    publish_alert_acknowledged(event_id, alert_id, current_user.id)
 
     return jsonify({'success': True, 'message': 'Alert acknowledged'})
 
@@ -487,5 +628,6 @@ def update_duplicate_settings(event_id):
     settings.notification_method = data.get('notification_method', 'dashboard')
 
     db.session.commit()
+    invalidate_duplicate_settings(event_id)
 
     return jsonify({'success': True, 'message': 'Settings updated'})
@@ -5,6 +5,8 @@ from database import db
 from utils.qr_generator import create_event_pass_qr, generate_pass_code
 from utils.barcode_generator import create_event_pass_barcode
 from utils.capacity import get_event_capacity_snapshot
+from utils.credential_index import pass_entries, register as register_credentials
+from utils.pass_tokens import signed_tokens_enabled, issue_pass_token
 import os
 import shutil
 from datetime import datetime, timedelta
@@ -180,13 +182,17 @@ def generate_pass():
                 if quantity > 1 else participant_name
             )
 
-            # ✅ Generate QR code that contains ONLY pass_code
-            qr_path, qr_payload = create_event_pass_qr(
-                pass_code,
-                event.event_name,
-                display_name,
-                pass_type.type_name
-            )
+            if signed_tokens_enabled():
+                # Signed tokens need the pass id: the QR is generated after flush below.
+                qr_path, qr_payload = None, pass_code
+            else:
+                # ✅ Generate QR code that contains ONLY pass_code
+                qr_path, qr_payload = create_event_pass_qr(
+                    pass_code,
+                    event.event_name,
+                    display_name,
+                    pass_type.type_name
+                )
 
             # ✅ Store qr_payload into encrypted_data for backward compatibility
             encrypted_data = qr_payload
@@ -218,7 +224,21 @@ def generate_pass():
             db.session.add(new_pass)
             generated_passes.append(new_pass)
 
+        db.session.flush()
+        if signed_tokens_enabled():
+            for new_pass in generated_passes:
+                # encrypted_data holds the QR payload, so the token resolves like any legacy payload
+                new_pass.qr_code_path, new_pass.encrypted_data = create_event_pass_qr(
+                    new_pass.pass_code,
+                    event.event_name,
+                    new_pass.participant_name,
+                    pass_type.type_name,
+                    payload=issue_pass_token(new_pass)
+                )
+            db.session.flush()
+        credential_entries = pass_entries(generated_passes)
         db.session.commit()
+        register_credentials(credential_entries)
 
         # -------------------------
         # Update Analytics
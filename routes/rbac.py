@@ -6,6 +6,12 @@ from models import (
     EventScannerAssignment, EventScannerInvite, TicketGateValidationLog
 )
 from utils.decorators import admin_only, organizer_or_admin
+from utils.scanner_access import invalidate_gate_scope
+from utils.gate_sessions import revoke_gate_sessions
+from utils.scan_log_writer import scan_log_pipeline_stats
+from utils.code_filter import code_filter_stats
+from utils.scan_metrics import scan_latency_stats
+from utils.scan_rate_limit import scan_rate_limit_stats
 from flask_bcrypt import Bcrypt
 from datetime import datetime, timedelta
 import os
@@ -183,8 +189,12 @@ def delete_user(user_id):
         (EventScannerInvite.invitee_user_id == user.id)
     ).delete(synchronize_session=False)
     TicketGateValidationLog.query.filter_by(validator_id=user.id).delete(synchronize_session=False)
+    deleted_user_id = user.id
     db.session.delete(user)
     db.session.commit()
+    # Assignments created by this user were removed too, so other scanners' scopes changed.
+    invalidate_gate_scope()
+    revoke_gate_sessions(user_id=deleted_user_id)
     flash(f'User "{username}" has been deleted.', 'success')
     return redirect(url_for('rbac.manage_users'))
 
@@ -255,3 +265,28 @@ def api_tickets_summary():
         'available': available,
         'expired': expired,
     })
+
+@rbac_bp.route('/api/scan-log-pipeline', methods=['GET'])
+@admin_only
+def api_scan_log_pipeline():
+    """Write-behind scan log pipeline metrics (queue depth, throughput, failures)."""
+    return jsonify(scan_log_pipeline_stats())
+
+@rbac_bp.route('/api/code-filter', methods=['GET'])
+@admin_only
+def api_code_filter():
+    """Unknown-code filter metrics (size, rejected scans, catch-ups)."""
+    return jsonify(code_filter_stats())
+
+@rbac_bp.route('/api/scan-latency', methods=['GET'])
+@admin_only
+def api_scan_latency():
+    """Per-gate scan stage latency percentiles (p50/p95/p99) over the rolling window."""
+    return jsonify(scan_latency_stats())
+
+
+@rbac_bp.route('/api/scan-rate-limit', methods=['GET'])
+@admin_only
+def api_scan_rate_limit():
+    """Scan rate limiter budgets and throttling counters for this worker."""
+    return jsonify(scan_rate_limit_stats())
@@ -1,9 +1,17 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app, make_response
 from flask_login import login_required, current_user
-from models import Event, TicketBatch, Ticket, Promotion
+from models import canonical_code, Event, TicketBatch, Ticket, Promotion
+from sqlalchemy.orm import joinedload
 from database import db
 from utils.barcode_generator import create_event_pass_barcode
 from utils.capacity import get_event_capacity_snapshot
+from utils.credential_index import ticket_entries, register as register_credentials
+from utils.code_filter import code_may_exist
+from utils.duplicate_detector import record_scan_attempt
+from utils.live_feed import release_staged_publishes, discard_staged_publishes, stage_consumed
+from utils.ticket_consumption import consume_ticket
+from utils.replay_cache import scan_idempotency_key, claim_replay, remember_replay, settle_replay
+from utils.scan_rate_limit import check_scan_rate, record_scan_outcome, throttled_body
 from utils.scanner_access import (
     get_scannable_active_events,
     user_can_scan_event,
@@ -13,7 +21,6 @@ import secrets
 import string
 import os
 import shutil
-from datetime import datetime
 
 
 tickets_bp = Blueprint('tickets', __name__, url_prefix='/tickets')
@@ -28,7 +35,7 @@ def generate_ticket_code(length=8):
 def _event_for_ticket(ticket: Ticket):
     if not ticket or not ticket.batch:
         return None
-    return Event.query.get(ticket.batch.event_id)
+    return ticket.batch.event
 
 
 def _can_manage_event(event: Event):
@@ -121,6 +128,7 @@ def create_batch(event_id):
             db.session.add(batch)
             db.session.flush()  # get batch.id
 
+            new_tickets = []
             for i in range(seat_count):
                 ticket_code = generate_ticket_code()
                 barcode = f"TICKET-{event_id}-{batch.id}-{i + 1}"
@@ -140,8 +148,12 @@ def create_batch(event_id):
                     price=price
                 )
                 db.session.add(ticket)
+                new_tickets.append(ticket)
 
+            db.session.flush()
+            credential_entries = ticket_entries(new_tickets, event_id)
             db.session.commit()
+            register_credentials(credential_entries)
             flash(f'Batch created successfully with {seat_count} tickets!', 'success')
             return redirect(url_for('tickets.list_tickets', event_id=event_id))
 
@@ -205,34 +217,36 @@ def scan_ticket(ticket_id):
                 'message': 'Your scanner assignment is gate-specific. Use Validate Pass page and choose your assigned gate.'
             }), 403
 
-        if ticket.status == 'used':
+        consumed = ticket.status not in ('used', 'expired') and consume_ticket(ticket, current_user.username)
+
+        if not consumed and ticket.status != 'expired':
             return jsonify({
                 'success': False,
                 'message': 'Ticket already used',
                 'scanned_at': ticket.scanned_at.strftime('%Y-%m-%d %H:%M:%S') if ticket.scanned_at else None
             })
 
-        if ticket.status == 'expired':
+        if not consumed:
             return jsonify({
                 'success': False,
                 'message': 'Ticket has expired'
             })
 
-        ticket.status = 'used'
-        ticket.scanned_by = current_user.username
-        ticket.scanned_at = datetime.utcnow()
-
+        ticket_code = ticket.ticket_code
+        stage_consumed(event.id)
         db.session.commit()
+        release_staged_publishes()
 
         return jsonify({
             'success': True,
             'message': 'Ticket validated successfully',
-            'ticket_code': ticket.ticket_code,
+            'ticket_code': ticket_code,
             'scanned_by': current_user.username
         })
 
     except Exception as e:
         db.session.rollback()
+        discard_staged_publishes()
         return jsonify({
             'success': False,
             'message': f'Error scanning ticket: {str(e)}'
@@ -243,6 +257,32 @@ def scan_ticket(ticket_id):
 @login_required
 def scan_by_code():
     """Scan ticket by ticket code or barcode"""
+    user_id = current_user.id
+    retry_after = check_scan_rate(user_id)
+    if retry_after is not None:
+        body, headers = throttled_body(retry_after)
+        return jsonify(body), 429, headers
+
+    data = request.get_json(silent=True) if request.is_json else None
+    replay_key = scan_idempotency_key(data) if isinstance(data, dict) else None
+    if replay_key:
+        replayed, claimed = claim_replay(user_id, 'ticket_scan', replay_key)
+        if replayed:
+            body, status_code = replayed
+            return jsonify(dict(body, replayed=True)), status_code
+    else:
+        claimed = False
+
+    try:
+        response = make_response(_scan_by_code(user_id, replay_key))
+        record_scan_outcome(user_id, response.status_code)
+        return response
+    finally:
+        if claimed:
+            settle_replay(user_id, 'ticket_scan', replay_key)
+
+
+def _scan_by_code(user_id, replay_key=None):
     try:
         if not request.is_json:
             return jsonify({'success': False, 'message': 'Invalid JSON request'}), 400
@@ -252,12 +292,13 @@ def scan_by_code():
         if not code:
             return jsonify({'success': False, 'message': 'Code is required'}), 400
 
-        upper_code = code.upper()
-        ticket = Ticket.query.filter(
-            (Ticket.ticket_code == code) |
-            (Ticket.ticket_code == upper_code) |
-            (Ticket.barcode == code) |
-            (Ticket.barcode == upper_code)
+        if not code_may_exist(code):
+            return jsonify({'success': False, 'message': 'Ticket not found'}), 404
+
+        code_key = canonical_code(code)
+        ticket = Ticket.query.options(joinedload(Ticket.batch).joinedload(TicketBatch.event)).filter(
+            (Ticket.ticket_code_key == code_key) |
+            (Ticket.barcode_key == code_key)
         ).first()
 
         if not ticket:
@@ -293,33 +334,43 @@ def scan_by_code():
                 'message': 'Your scanner assignment is gate-specific. Use Validate Pass page and choose your assigned gate.'
             }), 403
 
-        if ticket.status == 'used':
-            return jsonify({
+        consumed = ticket.status not in ('used', 'expired') and consume_ticket(ticket, current_user.username)
+        if event:
+            record_scan_attempt(
+                event.id, 'ticket', ticket.id, None, consumed, ticket.status == 'used', f'Ticket {ticket.ticket_code}'
+            )
+            if consumed:
+                stage_consumed(event.id)
+
+        if not consumed and ticket.status != 'expired':
+            body = {
                 'success': False,
                 'message': 'Ticket already used',
                 'scanned_at': ticket.scanned_at.strftime('%Y-%m-%d %H:%M:%S') if ticket.scanned_at else None,
                 'scanned_by': ticket.scanned_by
-            })
-
-        if ticket.status == 'expired':
-            return jsonify({'success': False, 'message': 'Ticket has expired'})
-
-        ticket.status = 'used'
-        ticket.scanned_by = current_user.username
-        ticket.scanned_at = datetime.utcnow()
-
+            }
+        elif not consumed:
+            body = {'success': False, 'message': 'Ticket has expired'}
+        else:
+            body = {
+                'success': True,
+                'message': 'Ticket validated successfully',
+                'ticket_code': ticket.ticket_code,
+                'price': ticket.price,
+                'scanned_by': current_user.username
+            }
+
+        # Commits the consumed state and any duplicate_entry alert raised above.
         db.session.commit()
+        release_staged_publishes()
+        if replay_key:
+            remember_replay(user_id, 'ticket_scan', replay_key, body, 200)
 
-        return jsonify({
-            'success': True,
-            'message': 'Ticket validated successfully',
-            'ticket_code': ticket.ticket_code,
-            'price': ticket.price,
-            'scanned_by': current_user.username
-        })
+        return jsonify(body)
 
     except Exception as e:
         db.session.rollback()
+        discard_staged_publishes()
         return jsonify({
             'success': False,
             'message': f'Error: {str(e)}'
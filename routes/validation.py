@@ -2,29 +2,44 @@ from flask import Blueprint, render_template, request, jsonify
 from flask_login import login_required, current_user
 from database import db
 from models import (
-    Event, EventPass, ValidationLog, Ticket,
-    Gate, GateAccessRule, GateValidationLog, TicketGateValidationLog
+    canonical_code, payload_digest, Event, EventPass, LegacyPassAlias, ValidationLog, Ticket, TicketBatch,
+    Gate, GateValidationLog, TicketGateValidationLog
 )
-from datetime import datetime
+from datetime import datetime, timezone
+from sqlalchemy.orm import joinedload
 import os
 import json
 from urllib.parse import urlparse, parse_qs, unquote
-from cryptography.fernet import Fernet, InvalidToken
+from cryptography.fernet import InvalidToken
 from utils.scanner_access import get_scannable_active_events, user_can_scan_gate
+from utils.credential_index import lookup_credential
+from utils.code_filter import code_may_exist
+from utils.live_feed import publish_scan_outcome, release_staged_publishes, discard_staged_publishes, stage_consumed
+from utils.duplicate_detector import record_scan_attempt
+from utils.pass_tokens import is_pass_token, verify_pass_token
+from utils.replay_cache import scan_idempotency_key, claim_replay, lookup_replay, remember_replay, settle_replay
+from utils.scan_rate_limit import check_miss_budget, check_scan_rate, record_scan_outcome, throttled_body
+from utils.gate_sessions import open_gate_session, resolve_gate_session
+from utils.legacy_payloads import LEGACY_DECRYPT_FALLBACK, is_legacy_payload, load_legacy_cipher
+from utils.scan_metrics import scan_stage, set_scan_gate, start_scan_trace, finish_scan_trace
+from utils.gate_access import get_gate_access
+from utils.ticket_consumption import consume_ticket
+from utils.scan_log_writer import (
+    write_behind_enabled, stage_scan_log, pass_scan_record, ticket_scan_record,
+    release_staged_scan_logs, discard_staged_scan_logs
+)
 
 validation_bp = Blueprint('validation', __name__)
 
+VALIDATE_BATCH_MAX_ITEMS = int(os.getenv('VALIDATE_BATCH_MAX_ITEMS', 500))
+
 # OPTIONAL legacy decrypt support (for older QR codes)
-def _load_fernet():
-    key = os.getenv("ENCRYPTION_KEY", "").strip()
-    if not key:
-        return None
-    try:
-        return Fernet(key.encode())
-    except Exception:
-        return None
+cipher = load_legacy_cipher()
 
-cipher = _load_fernet()
+# Everything the scan response needs, loaded with the credential itself so that
+# building pass_info / ticket_info never issues follow-up SELECTs.
+_PASS_SCAN_OPTIONS = (joinedload(EventPass.pass_type), joinedload(EventPass.event))
+_TICKET_SCAN_OPTIONS = (joinedload(Ticket.batch).joinedload(TicketBatch.event),)
 
 
 def _client_ip():
@@ -65,13 +80,7 @@ def _normalize_scanned_code(raw_code: str) -> str:
 
 def _find_ticket_hint(scanned_code: str):
     """Return ticket + event context if code belongs to ticket module."""
-    upper_code = scanned_code.upper()
-    ticket = Ticket.query.filter(
-        (Ticket.ticket_code == scanned_code) |
-        (Ticket.ticket_code == upper_code) |
-        (Ticket.barcode == scanned_code) |
-        (Ticket.barcode == upper_code)
-    ).first()
+    ticket = _resolve_ticket(scanned_code)
 
     if not ticket:
         return None
@@ -93,41 +102,51 @@ def _find_ticket_hint(scanned_code: str):
 
 
 def _resolve_ticket(scanned_code: str):
-    upper_code = scanned_code.upper()
-    return Ticket.query.filter(
-        (Ticket.ticket_code == scanned_code) |
-        (Ticket.ticket_code == upper_code) |
-        (Ticket.barcode == scanned_code) |
-        (Ticket.barcode == upper_code)
+    code_key = canonical_code(scanned_code)
+    if not code_key:
+        return None
+    return Ticket.query.options(*_TICKET_SCAN_OPTIONS).filter(
+        (Ticket.ticket_code_key == code_key) |
+        (Ticket.barcode_key == code_key)
     ).first()
 
 
 def _ticket_event(ticket_obj: Ticket):
     if not ticket_obj or not ticket_obj.batch:
         return None
-    return Event.query.get(ticket_obj.batch.event_id)
+    return ticket_obj.batch.event
 
 def _resolve_pass(scanned_code: str):
     """
     New QR payload: pass_code only.
     Also supports legacy encrypted QR payloads if cipher exists.
     """
-    upper_code = scanned_code.upper()
+    # 1) pass_code lookup via the canonical (uppercased) key - one indexed probe
+    #    that also covers lowercase manual input
+    p = EventPass.query.options(*_PASS_SCAN_OPTIONS).filter_by(pass_code_key=canonical_code(scanned_code)).first()
+    if p:
+        return p
 
-    # 1) direct pass_code lookup (new best practice)
-    p = EventPass.query.filter_by(pass_code=scanned_code).first()
+    # 2) legacy: code was stored in encrypted_data column (indexed digest probe,
+    #    then exact comparison to rule out digest collisions)
+    p = EventPass.query.options(*_PASS_SCAN_OPTIONS).filter(
+        EventPass.encrypted_data_digest == payload_digest(scanned_code),
+        EventPass.encrypted_data == scanned_code
+    ).first()
     if p:
         return p
 
-    # 2) case-insensitive fallback for manual input
-    if upper_code != scanned_code:
-        p = EventPass.query.filter_by(pass_code=upper_code).first()
-        if p:
-            return p
+    if not is_legacy_payload(scanned_code):
+        return None
 
-    # 3) legacy: code was stored in encrypted_data column
-    p = EventPass.query.filter_by(encrypted_data=scanned_code).first()
-    if p:
+    # 3) legacy JSON / Fernet payloads decoded ahead of time (migrate_legacy_payloads.py)
+    p = (
+        EventPass.query.options(*_PASS_SCAN_OPTIONS)
+        .join(LegacyPassAlias, LegacyPassAlias.pass_id == EventPass.id)
+        .filter(LegacyPassAlias.payload_digest == payload_digest(scanned_code))
+        .first()
+    )
+    if p or not LEGACY_DECRYPT_FALLBACK:
         return p
 
     # 4) legacy: plain JSON payload from old QR generation
@@ -135,11 +154,11 @@ def _resolve_pass(scanned_code: str):
         payload = json.loads(scanned_code)
         if payload.get("pass_code"):
             code = str(payload["pass_code"]).strip()
-            p = EventPass.query.filter_by(pass_code=code).first()
+            p = EventPass.query.options(*_PASS_SCAN_OPTIONS).filter_by(pass_code_key=canonical_code(code)).first()
             if p:
                 return p
         if payload.get("pass_id"):
-            return EventPass.query.get(payload["pass_id"])
+            return db.session.get(EventPass, payload["pass_id"], options=_PASS_SCAN_OPTIONS)
     except (ValueError, TypeError, json.JSONDecodeError):
         pass
 
@@ -155,40 +174,77 @@ def _resolve_pass(scanned_code: str):
 
     # allow pass_code or pass_id in legacy payload
     if payload.get("pass_code"):
-        return EventPass.query.filter_by(pass_code=payload["pass_code"]).first()
+        return EventPass.query.options(*_PASS_SCAN_OPTIONS).filter_by(pass_code_key=canonical_code(str(payload["pass_code"]))).first()
     if payload.get("pass_id"):
-        return EventPass.query.get(payload["pass_id"])
+        return db.session.get(EventPass, payload["pass_id"], options=_PASS_SCAN_OPTIONS)
 
     return None
 
 
-def _create_validation_log(pass_obj, status: str, message: str):
-    log = ValidationLog(
-        pass_id=pass_obj.id,
+def _resolve_credential(scanned_code: str):
+    """
+    Return (pass_obj, ticket_obj) for a scanned code.
+    Tries the in-memory credential index first (one primary-key load), then
+    falls back to the DB resolvers on a miss or when the indexed row is gone.
+    """
+    entry = lookup_credential(scanned_code)
+    if entry is not None:
+        if entry.kind == 'pass':
+            with scan_stage('resolve_pass'):
+                pass_obj = db.session.get(EventPass, entry.id, options=_PASS_SCAN_OPTIONS)
+            if pass_obj:
+                return pass_obj, None
+        else:
+            with scan_stage('resolve_ticket'):
+                ticket_obj = db.session.get(Ticket, entry.id, options=_TICKET_SCAN_OPTIONS)
+            if ticket_obj:
+                return None, ticket_obj
+
+    with scan_stage('resolve_pass'):
+        pass_obj = _resolve_pass(scanned_code)
+    if pass_obj:
+        return pass_obj, None
+    with scan_stage('resolve_ticket'):
+        return None, _resolve_ticket(scanned_code)
+
+
+def _record_pass_scan(pass_id: int, gate_id: int, status: str, message: str,
+                      gate_granted: bool, gate_message: str):
+    """
+    Write ValidationLog + GateValidationLog for a pass scan; return validation_time.
+    In write-behind mode the rows are staged and written by the background writer
+    after the scan commits; otherwise they join the current transaction.
+    """
+    now = datetime.utcnow()
+    validation = dict(
+        pass_id=pass_id,
         validator_id=current_user.id,
-        validation_time=datetime.utcnow(),
+        validation_time=now,
         validation_status=status,
         validation_message=message,
         ip_address=_client_ip(),
     )
-    db.session.add(log)
-    db.session.flush()  # ensures log.id exists
-    return log
-
-
-def _create_gate_log(validation_log_id: int, gate_id: int, granted: bool, message: str):
-    gate_log = GateValidationLog(
-        validation_log_id=validation_log_id,
+    gate = dict(
         gate_id=gate_id,
-        gate_access_granted=granted,
-        gate_access_message=message,
-        created_at=datetime.utcnow(),
+        gate_access_granted=gate_granted,
+        gate_access_message=gate_message,
+        created_at=now,
     )
-    db.session.add(gate_log)
+
+    with scan_stage('log_write'):
+        if write_behind_enabled():
+            stage_scan_log(pass_scan_record(validation, gate))
+            return now
+
+        log = ValidationLog(**validation)
+        db.session.add(log)
+        db.session.flush()  # ensures log.id exists
+        db.session.add(GateValidationLog(validation_log_id=log.id, **gate))
+    return now
 
 
 def _create_ticket_gate_log(ticket_obj: Ticket, gate_id: int, status: str, message: str):
-    log = TicketGateValidationLog(
+    ticket_log = dict(
         ticket_id=ticket_obj.id,
         gate_id=gate_id,
         validator_id=current_user.id,
@@ -196,15 +252,40 @@ def _create_ticket_gate_log(ticket_obj: Ticket, gate_id: int, status: str, messa
         validation_message=message,
         created_at=datetime.utcnow(),
     )
-    db.session.add(log)
-    return log
+
+    with scan_stage('log_write'):
+        if write_behind_enabled():
+            stage_scan_log(ticket_scan_record(ticket_log))
+            return
+
+        db.session.add(TicketGateValidationLog(**ticket_log))
+
+
+def _commit_scan():
+    """Commit the scan transaction and release any write-behind audit rows."""
+    with scan_stage('commit'):
+        try:
+            db.session.commit()
+        except Exception:
+            _discard_scan()
+            raise
+        release_staged_scan_logs()
+    release_staged_publishes()
+
+
+def _discard_scan():
+    """Roll back a failed scan and drop everything staged for after-commit."""
+    db.session.rollback()
+    discard_staged_scan_logs()
+    discard_staged_publishes()
 
 
 def _gate_allows(pass_obj: EventPass, gate_id: int):
     """
-    Return (allowed: bool, message: str, gate: Gate|None)
+    Return (allowed: bool, message: str, gate: GateAccessEntry|None)
+    Rules come from the compiled gate access matrix (no per-scan rule queries).
     """
-    gate = Gate.query.get(gate_id)
+    gate = get_gate_access(gate_id)
     if not gate or not gate.is_active:
         return False, "Gate not found or inactive", None
 
@@ -218,55 +299,43 @@ def _gate_allows(pass_obj: EventPass, gate_id: int):
             f'but selected gate is for "{gate_event}".'
         ), gate
 
-    # Check access rule
-    rule = GateAccessRule.query.filter_by(
-        gate_id=gate_id,
-        pass_type_id=pass_obj.pass_type_id
-    ).first()
-
-    if not rule:
-        # Legacy fallback: if a gate has zero rules configured, allow all pass types.
-        # This keeps older data usable while still enforcing explicit rules once configured.
-        gate_rule_count = GateAccessRule.query.filter_by(gate_id=gate_id).count()
-        if gate_rule_count == 0:
-            return True, "Gate access allowed (no explicit rules configured)", gate
-
-        return False, "No access rule for this pass type at this gate", gate
-
-    if not rule.can_access:
-        return False, "Access denied for this pass type at this gate", gate
-
-    return True, "Gate access allowed", gate
-
-
-def _validate_ticket_for_gate(ticket_obj: Ticket, gate_id: int, gate_obj=None):
-    gate_obj = gate_obj or Gate.query.get(gate_id)
-    if not gate_obj or not gate_obj.is_active:
-        return jsonify({"success": False, "message": "Gate not found or inactive"}), 400
+    allowed, message = gate.check(pass_obj.pass_type_id)
+    return allowed, message, gate
 
-    if not user_can_scan_gate(current_user, gate_obj):
-        return jsonify({"success": False, "message": "You are not assigned to this gate."}), 403
 
-    ticket_event = _ticket_event(ticket_obj)
-    if not ticket_event:
-        return jsonify({"success": False, "message": "Ticket is missing event mapping"}), 400
-
-    gate_event_obj = Event.query.get(gate_obj.event_id)
-    gate_event_name = gate_event_obj.event_name if gate_event_obj else f'Event #{gate_obj.event_id}'
-
-    if gate_obj.event_id != ticket_event.id:
-        try:
-            _create_ticket_gate_log(
-                ticket_obj,
-                gate_id,
-                'failed',
-                f'Wrong event ticket. Ticket event "{ticket_event.event_name}", gate event "{gate_event_name}".'
-            )
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
+def _validate_ticket_for_gate(ticket_obj: Ticket, gate_id: int, gate_event_id: int = None):
+    """
+    Validate a batch ticket at a gate inside the current transaction.
+    gate_event_id is passed by callers that already authorized the gate
+    (scanner gate or gate session); otherwise the gate is loaded and checked here.
+    Return (body: dict, status_code: int); the caller commits.
+    """
+    if gate_event_id is None:
+        with scan_stage('scope_check'):
+            gate_obj = Gate.query.get(gate_id)
+            if not gate_obj or not gate_obj.is_active:
+                return {"success": False, "message": "Gate not found or inactive"}, 400
+
+            if not user_can_scan_gate(current_user, gate_obj):
+                return {"success": False, "message": "You are not assigned to this gate."}, 403
+            gate_event_id = gate_obj.event_id
+
+    with scan_stage('gate_rules'):
+        ticket_event = _ticket_event(ticket_obj)
+        if not ticket_event:
+            return {"success": False, "message": "Ticket is missing event mapping"}, 400
+
+    if gate_event_id != ticket_event.id:
+        gate_event_obj = Event.query.get(gate_event_id)
+        gate_event_name = gate_event_obj.event_name if gate_event_obj else f'Event #{gate_event_id}'
+        _create_ticket_gate_log(
+            ticket_obj,
+            gate_id,
+            'failed',
+            f'Wrong event ticket. Ticket event "{ticket_event.event_name}", gate event "{gate_event_name}".'
+        )
 
-        return jsonify({
+        return {
             "success": False,
             "message": (
                 f'Wrong event ticket. This ticket belongs to "{ticket_event.event_name}" '
@@ -286,16 +355,19 @@ def _validate_ticket_for_gate(ticket_obj: Ticket, gate_id: int, gate_obj=None):
                 "event_id": ticket_event.id,
                 "event_name": ticket_event.event_name,
             }
-        }), 403
+        }, 403
 
-    if ticket_obj.status == 'used':
-        try:
-            _create_ticket_gate_log(ticket_obj, gate_id, 'duplicate', 'Duplicate scan (ticket already used)')
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
+    # Single conditional UPDATE; skipped when the loaded row already shows the outcome.
+    with scan_stage('state_update'):
+        consumed = (
+            ticket_obj.status not in ('used', 'expired')
+            and consume_ticket(ticket_obj, current_user.username)
+        )
 
-        return jsonify({
+    if not consumed and ticket_obj.status != 'expired':
+        _create_ticket_gate_log(ticket_obj, gate_id, 'duplicate', 'Duplicate scan (ticket already used)')
+
+        return {
             "success": False,
             "message": "Ticket already used",
             "pass_info": {
@@ -303,16 +375,12 @@ def _validate_ticket_for_gate(ticket_obj: Ticket, gate_id: int, gate_obj=None):
                 "pass_type": "Batch Ticket",
                 "event": ticket_event.event_name,
             }
-        }), 400
+        }, 400
 
-    if ticket_obj.status == 'expired':
-        try:
-            _create_ticket_gate_log(ticket_obj, gate_id, 'failed', 'Ticket expired')
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
+    if not consumed:
+        _create_ticket_gate_log(ticket_obj, gate_id, 'failed', 'Ticket expired')
 
-        return jsonify({
+        return {
             "success": False,
             "message": "Ticket has expired",
             "pass_info": {
@@ -320,19 +388,12 @@ def _validate_ticket_for_gate(ticket_obj: Ticket, gate_id: int, gate_obj=None):
                 "pass_type": "Batch Ticket",
                 "event": ticket_event.event_name,
             }
-        }), 400
+        }, 400
 
-    try:
-        ticket_obj.status = 'used'
-        ticket_obj.scanned_by = current_user.username
-        ticket_obj.scanned_at = datetime.utcnow()
-        _create_ticket_gate_log(ticket_obj, gate_id, 'success', 'Ticket entry approved')
-        db.session.commit()
-    except Exception:
-        db.session.rollback()
-        return jsonify({"success": False, "message": "Validation error occurred"}), 500
+    stage_consumed(ticket_event.id)
+    _create_ticket_gate_log(ticket_obj, gate_id, 'success', 'Ticket entry approved')
 
-    return jsonify({
+    return {
         "success": True,
         "message": "Ticket entry approved",
         "pass_info": {
@@ -347,66 +408,25 @@ def _validate_ticket_for_gate(ticket_obj: Ticket, gate_id: int, gate_obj=None):
             "barcode": ticket_obj.barcode,
             "status": ticket_obj.status
         }
-    }), 200
-
+    }, 200
 
-@validation_bp.route("/validate", methods=["GET", "POST"])
-@login_required
-def validate_pass():
-    if request.method == "GET":
-        events = get_scannable_active_events(current_user)
-        return render_template("validation/scanner.html", events=events)
-
-    data = request.get_json(silent=True) or {}
-    scanned_code = _normalize_scanned_code(data.get("code") or "")
-    gate_id = data.get("gate_id")
-
-    if not scanned_code:
-        return jsonify({"success": False, "message": "No code provided"}), 400
-
-    if not gate_id:
-        return jsonify({"success": False, "message": "gate_id is required"}), 400
-
-    try:
-        gate_id = int(gate_id)
-    except (ValueError, TypeError):
-        return jsonify({"success": False, "message": "gate_id must be a valid integer"}), 400
-
-    gate_for_scanner = Gate.query.get(gate_id)
-    if not gate_for_scanner or not gate_for_scanner.is_active:
-        return jsonify({"success": False, "message": "Gate not found or inactive"}), 400
-
-    if not user_can_scan_gate(current_user, gate_for_scanner):
-        return jsonify({"success": False, "message": "You are not assigned to this gate."}), 403
-
-    pass_obj = _resolve_pass(scanned_code)
-    if not pass_obj:
-        ticket_obj = _resolve_ticket(scanned_code)
-        if ticket_obj:
-            return _validate_ticket_for_gate(ticket_obj, gate_id, gate_for_scanner)
-
-        return jsonify({"success": False, "message": "Invalid code or pass/ticket not found"}), 404
 
+def _validate_pass_for_gate(pass_obj: EventPass, gate_id: int):
+    """
+    Validate an event pass at a gate inside the current transaction.
+    Return (body: dict, status_code: int); the caller commits.
+    """
     # Expiry check (server-side)
     now = datetime.utcnow()
     if pass_obj.expires_at and now > pass_obj.expires_at:
-        try:
-            log = _create_validation_log(pass_obj, "failed", "Pass expired")
-            _create_gate_log(log.id, int(gate_id), False, "Expired pass")
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-        return jsonify({"success": False, "message": "Pass expired"}), 400
+        _record_pass_scan(pass_obj.id, gate_id, "failed", "Pass expired", False, "Expired pass")
+        return {"success": False, "message": "Pass expired"}, 400
 
     # Gate access check BEFORE marking validated
-    allowed, gate_msg, gate_obj = _gate_allows(pass_obj, gate_id)
+    with scan_stage('gate_rules'):
+        allowed, gate_msg, gate_obj = _gate_allows(pass_obj, gate_id)
     if not allowed:
-        try:
-            log = _create_validation_log(pass_obj, "failed", f"Gate denied: {gate_msg}")
-            _create_gate_log(log.id, gate_id, False, gate_msg)
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
+        _record_pass_scan(pass_obj.id, gate_id, "failed", f"Gate denied: {gate_msg}", False, gate_msg)
 
         pass_event = pass_obj.event.event_name if pass_obj.event else f'Event #{pass_obj.event_id}'
         gate_event_name = None
@@ -414,7 +434,7 @@ def validate_pass():
             gate_event_obj = Event.query.get(gate_obj.event_id)
             gate_event_name = gate_event_obj.event_name if gate_event_obj else None
 
-        return jsonify({
+        return {
             "success": False,
             "message": gate_msg,
             "pass_info": {
@@ -425,10 +445,10 @@ def validate_pass():
             "event_mismatch": bool(gate_obj and gate_obj.event_id != pass_obj.event_id),
             "selected_gate_event": gate_event_name,
             "pass_event": pass_event,
-        }), 403
+        }, 403
 
     # ATOMIC validation update to prevent double entry
-    try:
+    with scan_stage('state_update'):
         rows = (
             db.session.query(EventPass)
             .filter(EventPass.id == pass_obj.id, EventPass.is_validated == False)  # noqa: E712
@@ -441,40 +461,378 @@ def validate_pass():
             )
         )
 
-        if rows == 0:
-            log = _create_validation_log(pass_obj, "duplicate", "Duplicate scan (already validated)")
-            _create_gate_log(log.id, gate_id, False, "Duplicate scan")
-            db.session.commit()
-
-            return jsonify({
-                "success": False,
-                "message": "Pass already validated",
-                "pass_info": {
-                    "participant_name": pass_obj.participant_name,
-                    "pass_type": pass_obj.pass_type.type_name if pass_obj.pass_type else "Unknown",
-                    "event": pass_obj.event.event_name if pass_obj.event else "Unknown",
-                }
-            }), 400
-
-        log = _create_validation_log(pass_obj, "success", "Pass validated successfully")
-        _create_gate_log(log.id, gate_id, True, "Entry approved")
-        db.session.commit()
+    if rows == 0:
+        _record_pass_scan(
+            pass_obj.id, gate_id, "duplicate", "Duplicate scan (already validated)", False, "Duplicate scan"
+        )
 
-        return jsonify({
-            "success": True,
-            "message": "Entry approved",
+        return {
+            "success": False,
+            "message": "Pass already validated",
             "pass_info": {
-                "id": pass_obj.id,
                 "participant_name": pass_obj.participant_name,
-                "email": pass_obj.participant_email,
-                "phone": pass_obj.participant_phone,
                 "pass_type": pass_obj.pass_type.type_name if pass_obj.pass_type else "Unknown",
                 "event": pass_obj.event.event_name if pass_obj.event else "Unknown",
-                "validated_at": log.validation_time.strftime("%Y-%m-%d %H:%M:%S"),
-                "gate_id": gate_id
             }
-        }), 200
+        }, 400
+
+    stage_consumed(pass_obj.event_id)
+    validated_at = _record_pass_scan(
+        pass_obj.id, gate_id, "success", "Pass validated successfully", True, "Entry approved"
+    )
+
+    return {
+        "success": True,
+        "message": "Entry approved",
+        "pass_info": {
+            "id": pass_obj.id,
+            "participant_name": pass_obj.participant_name,
+            "email": pass_obj.participant_email,
+            "phone": pass_obj.participant_phone,
+            "pass_type": pass_obj.pass_type.type_name if pass_obj.pass_type else "Unknown",
+            "event": pass_obj.event.event_name if pass_obj.event else "Unknown",
+            "validated_at": validated_at.strftime("%Y-%m-%d %H:%M:%S"),
+            "gate_id": gate_id
+        }
+    }, 200
+
+
+def _prevalidate_pass_token(scanned_code: str, gate_id: int):
+    """
+    Check a signed pass token (PT1...) against the compiled gate matrix without
+    loading the pass. Return (pass_id, None) when the pass may be consumed,
+    or (None, (body, status_code)) for forged, expired, wrong-event or wrong-gate tokens.
+    """
+    token, error = verify_pass_token(scanned_code)
+    if error:
+        return None, ({"success": False, "message": error}, 403)
+
+    if token.expires_at and datetime.utcnow() > token.expires_at:
+        _record_pass_scan(token.pass_id, gate_id, "failed", "Pass expired", False, "Expired pass")
+        return None, ({"success": False, "message": "Pass expired"}, 400)
+
+    gate = get_gate_access(gate_id)
+    if not gate or not gate.is_active:
+        return None, ({"success": False, "message": "Gate not found or inactive"}, 400)
+
+    if gate.event_id != token.event_id:
+        message = "Wrong event pass. This pass is not valid for the selected gate's event."
+        _record_pass_scan(token.pass_id, gate_id, "failed", f"Gate denied: {message}", False, message)
+        return None, ({"success": False, "message": message, "event_mismatch": True}, 403)
+
+    allowed, gate_msg = gate.check(token.pass_type_id)
+    if not allowed:
+        _record_pass_scan(token.pass_id, gate_id, "failed", f"Gate denied: {gate_msg}", False, gate_msg)
+        return None, ({"success": False, "message": gate_msg, "event_mismatch": False}, 403)
+
+    return token.pass_id, None
+
+
+def _scan_code(scanned_code: str, gate_id: int, gate_event_id: int):
+    """
+    Resolve and validate one normalized code at an already authorized gate.
+    Return (body: dict, status_code: int); nothing is committed here.
+    """
+    if is_pass_token(scanned_code):
+        # Signed tokens are rejected from the token alone; only accepted ones load the pass.
+        with scan_stage('resolve_pass'):
+            pass_id, rejection = _prevalidate_pass_token(scanned_code, gate_id)
+            if rejection:
+                return rejection
+            pass_obj = db.session.get(EventPass, pass_id, options=_PASS_SCAN_OPTIONS)
+        if not pass_obj:
+            return {"success": False, "message": "Invalid code or pass/ticket not found"}, 404
+        ticket_obj = None
+    else:
+        with scan_stage('resolve_pass'):
+            known = code_may_exist(scanned_code)
+        if not known:
+            return {"success": False, "message": "Invalid code or pass/ticket not found"}, 404
+
+        pass_obj, ticket_obj = _resolve_credential(scanned_code)
+
+    if pass_obj:
+        body, status_code = _validate_pass_for_gate(pass_obj, gate_id)
+        with scan_stage('duplicate_check'):
+            record_scan_attempt(
+                pass_obj.event_id, 'pass', pass_obj.id, gate_id, body.get("success"),
+                bool(body.get("success") or pass_obj.is_validated),
+                f'Pass {pass_obj.pass_code} ({pass_obj.participant_name})', pass_id=pass_obj.id
+            )
+        return body, status_code
+    if ticket_obj:
+        body, status_code = _validate_ticket_for_gate(ticket_obj, gate_id, gate_event_id)
+        if ticket_obj.batch:
+            with scan_stage('duplicate_check'):
+                record_scan_attempt(
+                    ticket_obj.batch.event_id, 'ticket', ticket_obj.id, gate_id, body.get("success"),
+                    ticket_obj.status == 'used', f'Ticket {ticket_obj.ticket_code}'
+                )
+        return body, status_code
+    return {"success": False, "message": "Invalid code or pass/ticket not found"}, 404
+
+
+def _load_scanner_gate(gate_id):
+    """
+    Parse gate_id and check the gate is active and the current user may scan it.
+    Return (gate, None) or (None, (body, status_code)).
+    """
+    if not gate_id:
+        return None, ({"success": False, "message": "gate_id is required"}, 400)
+
+    try:
+        gate_id = int(gate_id)
+    except (ValueError, TypeError):
+        return None, ({"success": False, "message": "gate_id must be a valid integer"}, 400)
+
+    gate = Gate.query.get(gate_id)
+    if not gate or not gate.is_active:
+        return None, ({"success": False, "message": "Gate not found or inactive"}, 400)
+
+    if not user_can_scan_gate(current_user, gate):
+        return None, ({"success": False, "message": "You are not assigned to this gate."}, 403)
+
+    return gate, None
+
+
+@validation_bp.route("/validate", methods=["GET", "POST"])
+@login_required
+def validate_pass():
+    if request.method == "GET":
+        events = get_scannable_active_events(current_user)
+        return render_template("validation/scanner.html", events=events)
+
+    # Read once: the scan commit expires current_user, and reloading it costs a query.
+    user_id = current_user.id
+    retry_after = check_scan_rate(user_id)
+    if retry_after is not None:
+        body, headers = throttled_body(retry_after)
+        return jsonify(body), 429, headers
+
+    data = request.get_json(silent=True) or {}
+    replay_key = scan_idempotency_key(data)
+    if replay_key:
+        # A retried scan gets its original response, not "already validated".
+        replayed, claimed = claim_replay(user_id, 'validate', replay_key)
+        if replayed:
+            body, status_code = replayed
+            return jsonify(dict(body, replayed=True)), status_code
+    else:
+        claimed = False
+
+    body = status_code = None
+    scanned = False
+    try:
+        start_scan_trace()
+        body, status_code, scanned = _validate_scan_request(data)
+        finish_scan_trace(status_code, body.get("message"))
+        record_scan_outcome(user_id, status_code)
+    finally:
+        if claimed:
+            # Only scan outcomes are replayed; request errors (no code, bad gate) are not.
+            if scanned:
+                settle_replay(user_id, 'validate', replay_key, body, status_code)
+            else:
+                settle_replay(user_id, 'validate', replay_key)
+    return jsonify(body), status_code
+
+
+def _validate_scan_request(data):
+    """
+    Handle one /validate POST body; return (body: dict, status_code: int, scanned: bool).
+    scanned is False for request errors returned before the code was scanned.
+    """
+    with scan_stage('normalize'):
+        scanned_code = _normalize_scanned_code(data.get("code") or "")
+
+    if not scanned_code:
+        return {"success": False, "message": "No code provided"}, 400, False
+
+    session_token = data.get("session_token") or request.headers.get("X-Gate-Session")
+    with scan_stage('scope_check'):
+        if session_token:
+            # Gate, event and scope were pinned when the session was opened.
+            gate_context, error = resolve_gate_session(session_token, current_user)
+        else:
+            gate_context, error = _load_scanner_gate(data.get("gate_id"))
+    if error:
+        return error + (False,)
+    if session_token:
+        gate_id, event_id = gate_context.gate_id, gate_context.event_id
+    else:
+        gate_id, event_id = gate_context.id, gate_context.event_id
+    set_scan_gate(gate_id)
+
+    try:
+        body, status_code = _scan_code(scanned_code, gate_id, event_id)
+        _commit_scan()
+    except Exception:
+        _discard_scan()
+        return {"success": False, "message": "Validation error occurred"}, 500, False
+
+    publish_scan_outcome(event_id, gate_id, body, status_code)
+    return body, status_code, True
+
+
+@validation_bp.route("/validate/session", methods=["POST"])
+@login_required
+def open_scan_session():
+    """
+    Authorize the current scanner for a gate once and return a session token.
+    Send it as session_token (or X-Gate-Session) on /validate instead of gate_id.
+    """
+    data = request.get_json(silent=True) or {}
+    gate, error = _load_scanner_gate(data.get("gate_id"))
+    if error:
+        return jsonify(error[0]), error[1]
+
+    token, session = open_gate_session(current_user, gate)
+    return jsonify({
+        "success": True,
+        "session_token": token,
+        "gate_id": session.gate_id,
+        "gate_name": session.gate_name,
+        "event_id": session.event_id,
+        "event_name": session.event_name,
+        "expires_at": datetime.utcfromtimestamp(session.expires_at).strftime("%Y-%m-%d %H:%M:%S"),
+    }), 200
+
+
+def _parse_client_ts(value):
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except (ValueError, TypeError):
+        return None
+    # Compare naive and aware timestamps on the same (UTC) footing.
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _batch_item_error(item):
+    """400 body for a batch item that cannot be scanned as sent, else None."""
+    if not isinstance(item, dict):
+        return {"success": False, "message": "Each scan must be an object"}
+    if not isinstance(item.get("code"), (str, type(None))):
+        return {"success": False, "message": "code must be a string"}
+    if not isinstance(item.get("idempotency_key"), (str, type(None))):
+        return {"success": False, "message": "idempotency_key must be a string"}
+    return None
+
+
+@validation_bp.route("/validate/batch", methods=["POST"])
+@login_required
+def validate_batch():
+    """
+    Validate many buffered scans in one request and one transaction.
+    Body: {"scans": [{"code", "gate_id", "client_ts", "idempotency_key"}, ...]}
+    Items are applied in client_ts order (earliest scan wins); results keep input order.
+    The request takes one scan token and each unknown code one miss token; once the
+    miss budget is used up, the remaining items get 429 without being scanned.
+    """
+    # Read once: the commit expires current_user, and reloading it costs a query.
+    user_id = current_user.id
+    retry_after = check_scan_rate(user_id)
+    if retry_after is not None:
+        body, headers = throttled_body(retry_after)
+        return jsonify(body), 429, headers
+
+    data = request.get_json(silent=True) or {}
+    items = data.get("scans")
+    if not isinstance(items, list) or not items:
+        return jsonify({"success": False, "message": "scans must be a non-empty list"}), 400
+
+    if len(items) > VALIDATE_BATCH_MAX_ITEMS:
+        return jsonify({
+            "success": False,
+            "message": f"Too many scans in one batch (max {VALIDATE_BATCH_MAX_ITEMS})"
+        }), 413
+
+    results = [None] * len(items)
+    throttled = None  # 429 body once the miss budget is used up
+    gate_cache = {}
+    results_by_key = {}
+    scanned_keys = set()  # keys whose result is a scan outcome (replayable)
+    outcomes = []  # (event_id, gate_id, body, status_code), published after commit
+
+    def apply_order(index):
+        item = items[index]
+        client_ts = _parse_client_ts(item.get("client_ts")) if isinstance(item, dict) else None
+        return (client_ts or datetime.max, index)
+
+    order = sorted(range(len(items)), key=apply_order)
+
+    try:
+        for index in order:
+            item = items[index]
+            error = _batch_item_error(item)
+            if error:
+                # Rejected on its own; the rest of the batch still applies.
+                results[index] = dict(error, index=index, status=400)
+                continue
+            if throttled is None:
+                retry_after = check_miss_budget(user_id)
+                if retry_after is not None:
+                    throttled = throttled_body(retry_after)[0]
+            if throttled is not None:
+                results[index] = dict(throttled, index=index, status=429)
+                continue
+
+            idempotency_key = item.get("idempotency_key")
+            result = {
+                "index": index,
+                "idempotency_key": idempotency_key,
+                "client_ts": item.get("client_ts"),
+            }
 
+            replayed = idempotency_key and (
+                results_by_key.get(idempotency_key)
+                or lookup_replay(user_id, 'validate', idempotency_key)
+            )
+            if replayed:
+                body, status_code = replayed
+                result.update(body, status=status_code, replayed=True)
+                results[index] = result
+                continue
+
+            scanned_code = _normalize_scanned_code(item.get("code") or "")
+            if not scanned_code:
+                body, status_code = {"success": False, "message": "No code provided"}, 400
+            else:
+                gate_key = str(item.get("gate_id") or "")
+                if gate_key not in gate_cache:
+                    gate_cache[gate_key] = _load_scanner_gate(gate_key)
+                gate, error = gate_cache[gate_key]
+                if error:
+                    body, status_code = error
+                else:
+                    body, status_code = _scan_code(scanned_code, gate.id, gate.event_id)
+                    record_scan_outcome(user_id, status_code)
+                    outcomes.append((gate.event_id, gate.id, body, status_code))
+                    if idempotency_key:
+                        scanned_keys.add(idempotency_key)
+
+            if idempotency_key:
+                results_by_key[idempotency_key] = (body, status_code)
+            result.update(body, status=status_code)
+            results[index] = result
+
+        _commit_scan()
     except Exception:
-        db.session.rollback()
-        return jsonify({"success": False, "message": "Validation error occurred"}), 500
+        _discard_scan()
+        return jsonify({"success": False, "message": "Validation error occurred; no scans were applied"}), 500
+
+    for event_id, gate_id, body, status_code in outcomes:
+        publish_scan_outcome(event_id, gate_id, body, status_code)
+    for idempotency_key in scanned_keys:
+        body, status_code = results_by_key[idempotency_key]
+        remember_replay(user_id, 'validate', idempotency_key, body, status_code)
+
+    return jsonify({
+        "success": True,
+        "processed": len(results),
+        "approved": sum(1 for r in results if r.get("success")),
+        "results": results,
+    }), 200
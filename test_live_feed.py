@@ -0,0 +1,70 @@
+import json
+
+from conftest import login, make_pass
+from utils import live_feed
+
+
+def _frames(response, count):
+    chunks = iter(response.response)
+    frames = []
+    while len(frames) < count:
+        chunk = next(chunks)
+        chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+        if chunk.startswith(':'):
+            continue  # heartbeat
+        kind, data = [line.split(': ', 1)[1] for line in chunk.strip().splitlines() if ': ' in line][-2:]
+        frames.append((kind, json.loads(data)))
+    return frames
+
+
+def test_stream_pushes_committed_scan_outcomes(scan_event):
+    code = make_pass(scan_event)
+    client = login(scan_event['user_id'])
+    response = client.get(f'/gates/alerts/{scan_event["event_id"]}/stream')
+    assert response.status_code == 200 and response.mimetype == 'text/event-stream'
+    try:
+        assert _frames(response, 1) == [('ready', {'event_id': scan_event['event_id']})]
+
+        client.post('/validate', json={'code': code, 'gate_id': scan_event['gate_id']})
+        client.post('/validate', json={'code': code, 'gate_id': scan_event['gate_id']})
+        # The second scan also raises a duplicate_entry alert.
+        frames = _frames(response, 3)
+        assert [kind for kind, _ in frames].count('alert') == 1
+        admitted, duplicate = [data for kind, data in frames if kind == 'scan']
+        assert (admitted['success'], admitted['status'], admitted['gate_id']) == (True, 200, scan_event['gate_id'])
+        assert (duplicate['success'], duplicate['status']) == (False, 400)
+        assert 'participant_name' not in admitted
+    finally:
+        response.close()
+    assert not live_feed._subscribers.get(scan_event['event_id'])
+
+
+def test_stream_is_capped_per_process(scan_event, monkeypatch):
+    monkeypatch.setattr(live_feed, 'LIVE_FEED_MAX_SUBSCRIBERS', 1)
+    client = login(scan_event['user_id'])
+    url = f'/gates/alerts/{scan_event["event_id"]}/stream'
+
+    first = client.get(url)
+    assert first.status_code == 200
+    # The cap spans events: a stream of another event is refused too.
+    assert client.get(f'/gates/alerts/{scan_event["other_event_id"]}/stream').status_code == 503
+    first.close()
+    second = client.get(url)
+    assert second.status_code == 200
+    second.close()
+
+
+def test_stream_requires_scan_access(scan_event):
+    response = login(scan_event['security_id']).get(f'/gates/alerts/{scan_event["other_event_id"]}/stream')
+    assert response.status_code == 403
+
+
+def test_slow_subscribers_lose_their_oldest_messages(monkeypatch):
+    monkeypatch.setattr(live_feed, 'LIVE_FEED_QUEUE_SIZE', 2)
+    q = live_feed.subscribe(-1)
+    try:
+        for n in range(3):
+            assert live_feed.publish(-1, 'scan', {'n': n}) == 1
+        assert [q.get_nowait()[1]['n'] for _ in range(q.qsize())] == [1, 2]
+    finally:
+        live_feed.unsubscribe(-1, q)
@@ -0,0 +1,389 @@
+import base64
+import gzip
+import json
+import sqlite3
+import threading
+import time as pytime
+from datetime import date, datetime, time, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import event
+
+from app import app, db
+from conftest import login, make_pass, make_ticket
+from models import Event, EventPass, Gate, GateAccessRule, GateValidationLog, RealtimeAlert, TicketBatch
+from utils import consumed_feed, offline_bundle, offline_queue
+from utils.offline_bundle import TICKET_STATUS_BITS, ticket_code_hash
+from utils.offline_merge import merge_offline_scans
+from utils.offline_queue import drain_offline_queue, enqueue_offline_upload, offline_upload_status
+
+
+@pytest.fixture(scope='module')
+def offline_event(scan_event):
+    """A separate event, so bundle contents only hold what these tests issue."""
+    with app.app_context():
+        event = Event(event_name='Offline Event', event_date=date.today(), event_time=time(9, 0),
+                      location='Field', total_capacity=1000, organizer_id=scan_event['user_id'])
+        db.session.add(event)
+        db.session.commit()
+        gate = Gate(event_id=event.id, gate_name='Field Gate', gate_type='General', is_active=True)
+        vip_gate = Gate(event_id=event.id, gate_name='Field VIP', gate_type='VIP', is_active=True)
+        batch = TicketBatch(event_id=event.id, batch_name='Field Door', seat_count=100)
+        db.session.add_all([gate, vip_gate, batch])
+        db.session.commit()
+        db.session.add(GateAccessRule(gate_id=vip_gate.id, pass_type_id=scan_event['vip_pass_type_id'],
+                                      can_access=True))
+        db.session.commit()
+        return dict(scan_event, event_id=event.id, gate_id=gate.id, vip_gate_id=vip_gate.id, batch_id=batch.id)
+
+
+def _download(client, event_id, **params):
+    query = '&'.join(f'{name}={value}' for name, value in params.items())
+    return client.get(f'/gates/offline/download/{event_id}?{query}')
+
+
+def test_columnar_bundle_is_compact_and_cacheable(offline_event):
+    code = make_pass(offline_event)
+    payload_code = f'EVT{offline_event["event_id"]:04d}-PAR-LEGACY-1'
+    make_pass(offline_event, pass_code=payload_code, encrypted_data=f'{{"pass_code": "{payload_code}"}}')
+    client = login(offline_event['user_id'])
+
+    response = _download(client, offline_event['event_id'], format='columnar')
+    assert response.status_code == 200 and response.headers['Content-Type'] == 'application/gzip'
+    bundle = json.loads(gzip.decompress(response.data))
+    columns = bundle['passes']['columns']
+    rows = {row['pass_code']: row for row in (dict(zip(columns, values)) for values in zip(*columns.values()))}
+    assert rows[code]['encrypted_data'] is None
+    assert rows[payload_code]['encrypted_data'] == f'{{"pass_code": "{payload_code}"}}'
+    assert rows[code]['pass_code_key'] == code.upper()
+    vip_gate = next(gate for gate in bundle['gates'] if gate['id'] == offline_event['vip_gate_id'])
+    assert vip_gate['allowed_pass_types'] == [offline_event['vip_pass_type_id']]
+
+    etag = response.headers['ETag']
+    assert _download(client, offline_event['event_id'], format='columnar').data == response.data
+    cached = client.get(f'/gates/offline/download/{offline_event["event_id"]}?format=columnar',
+                        headers={'If-None-Match': etag})
+    assert cached.status_code == 304 and cached.headers['X-Offline-Cursor']
+
+
+def test_sqlite_bundle_is_queryable(offline_event, tmp_path):
+    code = make_pass(offline_event, pass_type_id=offline_event['vip_pass_type_id'])
+    response = _download(login(offline_event['user_id']), offline_event['event_id'], format='sqlite')
+    assert response.status_code == 200
+    path = tmp_path / 'bundle.sqlite'
+    path.write_bytes(gzip.decompress(response.data))
+
+    conn = sqlite3.connect(path)
+    try:
+        meta = dict(conn.execute('SELECT key, value FROM meta'))
+        assert (meta['format'], meta['name']) == ('sqlite', 'Offline Event')
+        row = conn.execute('SELECT pass_type_id, is_validated FROM passes WHERE pass_code_key = ?', (code.upper(),))
+        assert row.fetchone() == (offline_event['vip_pass_type_id'], 0)
+        allowed = conn.execute('SELECT pass_type_id FROM gate_access WHERE gate_id = ?',
+                               (offline_event['vip_gate_id'],)).fetchall()
+        assert allowed == [(offline_event['vip_pass_type_id'],)]
+    finally:
+        conn.close()
+
+
+def test_unknown_bundle_format_is_rejected(offline_event):
+    response = _download(login(offline_event['user_id']), offline_event['event_id'], format='xml')
+    assert response.status_code == 400
+
+
+def test_delta_bundle_sends_rows_changed_since_the_cursor(offline_event, monkeypatch):
+    monkeypatch.setattr(offline_bundle, 'OFFLINE_DELTA_OVERLAP_SECONDS', 0)
+    client = login(offline_event['user_id'])
+    unchanged = make_pass(offline_event)
+    admitted = make_pass(offline_event)
+    cursor = _download(client, offline_event['event_id']).headers['X-Offline-Cursor']
+    pytime.sleep(0.01)
+
+    issued = make_pass(offline_event)
+    assert client.post('/validate', json={'code': admitted, 'gate_id': offline_event['gate_id']}).status_code == 200
+    response = _download(client, offline_event['event_id'], since=cursor)
+    assert response.status_code == 200
+    delta = response.get_json()
+    assert int(response.headers['X-Offline-Cursor']) >= int(cursor) == delta['since']
+    passes = {row['pass_code']: row for row in delta['passes']}
+    assert unchanged not in passes
+    assert passes[admitted]['is_validated'] == 1 and passes[issued]['is_validated'] == 0
+    assert {gate['id'] for gate in delta['gates']} >= {offline_event['gate_id'], offline_event['vip_gate_id']}
+
+    columnar = _download(client, offline_event['event_id'], since=cursor, format='columnar')
+    assert set(json.loads(gzip.decompress(columnar.data))['passes']['pass_code']) == set(passes)
+
+
+def test_delta_bundle_rejects_bad_cursors(offline_event):
+    client = login(offline_event['user_id'])
+    assert _download(client, offline_event['event_id'], since='yesterday').status_code == 400
+    assert _download(client, offline_event['event_id'], since='-5').status_code == 400
+    assert _download(client, offline_event['event_id'], since='0', format='sqlite').status_code == 400
+
+
+def _offline_scan(code, gate_id, at, status='success', **fields):
+    return dict(fields, pass_code=code, gate_id=gate_id, validation_time=at, validation_status=status)
+
+
+def _sync(client, validations, **params):
+    query = '&'.join(f'{name}={value}' for name, value in params.items())
+    return client.post(f'/gates/offline/sync?{query}', json={'validations': validations})
+
+
+def test_offline_sync_reports_each_item(offline_event):
+    client = login(offline_event['user_id'])
+    gate_id = offline_event['gate_id']
+    code = make_pass(offline_event)
+    scan = _offline_scan(code, gate_id, '2026-10-16T09:00:00Z')
+
+    response = _sync(client, [
+        scan,
+        _offline_scan('NEVER-ISSUED', gate_id, '2026-10-16T09:00:00Z'),
+        _offline_scan(code, gate_id, '2026-10-16T09:00:00Z', status='admitted'),
+        _offline_scan(code, 999999, '2026-10-16T09:00:00Z'),
+        _offline_scan(code, gate_id, 'not a time'),
+        dict(scan, pass_code=code.lower()),
+    ])
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [r['status'] for r in body['results']] == [
+        'synced', 'not_found', 'invalid', 'invalid', 'invalid', 'duplicate']
+    assert body['results'][5]['message'] == 'Same validation as item 0'
+    assert (body['synced'], body['duplicates'], body['failed']) == (1, 1, 4)
+
+    # Re-uploading after a lost response stores nothing twice.
+    again = _sync(client, [scan]).get_json()
+    assert again['results'][0] == {'index': 0, 'status': 'duplicate', 'message': 'Already synced'}
+    with app.app_context():
+        event_pass = EventPass.query.filter_by(pass_code=code).one()
+        assert (event_pass.is_validated, event_pass.validation_count) == (True, 1)
+        assert len(event_pass.validation_logs) == 1
+
+
+def _statements(client, validations):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        assert _sync(client, validations).get_json()['synced'] == len(validations)
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    return len(statements)
+
+
+def test_offline_sync_queries_do_not_grow_with_the_upload(offline_event):
+    client = login(offline_event['user_id'])
+
+    def upload(size):
+        return [_offline_scan(make_pass(offline_event), offline_event['gate_id'], '2026-10-16T09:30:00')
+                for _ in range(size)]
+
+    assert _statements(client, upload(2)) == _statements(client, upload(20))
+
+
+def test_merge_offline_scans_lets_the_earliest_success_win():
+    admitted = datetime(2026, 10, 16, 10, 0)
+    records = [
+        {'index': 0, 'pass_id': 1, 'validation_time': admitted + timedelta(minutes=5), 'validation_status': 'success'},
+        {'index': 1, 'pass_id': 1, 'validation_time': admitted, 'validation_status': 'success'},
+        {'index': 2, 'pass_id': 2, 'validation_time': admitted, 'validation_status': 'success'},
+    ]
+    # Pass 2 was admitted online after the offline scan: the offline scan supersedes it.
+    plan = merge_offline_scans(records, {1: False, 2: True}, {2: admitted + timedelta(hours=1)})
+
+    assert [r['validation_status'] for r in records] == ['duplicate', 'success', 'success']
+    assert records[1].get('admits') and not records[2].get('admits')
+    assert plan.admitted == {1}
+    assert plan.superseded == {2: admitted}
+
+
+def test_offline_sync_supersedes_a_later_online_admission(offline_event):
+    code = make_pass(offline_event)
+    client = login(offline_event['user_id'])
+    assert client.post('/validate', json={'code': code, 'gate_id': offline_event['gate_id']}).status_code == 200
+
+    response = _sync(client, [_offline_scan(code, offline_event['vip_gate_id'], '2000-01-01T10:00:00')])
+    assert response.get_json()['synced'] == 1
+    with app.app_context():
+        event_pass = EventPass.query.filter_by(pass_code=code).one()
+        assert (event_pass.is_validated, event_pass.validation_count) == (True, 1)
+        logs = sorted(event_pass.validation_logs, key=lambda log: log.validation_time)
+        assert [log.validation_status for log in logs] == ['success', 'duplicate']
+        assert logs[1].validation_message.startswith('Duplicate admission')
+        assert GateValidationLog.query.filter_by(validation_log_id=logs[1].id).one().gate_access_granted is False
+        alert = RealtimeAlert.query.filter_by(pass_id=event_pass.id, alert_type='duplicate_entry').one()
+        assert alert.alert_message.startswith(f'Pass {code} admitted 2 times across offline sync')
+        assert alert.severity == 'medium'
+
+
+def test_offline_double_admissions_keep_one_entry(offline_event):
+    code = make_pass(offline_event)
+    response = _sync(login(offline_event['user_id']), [
+        _offline_scan(code, offline_event['gate_id'], '2026-10-16T11:05:00', validator_id=offline_event['security_id']),
+        _offline_scan(code, offline_event['vip_gate_id'], '2026-10-16T11:00:00'),
+    ])
+    assert [r['status'] for r in response.get_json()['results']] == ['synced', 'synced']
+    with app.app_context():
+        event_pass = EventPass.query.filter_by(pass_code=code).one()
+        assert event_pass.validation_count == 1
+        statuses = {log.validation_time.minute: log.validation_status for log in event_pass.validation_logs}
+        assert statuses == {0: 'success', 5: 'duplicate'}
+        alert = RealtimeAlert.query.filter_by(pass_id=event_pass.id, alert_type='duplicate_entry').one()
+        assert alert.gate_id == offline_event['gate_id'] and 'duplicates at Field Gate' in alert.alert_message
+
+
+def test_async_uploads_are_staged_for_the_drain(offline_event, monkeypatch):
+    woken = []
+    monkeypatch.setattr(offline_queue, '_worker', SimpleNamespace(wake=lambda: woken.append(True)))
+    client = login(offline_event['user_id'])
+    code = make_pass(offline_event)
+
+    response = _sync(client, [
+        _offline_scan(code, offline_event['gate_id'], '2026-10-16T12:00:00'),
+        _offline_scan(code, offline_event['gate_id'], 'noon'),
+    ], **{'async': 1})
+    assert response.status_code == 202 and woken
+    body = response.get_json()
+    assert (body['queued'], body['rejected']) == (1, 1)
+    status = client.get(body['status_url']).get_json()
+    assert (status['counts'], status['complete']) == ({'pending': 1, 'synced': 0, 'failed': 0}, False)
+    assert login(offline_event['security_id']).get(body['status_url']).status_code == 403
+
+    with app.app_context():
+        assert [r['status'] for r in drain_offline_queue(upload_id=body['upload_id']).values()] == ['synced']
+    status = client.get(body['status_url']).get_json()
+    assert (status['counts']['synced'], status['complete']) == (1, True)
+    assert client.get('/gates/offline/sync/no-such-upload').status_code == 404
+
+
+def test_async_uploads_are_synced_inline_without_a_worker(offline_event):
+    code = make_pass(offline_event)
+    response = _sync(login(offline_event['user_id']),
+                     [_offline_scan(code, offline_event['gate_id'], '2026-10-16T12:00:00')], **{'async': 1})
+    assert response.status_code == 200 and response.get_json()['synced'] == 1
+
+
+def test_queue_leases_expire_and_failures_are_retried(offline_event, monkeypatch):
+    code = make_pass(offline_event)
+    scan = {'pass_code': code, 'gate_id': offline_event['gate_id'], 'validation_status': 'success',
+            'validation_time': '2026-10-16T12:30:00'}
+    with app.app_context():
+        upload_id, _ = enqueue_offline_upload([scan], offline_event['user_id'], wake=False)
+        # A drain that claimed the row and died: the lease keeps it from others until it expires.
+        assert len(offline_queue._claim(10, upload_id)) == 1
+        assert drain_offline_queue(upload_id=upload_id) == {}
+
+        monkeypatch.setattr(offline_queue, 'OFFLINE_QUEUE_CLAIM_TIMEOUT_SECONDS', -1)
+        monkeypatch.setattr(offline_queue, 'OFFLINE_QUEUE_MAX_ATTEMPTS', 3)
+
+        def broken_store(records, results):
+            raise RuntimeError('database went away')
+        monkeypatch.setattr(offline_queue, 'store_offline_records', broken_store)
+        drain_offline_queue(upload_id=upload_id)
+        status = offline_upload_status(upload_id)
+        assert status['counts']['pending'] == 1 and status['errors'][0]['attempts'] == 2
+
+        drain_offline_queue(upload_id=upload_id)
+        status = offline_upload_status(upload_id)
+        assert status['counts']['failed'] == 1 and status['errors'][0]['message'] == 'Not processed'
+
+
+def _ticket_statuses(hash_set):
+    hashes, status = base64.b64decode(hash_set['hashes']), base64.b64decode(hash_set['status'])
+    size = hash_set['hash_bytes']
+    digests = [hashes[i:i + size] for i in range(0, len(hashes), size)]
+    assert digests == sorted(digests) and len(digests) == len(status) == hash_set['count']
+    return dict(zip(digests, status))
+
+
+def test_bundle_ships_tickets_as_a_hashed_code_set(offline_event, monkeypatch, tmp_path):
+    monkeypatch.setattr(offline_bundle, 'OFFLINE_DELTA_OVERLAP_SECONDS', 0)
+    client = login(offline_event['user_id'])
+    ticket_id, ticket_code, barcode = make_ticket(offline_event)
+    code_hash, barcode_hash = ticket_code_hash(f' {ticket_code.lower()} '), ticket_code_hash(barcode)
+
+    response = _download(client, offline_event['event_id'])
+    statuses = _ticket_statuses(response.get_json()['tickets'])
+    assert (statuses[code_hash], statuses[barcode_hash]) == (0, 0)
+    assert ticket_code.encode() not in response.data and barcode.encode() not in response.data
+    cursor = response.headers['X-Offline-Cursor']
+    pytime.sleep(0.01)
+
+    assert client.post('/validate', json={'code': barcode, 'gate_id': offline_event['gate_id']}).status_code == 200
+    bundle = json.loads(gzip.decompress(_download(client, offline_event['event_id'], format='columnar').data))
+    assert _ticket_statuses(bundle['tickets'])[code_hash] == TICKET_STATUS_BITS['used']
+
+    delta = _download(client, offline_event['event_id'], since=cursor).get_json()
+    assert delta['tickets'] == [{'id': ticket_id, 'ticket_code_hash': code_hash.hex(),
+                                 'barcode_hash': barcode_hash.hex(), 'status': TICKET_STATUS_BITS['used']}]
+
+    path = tmp_path / 'bundle.sqlite'
+    path.write_bytes(gzip.decompress(_download(client, offline_event['event_id'], format='sqlite').data))
+    conn = sqlite3.connect(path)
+    try:
+        row = conn.execute('SELECT status FROM tickets WHERE code_hash = ?', (barcode_hash,)).fetchone()
+        assert row == (TICKET_STATUS_BITS['used'],)
+    finally:
+        conn.close()
+
+
+def _pass_id(code):
+    with app.app_context():
+        return EventPass.query.filter_by(pass_code=code).one().id
+
+
+def test_consumed_feed_wakes_on_a_scan(offline_event, monkeypatch):
+    monkeypatch.setattr(consumed_feed, 'OFFLINE_DELTA_OVERLAP_SECONDS', 0)
+    monkeypatch.setattr(consumed_feed, 'CONSUMED_FEED_POLL_SECONDS', 30)  # only the commit can wake the poll
+    client = login(offline_event['user_id'])
+    code = make_pass(offline_event)
+    ticket_id, ticket_code, barcode = make_ticket(offline_event)
+    cursor = _download(client, offline_event['event_id']).headers['X-Offline-Cursor']
+    url = f'/gates/offline/consumed/{offline_event["event_id"]}?since={cursor}'
+    pytime.sleep(0.01)
+
+    idle = client.get(f'{url}&timeout=0').get_json()
+    assert (idle['passes'], idle['tickets']) == ([], [])
+
+    scanner = login(offline_event['user_id'])
+    scans = threading.Timer(0.2, lambda: [
+        scanner.post('/validate', json={'code': scanned, 'gate_id': offline_event['gate_id']})
+        for scanned in (code, barcode)
+    ])
+    started = pytime.monotonic()
+    scans.start()
+    try:
+        response = client.get(f'{url}&timeout=5')
+    finally:
+        scans.join()
+    assert pytime.monotonic() - started < 5
+    body = response.get_json()
+    assert body['passes'] == [_pass_id(code)] and int(response.headers['X-Offline-Cursor']) == body['cursor']
+    if not body['tickets']:  # woken by the pass before the ticket committed
+        body = client.get(f'{url}&timeout=0').get_json()
+    assert body['tickets'] == [{'id': ticket_id, 'ticket_code_hash': ticket_code_hash(ticket_code).hex(),
+                                'barcode_hash': ticket_code_hash(barcode).hex()}]
+
+
+def test_consumed_feed_answers_at_once_past_the_waiter_cap(offline_event, monkeypatch):
+    monkeypatch.setattr(consumed_feed, 'CONSUMED_FEED_MAX_WAITERS', 0)
+    client = login(offline_event['user_id'])
+    started = pytime.monotonic()
+    response = client.get(f'/gates/offline/consumed/{offline_event["event_id"]}?since=0&timeout=5')
+    assert response.status_code == 200 and pytime.monotonic() - started < 5
+    assert int(response.headers['Retry-After']) >= 1
+
+
+def test_consumed_feed_rejects_bad_requests(offline_event):
+    url = f'/gates/offline/consumed/{offline_event["event_id"]}'
+    client = login(offline_event['user_id'])
+    assert client.get(f'{url}?timeout=0').status_code == 400
+    assert client.get(f'{url}?since=soon&timeout=0').status_code == 400
+    assert client.get(f'{url}?since=0&timeout=later').status_code == 400
+    assert login(offline_event['security_id']).get(f'{url}?since=0&timeout=0').status_code == 403
@@ -0,0 +1,648 @@
+import json
+import logging
+import re
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from cryptography.fernet import Fernet
+from sqlalchemy import event, text
+
+from app import app, db
+from conftest import login, make_pass, make_ticket
+from models import (EventPass, EventScannerAssignment, Gate, RealtimeAlert, Ticket, TicketGateValidationLog, User,
+                    payload_digest)
+from routes import validation
+from routes.validation import _resolve_pass
+from utils import (code_filter, duplicate_detector, gate_access, replay_cache, scan_log_writer, scan_metrics,
+                   scan_rate_limit, scanner_access)
+from utils.credential_index import drop_event, index_event, lookup_credential
+from utils.gate_access import get_gate_access, refresh_gate
+from utils.legacy_payloads import migrate_legacy_payloads
+from utils.pass_tokens import issue_pass_token, verify_pass_token
+from utils.scan_log_writer import ScanLogWriter, pass_scan_record
+from utils.scan_metrics import scan_latency_stats
+from utils.scanner_access import invalidate_gate_scope, user_gate_scope_for_event
+from utils.schema_upgrades import upgrade_schema
+from utils.ticket_consumption import consume_ticket
+
+
+def _pass_state(code):
+    with app.app_context():
+        event_pass = EventPass.query.filter_by(pass_code=code).first()
+        logs = sorted(event_pass.validation_logs, key=lambda log: log.validation_time)
+        return event_pass.is_validated, event_pass.validation_count, [log.validation_status for log in logs]
+
+
+def test_credential_index_resolves_passes_and_tickets(scan_event):
+    code = make_pass(scan_event)
+    ticket_id, ticket_code, barcode = make_ticket(scan_event)
+
+    entry = lookup_credential(f'  {code.lower()} ')
+    assert entry.kind == 'pass' and entry.event_id == scan_event['event_id']
+    assert entry.pass_type_id == scan_event['pass_type_id']
+    assert lookup_credential(ticket_code.lower()) == lookup_credential(barcode)
+    assert lookup_credential(barcode) == ('ticket', ticket_id, scan_event['event_id'], None)
+    assert lookup_credential('NO-SUCH-CODE') is None
+
+
+def test_credential_index_follows_event_lifecycle(scan_event):
+    code = make_pass(scan_event)
+    with app.app_context():
+        drop_event(scan_event['event_id'])
+        assert lookup_credential(code) is None
+        index_event(scan_event['event_id'])
+        assert lookup_credential(code).kind == 'pass'
+
+
+def test_validate_admits_an_indexed_pass_once(scan_event):
+    code = make_pass(scan_event)
+    client = login(scan_event['user_id'])
+
+    response = client.post('/validate', json={'code': code.lower(), 'gate_id': scan_event['gate_id']})
+    assert response.status_code == 200 and response.get_json()['success']
+    response = client.post('/validate', json={'code': code, 'gate_id': scan_event['gate_id']})
+    assert response.status_code == 400
+    assert _pass_state(code) == (True, 1, ['success', 'duplicate'])
+
+
+def test_gate_access_matrix_follows_gate_changes(scan_event):
+    make_pass(scan_event, pass_type_id=scan_event['vip_pass_type_id'])
+    client = login(scan_event['user_id'])
+    vip, participant = scan_event['vip_pass_type_id'], scan_event['pass_type_id']
+
+    client.post(f'/gates/create/{scan_event["event_id"]}', data={
+        'gate_name': 'Side Door', 'gate_type': 'General', 'is_active': 'on', 'pass_types': [str(vip)],
+    })
+    with app.app_context():
+        gate_id = Gate.query.filter_by(event_id=scan_event['event_id'], gate_name='Side Door').one().id
+    assert client.get(f'/gates/api/check-access/{gate_id}/{vip}').get_json()['can_access']
+    assert not client.get(f'/gates/api/check-access/{gate_id}/{participant}').get_json()['can_access']
+
+    client.post(f'/gates/update/{gate_id}', data={
+        'gate_name': 'Side Door', 'gate_type': 'General', 'is_active': 'on', 'pass_types': [str(participant)],
+    })
+    assert get_gate_access(gate_id).check(participant)[0]
+    assert not get_gate_access(gate_id).check(vip)[0]
+
+    client.post(f'/gates/delete/{gate_id}')
+    assert get_gate_access(gate_id) is None
+
+
+def test_gate_access_remembers_unknown_gates(scan_event, monkeypatch):
+    with app.app_context():
+        assert get_gate_access(987654) is None
+        compiled = []
+        monkeypatch.setattr(gate_access, 'compile_gates', lambda gate_ids=None: compiled.append(gate_ids))
+
+        assert get_gate_access(987654) is None
+        assert compiled == []
+
+
+def test_scanner_scope_is_cached_until_the_assignment_changes(scan_event, monkeypatch):
+    with app.app_context():
+        scanner = User(username='scope-scanner', email='scope-scanner@example.com', password_hash='hash',
+                       full_name='Scope Scanner', role='security')
+        db.session.add(scanner)
+        db.session.commit()
+        assignment = EventScannerAssignment(event_id=scan_event['event_id'], scanner_user_id=scanner.id,
+                                            gate_id=scan_event['vip_gate_id'], assigned_by_user_id=scan_event['user_id'])
+        db.session.add(assignment)
+        db.session.commit()
+        scanner_id, assignment_id = scanner.id, assignment.id
+
+        assert user_gate_scope_for_event(scanner, scan_event['event_id']) == {scan_event['vip_gate_id']}
+        with monkeypatch.context() as patched:
+            patched.setattr(scanner_access, '_load_gate_scope', lambda user, event_id: pytest.fail('scope reloaded'))
+            assert user_gate_scope_for_event(scanner, scan_event['event_id']) == {scan_event['vip_gate_id']}
+
+    login(scan_event['user_id']).post(f'/events/{scan_event["event_id"]}/scanners/{assignment_id}/delete')
+    with app.app_context():
+        scanner = db.session.get(User, scanner_id)
+        assert user_gate_scope_for_event(scanner, scan_event['event_id']) == frozenset()
+
+
+def test_scanner_scope_cache_evicts_the_oldest_entries(scan_event, monkeypatch):
+    monkeypatch.setattr(scanner_access, 'SCANNER_SCOPE_CACHE_MAX_ENTRIES', 2)
+    invalidate_gate_scope()
+    with app.app_context():
+        security = db.session.get(User, scan_event['security_id'])
+        organizer = db.session.get(User, scan_event['user_id'])
+        user_gate_scope_for_event(security, scan_event['event_id'])
+        user_gate_scope_for_event(security, scan_event['other_event_id'])
+        user_gate_scope_for_event(organizer, scan_event['event_id'])
+
+    assert list(scanner_access._scope_cache) == [
+        (scan_event['security_id'], scan_event['other_event_id']),
+        (scan_event['user_id'], scan_event['event_id']),
+    ]
+
+
+def test_validate_enforces_the_scanner_gate_scope(scan_event):
+    code = make_pass(scan_event, pass_type_id=scan_event['vip_pass_type_id'])
+    client = login(scan_event['security_id'])
+
+    assert client.post('/validate', json={'code': code, 'gate_id': scan_event['vip_gate_id']}).status_code == 403
+    assert client.post('/validate', json={'code': code, 'gate_id': scan_event['gate_id']}).status_code == 200
+
+
+def test_batch_rejects_bad_items_without_failing_the_rest(scan_event):
+    code = make_pass(scan_event)
+    ticket_id, ticket_code, _ = make_ticket(scan_event)
+    response = login(scan_event['user_id']).post('/validate/batch', json={'scans': [
+        {'code': code, 'gate_id': scan_event['gate_id']},
+        {'code': 12345, 'gate_id': scan_event['gate_id']},
+        {'code': code, 'gate_id': scan_event['gate_id'], 'idempotency_key': ['not', 'a', 'string']},
+        'not an item',
+        {'code': 'NO-SUCH-CODE', 'gate_id': scan_event['gate_id']},
+        {'code': ticket_code, 'gate_id': scan_event['gate_id']},
+        {'code': code, 'gate_id': scan_event['gate_id']},
+    ]})
+
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert [r['index'] for r in results] == list(range(7))
+    assert [r['status'] for r in results] == [200, 400, 400, 400, 404, 200, 400]
+    assert _pass_state(code) == (True, 1, ['success', 'duplicate'])
+    with app.app_context():
+        assert db.session.get(Ticket, ticket_id).status == 'used'
+
+
+def test_batch_rejects_a_malformed_body(scan_event):
+    client = login(scan_event['user_id'])
+    assert client.post('/validate/batch', json={'scans': 'nope'}).status_code == 400
+    assert client.post('/validate/batch', json=[]).status_code == 400
+
+
+def test_write_behind_logs_are_written_after_the_scan_commits(scan_event, monkeypatch):
+    code = make_pass(scan_event)
+    ticket_id, ticket_code, _ = make_ticket(scan_event)
+    writer = ScanLogWriter(app)  # not started: records wait in the queue until flushed
+    monkeypatch.setattr(scan_log_writer, '_writer', writer)
+    client = login(scan_event['user_id'])
+
+    assert client.post('/validate', json={'code': code, 'gate_id': scan_event['gate_id']}).status_code == 200
+    assert client.post('/validate', json={'code': ticket_code, 'gate_id': scan_event['gate_id']}).status_code == 200
+    assert writer.queue.qsize() == 2
+    assert _pass_state(code) == (True, 1, [])
+
+    writer.flush()
+    assert _pass_state(code) == (True, 1, ['success'])
+    with app.app_context():
+        assert TicketGateValidationLog.query.filter_by(ticket_id=ticket_id).one().validation_status == 'success'
+        assert writer.stats()['written'] == 2
+
+
+def test_write_behind_drops_only_the_bad_record(scan_event, monkeypatch):
+    code = make_pass(scan_event)
+    with app.app_context():
+        pass_id = EventPass.query.filter_by(pass_code=code).one().id
+    monkeypatch.setattr(scan_log_writer, 'SCAN_LOG_MAX_RETRIES', 1)
+    writer = ScanLogWriter(app, maxsize=1)
+
+    def record(status):
+        validation = {'pass_id': pass_id, 'validator_id': scan_event['user_id'], 'validation_status': status}
+        return pass_scan_record(validation, {'gate_id': scan_event['gate_id'], 'gate_access_granted': True})
+
+    # The first record is queued; the queue is full, so the rest are written inline.
+    writer.submit([record('success'), record('duplicate'), record(None), record('failed')])
+    writer.flush()
+
+    stats = writer.stats()
+    assert (stats['enqueued'], stats['inline_writes'], stats['written'], stats['failed']) == (1, 3, 3, 1)
+    assert sorted(_pass_state(code)[2]) == ['duplicate', 'failed', 'success']
+
+
+def test_consume_ticket_has_a_single_winner(scan_event):
+    ticket_id, _, _ = make_ticket(scan_event)
+
+    # Both sessions load the ticket while it is still available.
+    with app.app_context():
+        first = db.session.get(Ticket, ticket_id)
+        with app.app_context():
+            second = db.session.get(Ticket, ticket_id)
+            assert consume_ticket(second, scan_event['user_id'])
+            db.session.commit()
+        assert not consume_ticket(first, scan_event['user_id'])
+        assert first.status == 'used' and first.scanned_by == str(scan_event['user_id'])
+        db.session.commit()
+
+
+def test_concurrent_ticket_scans_admit_once(scan_event):
+    _, ticket_code, _ = make_ticket(scan_event)
+    barrier = threading.Barrier(4)
+    statuses = []
+
+    def scan():
+        client = login(scan_event['user_id'])
+        barrier.wait()
+        response = client.post('/validate', json={'code': ticket_code, 'gate_id': scan_event['gate_id']})
+        statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=scan) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(statuses) == [200, 400, 400, 400]
+
+
+def test_code_keys_follow_the_codes(scan_event):
+    code = make_pass(scan_event)
+    ticket_id, ticket_code, barcode = make_ticket(scan_event)
+    with app.app_context():
+        event_pass = EventPass.query.filter_by(pass_code=code).one()
+        assert event_pass.pass_code_key == code.upper()
+        assert _resolve_pass(f' {code.lower()} ').id == event_pass.id
+
+        event_pass.pass_code = f'{code}-r2'
+        db.session.commit()
+        assert event_pass.pass_code_key == f'{code}-R2'
+        ticket = db.session.get(Ticket, ticket_id)
+        assert (ticket.ticket_code_key, ticket.barcode_key) == (ticket_code, barcode.upper())
+
+    response = login(scan_event['user_id']).post('/tickets/scan/by-code', json={'code': ticket_code.lower()})
+    assert response.get_json()['success']
+
+
+def test_schema_upgrade_backfills_missing_code_keys(scan_event):
+    code = make_pass(scan_event)
+    with app.app_context():
+        db.session.execute(text('UPDATE event_passes SET pass_code_key = NULL WHERE pass_code = :code'),
+                           {'code': code})
+        db.session.commit()
+        upgrade_schema()
+        assert EventPass.query.filter_by(pass_code=code).one().pass_code_key == code.upper()
+
+
+def test_legacy_payloads_are_found_by_digest(scan_event):
+    payload = f'opaque-legacy-payload-{uuid.uuid4().hex}'
+    code = make_pass(scan_event, encrypted_data=payload)
+    with app.app_context():
+        event_pass = EventPass.query.filter_by(pass_code=code).one()
+        assert event_pass.encrypted_data_digest == payload_digest(payload)
+        assert _resolve_pass(payload).id == event_pass.id
+        assert _resolve_pass(payload.upper()) is None
+
+        db.session.execute(text('UPDATE event_passes SET encrypted_data_digest = NULL WHERE id = :id'),
+                           {'id': event_pass.id})
+        db.session.commit()
+        upgrade_schema()
+        db.session.refresh(event_pass)
+        assert event_pass.encrypted_data_digest == payload_digest(payload)
+
+
+def _insert_pass_elsewhere(scan_event, pass_id, code):
+    # Committed without registering the code, as another worker's insert would be.
+    with app.app_context():
+        db.session.add(EventPass(id=pass_id, event_id=scan_event['event_id'], pass_type_id=scan_event['pass_type_id'],
+                                 pass_code=code, encrypted_data=code, participant_name='Elsewhere'))
+        db.session.commit()
+
+
+def test_code_filter_trusts_itself_between_catch_ups(scan_event, monkeypatch):
+    monkeypatch.setattr(code_filter, 'CODE_FILTER_ENABLED', True)
+    with app.app_context():
+        code_filter.warm_code_filter()
+    code = make_pass(scan_event)
+    assert code_filter.code_may_exist(code.lower())
+    assert code_filter.code_may_exist('{"pass_code": "NEVER-ISSUED"}')
+
+    _insert_pass_elsewhere(scan_event, 800000, 'FILTER-ELSEWHERE-1')
+    with app.app_context():
+        assert not code_filter.code_may_exist('FILTER-ELSEWHERE-1')
+        code_filter._state['synced_at'] = 0  # refresh interval elapsed
+        assert code_filter.code_may_exist('FILTER-ELSEWHERE-1')
+
+
+def test_code_filter_catches_up_on_out_of_order_rows(scan_event, monkeypatch):
+    monkeypatch.setattr(code_filter, 'CODE_FILTER_ENABLED', True)
+    monkeypatch.setattr(code_filter, 'CODE_FILTER_REFRESH_SECONDS', 0)
+    with app.app_context():
+        code_filter.warm_code_filter()
+    _insert_pass_elsewhere(scan_event, 900000, 'FILTER-HIGH-1')
+    with app.app_context():
+        assert code_filter.code_may_exist('FILTER-HIGH-1')
+
+    # Committed later but with a lower id than the last one seen (e.g. a slow
+    # transaction in another worker): the created_at watermark still finds it.
+    _insert_pass_elsewhere(scan_event, 899999, 'FILTER-LOW-1')
+    with app.app_context():
+        assert code_filter.code_may_exist('FILTER-LOW-1')
+        assert not code_filter.code_may_exist('FILTER-NEVER-ISSUED')
+
+
+def test_validate_rejects_unknown_codes_before_the_db(scan_event, monkeypatch):
+    monkeypatch.setattr(code_filter, 'CODE_FILTER_ENABLED', True)
+    with app.app_context():
+        code_filter.warm_code_filter()
+    rejected = code_filter.code_filter_stats()['rejected']
+
+    client = login(scan_event['user_id'])
+    response = client.post('/validate', json={'code': 'NEVER-ISSUED', 'gate_id': scan_event['gate_id']})
+    assert response.status_code == 404
+    assert code_filter.code_filter_stats()['rejected'] == rejected + 1
+
+
+def test_scan_stages_are_traced_per_gate(scan_event, monkeypatch, caplog):
+    code = make_pass(scan_event, pass_type_id=scan_event['vip_pass_type_id'])
+    monkeypatch.setattr(scan_metrics, 'SLOW_SCAN_THRESHOLD_MS', 0)
+    slow_scans = scan_latency_stats()['slow_scans']
+
+    with caplog.at_level(logging.WARNING, logger='utils.scan_metrics'):
+        response = login(scan_event['user_id']).post(
+            '/validate', json={'code': code, 'gate_id': scan_event['vip_gate_id']})
+    assert response.status_code == 200
+
+    stats = scan_latency_stats()
+    assert stats['slow_scans'] == slow_scans + 1
+    stages = stats['gates'][str(scan_event['vip_gate_id'])]
+    assert {'resolve_pass', 'gate_rules', 'state_update', 'commit', 'total'} <= set(stages)
+    assert stages['total']['p50_ms'] <= stages['total']['p99_ms'] <= stages['total']['max_ms']
+
+    slow_log = json.loads(caplog.records[-1].getMessage().split(' ', 2)[2])
+    assert slow_log['gate_id'] == scan_event['vip_gate_id'] and slow_log['status'] == 200
+    assert 'resolve_pass' in slow_log['stages_ms']
+
+
+def _selected_tables(client, body):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        response = client.post('/validate', json=body)
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    tables = [re.search(r'\bFROM (\w+)', s).group(1) for s in statements if s.lstrip().startswith('SELECT')]
+    return response, tables
+
+
+def test_scan_responses_load_related_rows_with_the_credential(scan_event):
+    client = login(scan_event['user_id'])
+    client.post('/validate', json={'code': make_pass(scan_event), 'gate_id': scan_event['gate_id']})  # warm caches
+    ticket_id, ticket_code, _ = make_ticket(scan_event)
+
+    response, tables = _selected_tables(client, {'code': make_pass(scan_event), 'gate_id': scan_event['gate_id']})
+    assert response.status_code == 200
+    assert response.get_json()['pass_info']['event'] == 'Scan Pipeline Event'
+    assert tables.count('event_passes') == 1
+    assert not {'events', 'pass_types'} & set(tables)
+
+    response, tables = _selected_tables(client, {'code': ticket_code, 'gate_id': scan_event['gate_id']})
+    assert response.status_code == 200
+    assert response.get_json()['pass_info']['event'] == 'Scan Pipeline Event'
+    assert tables.count('tickets') == 1
+    assert not {'events', 'ticket_batches'} & set(tables)
+
+
+def _duplicate_alerts(code):
+    with app.app_context():
+        pass_id = EventPass.query.filter_by(pass_code=code).one().id
+        alerts = RealtimeAlert.query.filter_by(pass_id=pass_id, alert_type='duplicate_entry').all()
+        return [(alert.alert_message, alert.severity) for alert in alerts]
+
+
+def test_passback_raises_one_duplicate_alert_per_window(scan_event):
+    code = make_pass(scan_event, pass_type_id=scan_event['vip_pass_type_id'])
+    client = login(scan_event['user_id'])
+
+    assert client.post('/validate', json={'code': code, 'gate_id': scan_event['vip_gate_id']}).status_code == 200
+    assert _duplicate_alerts(code) == []
+    assert client.post('/validate', json={'code': code, 'gate_id': scan_event['gate_id']}).status_code == 400
+    assert client.post('/validate', json={'code': code, 'gate_id': scan_event['gate_id']}).status_code == 400
+
+    assert _duplicate_alerts(code) == [
+        (f'Pass {code} (Guest) scanned 2 times within 5 min (1 entries) at VIP Lounge, Main', 'high'),
+    ]
+
+
+def test_scans_before_admission_are_not_duplicates(scan_event):
+    code = make_pass(scan_event)
+    client = login(scan_event['user_id'])
+
+    assert client.post('/validate', json={'code': code, 'gate_id': scan_event['vip_gate_id']}).status_code == 403
+    assert client.post('/validate', json={'code': code, 'gate_id': scan_event['gate_id']}).status_code == 200
+    assert _duplicate_alerts(code) == []
+
+
+def test_admission_seen_by_another_worker_counts_as_an_attempt(scan_event):
+    code = make_pass(scan_event)
+    client = login(scan_event['user_id'])
+    assert client.post('/validate', json={'code': code, 'gate_id': scan_event['gate_id']}).status_code == 200
+
+    duplicate_detector._attempts.clear()  # this worker never saw the admission
+    assert client.post('/validate', json={'code': code, 'gate_id': scan_event['gate_id']}).status_code == 400
+    assert len(_duplicate_alerts(code)) == 1
+
+
+def _pass_token(code, **changes):
+    with app.app_context():
+        event_pass = EventPass.query.filter_by(pass_code=code).one()
+        for name, value in changes.items():
+            setattr(event_pass, name, value)
+        token = issue_pass_token(event_pass)
+        db.session.rollback()
+        return token
+
+
+def test_pass_tokens_verify_without_the_db(scan_event):
+    code = make_pass(scan_event)
+    token = _pass_token(code)
+    with app.app_context():
+        pass_id = EventPass.query.filter_by(pass_code=code).one().id
+        parsed, error = verify_pass_token(token.lower())
+        assert error is None
+        assert (parsed.event_id, parsed.pass_id, parsed.pass_type_id) == (
+            scan_event['event_id'], pass_id, scan_event['pass_type_id'])
+
+        # Upgrading the pass type (or moving the pass to another event) breaks the signature.
+        parts = token.split('.')
+        parts[3] = str(scan_event['vip_pass_type_id'])
+        assert verify_pass_token('.'.join(parts)) == (None, 'Invalid pass token signature')
+        parts = token.split('.')
+        parts[1] = str(scan_event['other_event_id'])
+        assert verify_pass_token('.'.join(parts)) == (None, 'Invalid pass token signature')
+        assert verify_pass_token('PT1.1.2.3') == (None, 'Malformed pass token')
+
+
+def test_validate_rejects_tokens_before_loading_the_pass(scan_event):
+    code = make_pass(scan_event)
+    token = _pass_token(code)
+    client = login(scan_event['user_id'])
+
+    response, tables = _selected_tables(client, {'code': token, 'gate_id': scan_event['vip_gate_id']})
+    assert response.status_code == 403
+    assert 'event_passes' not in tables
+    forged = token[:-1] + ('A' if token[-1] != 'A' else 'B')
+    response = client.post('/validate', json={'code': forged, 'gate_id': scan_event['gate_id']})
+    assert response.status_code == 403
+    expired = _pass_token(make_pass(scan_event), expires_at=datetime.utcnow() - timedelta(minutes=1))
+    assert client.post('/validate', json={'code': expired, 'gate_id': scan_event['gate_id']}).status_code == 400
+
+    response = client.post('/validate', json={'code': token, 'gate_id': scan_event['gate_id']})
+    assert response.status_code == 200
+    assert _pass_state(code) == (True, 1, ['failed', 'success'])
+
+
+def test_legacy_payload_migration_aliases_json_and_fernet(scan_event, monkeypatch):
+    cipher = Fernet(Fernet.generate_key())
+    fernet_code = make_pass(scan_event)
+    plaintext = json.dumps({'pass_code': fernet_code.lower(), 'event': 'Scan Pipeline Event'})
+    token = cipher.encrypt(plaintext.encode()).decode()
+    json_code = f'EVT{scan_event["event_id"]:04d}-PAR-{uuid.uuid4().hex[:6].upper()}-1'
+    make_pass(scan_event, pass_code=json_code, encrypted_data=f'{{"pass_code": "{json_code}"}}')
+    with app.app_context():
+        fernet_pass = EventPass.query.filter_by(pass_code=fernet_code).one()
+        fernet_pass.encrypted_data = token
+        db.session.commit()
+        fernet_id = fernet_pass.id
+        json_id = EventPass.query.filter_by(pass_code=json_code).one().id
+
+        stats = migrate_legacy_payloads(batch_size=2, cipher=cipher)
+        assert stats['aliases'] >= 3 and stats['unresolved'] == 0
+        assert migrate_legacy_payloads(cipher=cipher)['aliases'] == 0
+
+        # With the decrypt fallback off, every legacy form resolves through the alias table.
+        monkeypatch.setattr(validation, 'LEGACY_DECRYPT_FALLBACK', False)
+        monkeypatch.setattr(validation, 'cipher', None)
+        assert _resolve_pass(token).id == fernet_id
+        assert _resolve_pass(''.join(plaintext.split())).id == fernet_id
+        assert _resolve_pass(f'{{"pass_code":"{json_code}"}}').id == json_id
+        assert _resolve_pass('{"pass_code":"NEVER-ISSUED"}') is None
+
+
+def test_gate_session_pins_the_gate_context(scan_event):
+    client = login(scan_event['security_id'])
+    assert client.post('/validate/session', json={'gate_id': scan_event['vip_gate_id']}).status_code == 403
+    response = client.post('/validate/session', json={'gate_id': scan_event['gate_id']})
+    assert response.status_code == 200
+    session = response.get_json()
+    assert (session['gate_name'], session['event_name']) == ('Main', 'Scan Pipeline Event')
+    token = session['session_token']
+
+    response, tables = _selected_tables(client, {'code': make_pass(scan_event), 'session_token': token})
+    assert response.status_code == 200
+    assert not {'gates', 'event_scanner_assignments'} & set(tables)
+
+    other_scanner = login(scan_event['user_id'])
+    response = other_scanner.post('/validate', json={'code': make_pass(scan_event), 'session_token': token})
+    assert response.status_code == 403
+    response = client.post('/validate', json={'code': make_pass(scan_event), 'session_token': token[:-2] + 'xx'})
+    assert response.status_code == 401 and response.get_json()['session_expired']
+
+
+def test_gate_sessions_end_when_the_gate_is_deactivated(scan_event):
+    with app.app_context():
+        gate = Gate(event_id=scan_event['event_id'], gate_name='Session Gate', gate_type='General', is_active=True)
+        db.session.add(gate)
+        db.session.commit()
+        gate_id = gate.id
+        refresh_gate(gate_id)
+    client = login(scan_event['user_id'])
+    token = client.post('/validate/session', json={'gate_id': gate_id}).get_json()['session_token']
+    headers = {'X-Gate-Session': token}
+    assert client.post('/validate', json={'code': make_pass(scan_event)}, headers=headers).status_code == 200
+
+    client.post(f'/gates/update/{gate_id}', data={'gate_name': 'Session Gate', 'gate_type': 'General'})
+    response = client.post('/validate', json={'code': make_pass(scan_event)}, headers=headers)
+    assert response.status_code == 401 and response.get_json()['session_expired']
+
+
+def test_replay_claim_is_settled_only_by_its_owner(monkeypatch):
+    monkeypatch.setattr(replay_cache, 'REPLAY_WAIT_SECONDS', 0.05)
+    key = uuid.uuid4().hex
+
+    replayed, claimed = replay_cache.claim_replay(1, 'validate', key)
+    assert replayed is None and claimed
+    # A retry that times out waiting for the original does not own the slot.
+    replayed, claimed = replay_cache.claim_replay(1, 'validate', key)
+    assert replayed is None and not claimed
+
+    replay_cache.settle_replay(1, 'validate', key, {'success': True}, 200)
+    assert replay_cache.claim_replay(1, 'validate', key) == (({'success': True}, 200), False)
+
+
+def test_retried_scans_replay_the_original_result(scan_event):
+    code = make_pass(scan_event)
+    client = login(scan_event['user_id'])
+    key = uuid.uuid4().hex
+
+    # Request errors returned before the scan (here: an unknown gate) are not replayed.
+    response = client.post('/validate', json={'code': code, 'gate_id': 999999, 'idempotency_key': key})
+    assert response.status_code == 400
+    response = client.post('/validate', json={'code': code, 'gate_id': scan_event['gate_id']},
+                           headers={'Idempotency-Key': key})
+    assert response.status_code == 200 and not response.get_json().get('replayed')
+    response = client.post('/validate', json={'code': code, 'gate_id': scan_event['gate_id'], 'idempotency_key': key})
+    assert response.status_code == 200 and response.get_json().get('replayed')
+
+    response = client.post('/validate/batch', json={'scans': [
+        {'code': code, 'gate_id': scan_event['gate_id'], 'idempotency_key': key},
+        {'code': code, 'gate_id': scan_event['gate_id']},
+    ]})
+    assert [(r['status'], r.get('replayed', False)) for r in response.get_json()['results']] == [
+        (200, True), (400, False)]
+    assert _pass_state(code) == (True, 1, ['success', 'duplicate'])
+
+
+def test_unknown_code_loops_are_throttled(scan_event, monkeypatch):
+    monkeypatch.setitem(scan_rate_limit.SCAN_RATE_LIMITS, ('user', 'miss'), (0.01, 3))
+    client = login(scan_event['user_id'])
+    code = make_pass(scan_event)
+
+    for n in range(3):
+        response = client.post('/validate', json={'code': f'GUESS-{n}', 'gate_id': scan_event['gate_id']})
+        assert response.status_code == 404
+    response = client.post('/validate', json={'code': code, 'gate_id': scan_event['gate_id']})
+    assert response.status_code == 429
+    assert response.get_json()['rate_limited'] and int(response.headers['Retry-After']) >= 1
+    assert _pass_state(code) == (False, 0, [])
+
+
+def test_batches_charge_unknown_codes_as_misses(scan_event, monkeypatch):
+    monkeypatch.setitem(scan_rate_limit.SCAN_RATE_LIMITS, ('user', 'miss'), (0.01, 2))
+    client = login(scan_event['user_id'])
+    code = make_pass(scan_event)
+    gate_id = scan_event['gate_id']
+
+    response = client.post('/validate/batch', json={'scans': [
+        {'code': 'GUESS-1', 'gate_id': gate_id},
+        {'code': 'GUESS-2', 'gate_id': gate_id},
+        {'code': code, 'gate_id': gate_id},
+        {'code': 'GUESS-3', 'gate_id': gate_id},
+    ]})
+    assert response.status_code == 200
+    assert [r['status'] for r in response.get_json()['results']] == [404, 404, 429, 429]
+    assert _pass_state(code) == (False, 0, [])
+    assert client.post('/validate/batch', json={'scans': [{'code': code, 'gate_id': gate_id}]}).status_code == 429
+
+
+def test_per_ip_limits_key_on_the_trusted_proxy_address(scan_event, monkeypatch):
+    monkeypatch.setitem(scan_rate_limit.SCAN_RATE_LIMITS, ('ip', 'scan'), (0.01, 2))
+    monkeypatch.setattr(scan_rate_limit, 'SCAN_RATE_TRUSTED_PROXIES', 1)
+    organizer, security = login(scan_event['user_id']), login(scan_event['security_id'])
+
+    def scan(client, forwarded_for):
+        return client.post('/validate', json={'code': make_pass(scan_event), 'gate_id': scan_event['gate_id']},
+                           headers={'X-Forwarded-For': forwarded_for}).status_code
+
+    assert scan(organizer, '10.0.0.7') == 200
+    assert scan(security, '10.0.0.7') == 200
+    # A client-supplied entry left of the proxy's does not buy a fresh bucket.
+    assert scan(security, '192.0.2.1, 10.0.0.7') == 429
+    assert scan(organizer, '10.0.0.8') == 200
+
+
+def test_rate_limit_buckets_are_capped(scan_event, monkeypatch):
+    monkeypatch.setattr(scan_rate_limit, 'SCAN_RATE_LIMIT_MAX_KEYS', 3)
+    with app.test_request_context(environ_base={'REMOTE_ADDR': '10.0.0.9'}):
+        for user_id in range(1, 6):
+            assert scan_rate_limit.check_scan_rate(user_id) is None
+    assert len(scan_rate_limit._buckets) == 3
@@ -0,0 +1,211 @@
+import hashlib
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_
+
+from database import db
+from models import canonical_code, EventPass, Ticket
+from utils.legacy_payloads import is_legacy_payload
+
+
+# Bloom filter over every known canonical pass code, ticket code, barcode and
+# raw legacy payload. A negative answer means the code definitely does not
+# exist, so unknown scans are rejected without touching the DB.
+CODE_FILTER_ENABLED = os.getenv('CODE_FILTER_ENABLED', 'True') == 'True'
+CODE_FILTER_MIN_CAPACITY = int(os.getenv('CODE_FILTER_MIN_CAPACITY', 100000))
+CODE_FILTER_ERROR_RATE = float(os.getenv('CODE_FILTER_ERROR_RATE', 0.01))
+# Codes issued by this process are added as they are committed. Rows created by
+# other workers are picked up by an incremental catch-up, run by at most one
+# request per REFRESH seconds; between catch-ups the filter is trusted, so a code
+# issued on another worker may be rejected here for up to REFRESH seconds.
+# A catch-up reads rows past the last seen ids plus rows created within OVERLAP
+# seconds before the previous catch-up started (ids can commit out of order, e.g.
+# on MySQL), so OVERLAP must cover the longest issuing transaction.
+CODE_FILTER_REFRESH_SECONDS = float(os.getenv('CODE_FILTER_REFRESH_SECONDS', 5))
+CODE_FILTER_OVERLAP_SECONDS = int(os.getenv('CODE_FILTER_OVERLAP_SECONDS', 30))
+
+_lock = threading.Lock()
+_sync_lock = threading.Lock()  # held by the one request running a catch-up
+_filter = None
+_state = {'max_pass_id': 0, 'max_ticket_id': 0, 'created_since': None, 'synced_at': 0.0, 'needs_rebuild': False}
+_stats = {'checks': 0, 'rejected': 0, 'bypassed': 0, 'catch_ups': 0, 'rebuilds': 0}
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter using double hashing over one blake2b digest."""
+
+    def __init__(self, capacity, error_rate=CODE_FILTER_ERROR_RATE):
+        capacity = max(int(capacity), 1)
+        self.capacity = capacity
+        self.size = max(int(-capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.hash_count = max(int(round(self.size / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, value):
+        for pos in self._positions(value):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(value))
+
+    @property
+    def saturated(self):
+        return self.count > self.capacity
+
+
+def _load_codes(min_pass_id=0, min_ticket_id=0, created_since=None):
+    """
+    Return (codes, max_pass_id, max_ticket_id) for rows past the given ids or,
+    when created_since is set, created at or after it.
+    """
+    codes = []
+    max_pass_id, max_ticket_id = min_pass_id, min_ticket_id
+
+    pass_filter = EventPass.id > min_pass_id
+    ticket_filter = Ticket.id > min_ticket_id
+    if created_since is not None:
+        pass_filter = or_(pass_filter, EventPass.created_at >= created_since)
+        ticket_filter = or_(ticket_filter, Ticket.created_at >= created_since)
+
+    pass_rows = (
+        db.session.query(EventPass.id, EventPass.pass_code_key, EventPass.pass_code, EventPass.encrypted_data)
+        .filter(pass_filter)
+    )
+    for pass_id, pass_code_key, pass_code, encrypted_data in pass_rows:
+        codes.append(pass_code_key)
+        if encrypted_data and encrypted_data != pass_code:
+            codes.append(encrypted_data)
+        max_pass_id = max(max_pass_id, pass_id)
+
+    ticket_rows = (
+        db.session.query(Ticket.id, Ticket.ticket_code_key, Ticket.barcode_key)
+        .filter(ticket_filter)
+    )
+    for ticket_id, ticket_code_key, barcode_key in ticket_rows:
+        codes.append(ticket_code_key)
+        codes.append(barcode_key)
+        max_ticket_id = max(max_ticket_id, ticket_id)
+
+    return [code for code in codes if code], max_pass_id, max_ticket_id
+
+
+def warm_code_filter():
+    """(Re)build the filter from every pass and ticket. Called at startup."""
+    global _filter
+    if not CODE_FILTER_ENABLED:
+        return 0
+
+    started = datetime.utcnow()
+    codes, max_pass_id, max_ticket_id = _load_codes()
+    bloom = BloomFilter(max(len(codes) * 2, CODE_FILTER_MIN_CAPACITY))
+    for code in codes:
+        bloom.add(code)
+
+    with _lock:
+        _filter = bloom
+        _state.update(max_pass_id=max_pass_id, max_ticket_id=max_ticket_id, created_since=started,
+                      synced_at=time.monotonic(), needs_rebuild=False)
+        _stats['rebuilds'] += 1
+    return len(codes)
+
+
+def add_codes(codes):
+    """Add codes of newly committed passes/tickets (no-op until the filter is warmed)."""
+    with _lock:
+        if _filter is None:
+            return
+        for code in codes:
+            # Catch-ups re-read the overlap window; don't count those codes twice.
+            if code and code not in _filter:
+                _filter.add(code)
+        if _filter.saturated:
+            _state['needs_rebuild'] = True
+
+
+def _catch_up():
+    """Add rows created since the last sync (e.g. by another worker)."""
+    with _lock:
+        min_pass_id, min_ticket_id = _state['max_pass_id'], _state['max_ticket_id']
+        created_since = _state['created_since'] - timedelta(seconds=CODE_FILTER_OVERLAP_SECONDS)
+        needs_rebuild = _state['needs_rebuild']
+
+    if needs_rebuild:
+        warm_code_filter()
+        return
+
+    started = datetime.utcnow()
+    codes, max_pass_id, max_ticket_id = _load_codes(min_pass_id, min_ticket_id, created_since)
+    add_codes(codes)
+    with _lock:
+        _state['max_pass_id'] = max(_state['max_pass_id'], max_pass_id)
+        _state['max_ticket_id'] = max(_state['max_ticket_id'], max_ticket_id)
+        _state['created_since'] = max(_state['created_since'], started)
+        _state['synced_at'] = time.monotonic()
+        _stats['catch_ups'] += 1
+
+
+def _catch_up_if_due():
+    """Run a catch-up when REFRESH seconds have passed; callers that find one running skip it."""
+    if time.monotonic() - _state['synced_at'] < CODE_FILTER_REFRESH_SECONDS:
+        return
+    if not _sync_lock.acquire(blocking=False):
+        return
+    try:
+        if time.monotonic() - _state['synced_at'] >= CODE_FILTER_REFRESH_SECONDS:
+            _catch_up()
+    finally:
+        _sync_lock.release()
+
+
+def _filter_has(code):
+    key = canonical_code(code)
+    return (key is not None and key in _filter) or code in _filter
+
+
+def code_may_exist(code):
+    """
+    False only when no pass or ticket can match the normalized scanned code.
+    True means "maybe" - the caller must still resolve it against the DB.
+    """
+    if _filter is None or not code:
+        return True
+    # Legacy JSON / Fernet payloads may be decoded (or aliased) rather than
+    # matched verbatim, so they always go to the DB.
+    if is_legacy_payload(code):
+        _stats['bypassed'] += 1
+        return True
+
+    _stats['checks'] += 1
+    _catch_up_if_due()
+    if _filter_has(code):
+        return True
+
+    _stats['rejected'] += 1
+    return False
+
+
+def code_filter_stats():
+    if _filter is None:
+        return {'enabled': False}
+    with _lock:
+        stats = dict(_stats)
+        stats.update(
+            enabled=True,
+            codes=_filter.count,
+            capacity=_filter.capacity,
+            size_bytes=len(_filter.bits),
+            hash_count=_filter.hash_count,
+        )
+    return stats
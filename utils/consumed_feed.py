@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+from datetime import timedelta
+
+from sqlalchemy import select
+
+from database import db
+from models import EventPass, Ticket, TicketBatch
+from utils.live_feed import consumed_version, wait_consumed
+from utils.offline_bundle import OFFLINE_DELTA_OVERLAP_SECONDS, offline_cursor, parse_offline_cursor, ticket_code_hash
+
+
+# Long-poll feed of passes and tickets consumed since an offline cursor, so
+# offline-capable scanners keep their local used-set fresh between bundle
+# downloads. A local commit wakes waiters at once (live_feed.stage_consumed);
+# scans committed by other workers are seen by re-querying every POLL seconds.
+CONSUMED_FEED_POLL_SECONDS = float(os.getenv('CONSUMED_FEED_POLL_SECONDS', 2))
+CONSUMED_FEED_MAX_WAIT_SECONDS = float(os.getenv('CONSUMED_FEED_MAX_WAIT', 10))
+# A waiting poll holds a worker thread, so at most MAX_WAITERS polls of one process
+# wait at a time; the rest are answered at once and told to come back after POLL
+# seconds. Set it to 0 under sync workers, where any wait blocks the whole worker.
+CONSUMED_FEED_MAX_WAITERS = int(os.getenv('CONSUMED_FEED_MAX_WAITERS', 8))
+
+_waiters_lock = threading.Lock()
+_waiters = 0
+
+
+def _consumed_since(event_id, since):
+    """
+    Passes and tickets of the event consumed from `since` minus the delta overlap.
+    Return (pass ids, ticket rows, fresh) where fresh is True when any of them
+    changed at or after `since` itself, i.e. is news to the client.
+    """
+    changed_since = since - timedelta(seconds=OFFLINE_DELTA_OVERLAP_SECONDS)
+    fresh = False
+
+    pass_ids = []
+    rows = db.session.execute(
+        select(EventPass.id, EventPass.updated_at)
+        .where(EventPass.event_id == event_id, EventPass.is_validated.is_(True),
+               EventPass.updated_at >= changed_since)
+        .order_by(EventPass.id)
+    )
+    for pass_id, updated_at in rows:
+        pass_ids.append(pass_id)
+        fresh = fresh or updated_at >= since
+
+    tickets = []
+    rows = db.session.execute(
+        select(Ticket.id, Ticket.ticket_code_key, Ticket.barcode_key, Ticket.updated_at)
+        .join(TicketBatch, TicketBatch.id == Ticket.batch_id)
+        .where(TicketBatch.event_id == event_id, Ticket.status == 'used', Ticket.updated_at >= changed_since)
+        .order_by(Ticket.id)
+    )
+    for ticket_id, code_key, barcode_key, updated_at in rows:
+        tickets.append({
+            'id': ticket_id,
+            'ticket_code_hash': ticket_code_hash(code_key).hex(),
+            'barcode_hash': ticket_code_hash(barcode_key).hex(),
+        })
+        fresh = fresh or updated_at >= since
+
+    return pass_ids, tickets, fresh
+
+
+def _claim_waiter():
+    global _waiters
+    with _waiters_lock:
+        if _waiters >= CONSUMED_FEED_MAX_WAITERS:
+            return False
+        _waiters += 1
+        return True
+
+
+def _release_waiter():
+    global _waiters
+    with _waiters_lock:
+        _waiters -= 1
+
+
+def poll_consumed(event_id, since, timeout):
+    """
+    Wait up to `timeout` seconds (capped at CONSUMED_FEED_MAX_WAIT) for passes or
+    tickets consumed after the `since` cursor. Return (cursor, pass ids, tickets, busy);
+    the lists may be empty on timeout and repeat ids from the overlap window.
+    busy is True when the poll could not wait because this process is at
+    CONSUMED_FEED_MAX_WAITERS and was answered at once.
+    Raises ValueError for a malformed cursor.
+    """
+    since_at = parse_offline_cursor(since)
+    timeout = max(0.0, min(timeout, CONSUMED_FEED_MAX_WAIT_SECONDS))
+    if timeout <= 0:
+        return _poll(event_id, since_at, 0) + (False,)
+    if not _claim_waiter():
+        return _poll(event_id, since_at, 0) + (True,)
+    try:
+        return _poll(event_id, since_at, timeout) + (False,)
+    finally:
+        _release_waiter()
+
+
+def _poll(event_id, since_at, timeout):
+    deadline = time.monotonic() + timeout
+    while True:
+        # Version before the query: a commit landing in between still wakes the wait.
+        version = consumed_version(event_id)
+        cursor = offline_cursor()
+        pass_ids, tickets, fresh = _consumed_since(event_id, since_at)
+        # Never hold a connection (or a stale SQLite snapshot) while waiting.
+        db.session.close()
+
+        remaining = deadline - time.monotonic()
+        if fresh or remaining <= 0:
+            return cursor, pass_ids, tickets
+        wait_consumed(event_id, version, min(remaining, CONSUMED_FEED_POLL_SECONDS))
@@ -0,0 +1,122 @@
+import threading
+from collections import namedtuple
+
+from database import db
+from models import canonical_code, Event, EventPass, Ticket, TicketBatch
+from utils.code_filter import add_codes as add_filter_codes
+
+
+# kind is 'pass' or 'ticket'; pass_type_id is None for batch tickets.
+CredentialEntry = namedtuple('CredentialEntry', ['kind', 'id', 'event_id', 'pass_type_id'])
+
+_lock = threading.Lock()
+_codes_by_event = {}   # event_id -> set(code)
+_entries_by_code = {}  # canonical code (or raw legacy payload) -> CredentialEntry
+
+
+def pass_entries(passes):
+    """
+    Build (code, entry) pairs for passes.
+    Call after flush (ids assigned) and before commit (no reload on access).
+    """
+    entries = []
+    for pass_obj in passes:
+        entry = CredentialEntry('pass', pass_obj.id, pass_obj.event_id, pass_obj.pass_type_id)
+        entries.append((canonical_code(pass_obj.pass_code), entry))
+        if pass_obj.encrypted_data and pass_obj.encrypted_data != pass_obj.pass_code:
+            entries.append((pass_obj.encrypted_data, entry))
+    return entries
+
+
+def ticket_entries(tickets, event_id):
+    """Build (code, entry) pairs for batch tickets (ticket_code + barcode)."""
+    entries = []
+    for ticket in tickets:
+        entry = CredentialEntry('ticket', ticket.id, event_id, None)
+        entries.append((canonical_code(ticket.ticket_code), entry))
+        entries.append((canonical_code(ticket.barcode), entry))
+    return entries
+
+
+def register(entries):
+    """Add (code, entry) pairs to the index. Call only after the rows are committed."""
+    with _lock:
+        for code, entry in entries:
+            if not code:
+                continue
+            _entries_by_code[code] = entry
+            _codes_by_event.setdefault(entry.event_id, set()).add(code)
+    add_filter_codes(code for code, _ in entries)
+
+
+def drop_event(event_id):
+    """Forget every credential of an event (event archived, purged or deleted)."""
+    with _lock:
+        for code in _codes_by_event.pop(event_id, set()):
+            _entries_by_code.pop(code, None)
+
+
+def _load_event_entries(event_ids):
+    entries = []
+    if not event_ids:
+        return entries
+
+    pass_rows = (
+        db.session.query(
+            EventPass.id, EventPass.event_id, EventPass.pass_type_id,
+            EventPass.pass_code_key, EventPass.pass_code, EventPass.encrypted_data
+        )
+        .filter(EventPass.event_id.in_(event_ids))
+    )
+    for pass_id, event_id, pass_type_id, pass_code_key, pass_code, encrypted_data in pass_rows:
+        entry = CredentialEntry('pass', pass_id, event_id, pass_type_id)
+        entries.append((pass_code_key, entry))
+        if encrypted_data and encrypted_data != pass_code:
+            entries.append((encrypted_data, entry))
+
+    ticket_rows = (
+        db.session.query(Ticket.id, TicketBatch.event_id, Ticket.ticket_code_key, Ticket.barcode_key)
+        .join(TicketBatch, Ticket.batch_id == TicketBatch.id)
+        .filter(TicketBatch.event_id.in_(event_ids))
+    )
+    for ticket_id, event_id, ticket_code_key, barcode_key in ticket_rows:
+        entry = CredentialEntry('ticket', ticket_id, event_id, None)
+        entries.append((ticket_code_key, entry))
+        entries.append((barcode_key, entry))
+
+    return entries
+
+
+def index_event(event_id):
+    """(Re)load all credentials of one event, e.g. after restoring it from the recycle bin."""
+    entries = _load_event_entries([event_id])
+    drop_event(event_id)
+    register(entries)
+
+
+def warm_credential_index():
+    """Load credentials of all active events. Called once at startup."""
+    active_event_ids = [
+        event_id for event_id, in db.session.query(Event.id).filter(Event.status == 'active')
+    ]
+    entries = _load_event_entries(active_event_ids)
+
+    with _lock:
+        _entries_by_code.clear()
+        _codes_by_event.clear()
+    register(entries)
+    return len(entries)
+
+
+def lookup_credential(code):
+    """
+    Return CredentialEntry for a normalized scanned code, or None.
+    Mirrors the resolver: canonical pass/ticket code first, then the raw
+    legacy payload (encrypted_data is matched exactly).
+    """
+    if not code:
+        return None
+    entry = _entries_by_code.get(canonical_code(code))
+    if entry is None:
+        entry = _entries_by_code.get(code)
+    return entry
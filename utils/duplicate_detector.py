@@ -0,0 +1,176 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+
+from database import db
+from models import DuplicateAlertSetting, GateValidationLog, RealtimeAlert, Ticket, ValidationLog
+from utils.gate_access import get_gate_access
+from utils.live_feed import alert_payload, stage_publish
+
+
+# Sliding-window passback detection. Attempts are tracked per process; when a
+# worker sees a credential that was admitted elsewhere (e.g. by another worker),
+# the stored admission is counted as the first attempt, so a passback alerts no
+# matter which worker takes the second scan.
+DUPLICATE_CHECK_WINDOW_MINUTES = int(os.getenv('DUPLICATE_CHECK_WINDOW', 5))
+DUPLICATE_ALERT_THRESHOLD = int(os.getenv('DUPLICATE_ALERT_THRESHOLD', 2))
+DUPLICATE_TRACKER_MAX_ENTRIES = int(os.getenv('DUPLICATE_TRACKER_MAX_ENTRIES', 50000))
+DUPLICATE_SETTINGS_CACHE_TTL_SECONDS = int(os.getenv('DUPLICATE_SETTINGS_CACHE_TTL', 30))
+_EVICTION_SWEEP = 16
+
+_lock = threading.Lock()
+_attempts = OrderedDict()  # (event_id, kind, credential_id) -> _Attempts, oldest first
+_settings_cache = {}       # event_id -> (expires_at, window_seconds, enabled)
+
+
+class _Attempts:
+    __slots__ = ('window', 'seen', 'last_alert')
+
+    def __init__(self, window):
+        self.window = window
+        self.seen = deque()  # (monotonic ts, gate_id, approved)
+        self.last_alert = None
+
+    def prune(self, now):
+        while self.seen and now - self.seen[0][0] > self.window:
+            self.seen.popleft()
+
+
+def _event_settings(event_id):
+    """Return (window_seconds, enabled) for an event; cached for a short TTL."""
+    now = time.monotonic()
+    cached = _settings_cache.get(event_id)
+    if cached and cached[0] > now:
+        return cached[1], cached[2]
+
+    row = (
+        db.session.query(DuplicateAlertSetting.time_window_minutes, DuplicateAlertSetting.alert_enabled)
+        .filter(DuplicateAlertSetting.event_id == event_id)
+        .first()
+    )
+    minutes = (row[0] if row and row[0] else None) or DUPLICATE_CHECK_WINDOW_MINUTES
+    enabled = True if row is None or row[1] is None else bool(row[1])
+    _settings_cache[event_id] = (now + DUPLICATE_SETTINGS_CACHE_TTL_SECONDS, minutes * 60, enabled)
+    return minutes * 60, enabled
+
+
+def duplicate_alerts_enabled(event_id):
+    return _event_settings(event_id)[1]
+
+
+def invalidate_duplicate_settings(event_id=None):
+    if event_id is None:
+        _settings_cache.clear()
+    else:
+        _settings_cache.pop(event_id, None)
+
+
+def _evict_expired(now):
+    """Drop up to _EVICTION_SWEEP least recently used entries whose window has passed."""
+    for _ in range(_EVICTION_SWEEP):
+        if not _attempts:
+            return
+        key, entry = next(iter(_attempts.items()))
+        if entry.seen and now - entry.seen[-1][0] <= entry.window:
+            return
+        _attempts.pop(key)
+
+
+def _stored_admission(kind, credential_id):
+    """(admitted_at, gate_id) of the credential's stored admission, or None."""
+    if kind == 'ticket':
+        scanned_at = db.session.query(Ticket.scanned_at).filter(Ticket.id == credential_id).scalar()
+        return (scanned_at, None) if scanned_at else None
+    return (
+        db.session.query(ValidationLog.validation_time, GateValidationLog.gate_id)
+        .outerjoin(GateValidationLog, GateValidationLog.validation_log_id == ValidationLog.id)
+        .filter(ValidationLog.pass_id == credential_id, ValidationLog.validation_status == 'success')
+        .order_by(ValidationLog.validation_time.desc())
+        .first()
+    )
+
+
+def _seen_admission(key, now):
+    with _lock:
+        entry = _attempts.get(key)
+        return entry is not None and any(
+            approved and now - seen_at <= entry.window for seen_at, _, approved in entry.seen
+        )
+
+
+def record_scan_attempt(event_id, kind, credential_id, gate_id, approved, consumed, label, pass_id=None):
+    """
+    Track one scan of a credential and raise a duplicate_entry RealtimeAlert
+    when it was scanned DUPLICATE_ALERT_THRESHOLD times within the event's window.
+    consumed: the credential has been admitted (by this scan or an earlier one);
+    scans before that (gate denied, expired, wrong event) are not counted.
+    The alert joins the current transaction and is published after commit.
+    At most one alert per credential per window.
+    """
+    if not consumed:
+        return None
+
+    window, enabled = _event_settings(event_id)
+    if not enabled:
+        return None
+
+    now = time.monotonic()
+    key = (event_id, kind, credential_id)
+    seed = None
+    if not approved and not _seen_admission(key, now):
+        # Admitted without this worker seeing it: count the stored admission.
+        admission = _stored_admission(kind, credential_id)
+        if admission is not None:
+            age = (datetime.utcnow() - admission[0]).total_seconds()
+            if 0 <= age <= window:
+                seed = (now - age, admission[1], True)
+
+    with _lock:
+        entry = _attempts.get(key)
+        if entry is None:
+            entry = _attempts[key] = _Attempts(window)
+        else:
+            _attempts.move_to_end(key)
+            entry.window = window
+        entry.prune(now)
+        if seed is not None and not any(was_approved for _, _, was_approved in entry.seen):
+            entry.seen = deque(sorted([*entry.seen, seed], key=lambda attempt: attempt[0]))
+        entry.seen.append((now, gate_id, bool(approved)))
+
+        if len(_attempts) > DUPLICATE_TRACKER_MAX_ENTRIES:
+            _attempts.popitem(last=False)
+        _evict_expired(now)
+
+        if len(entry.seen) < DUPLICATE_ALERT_THRESHOLD:
+            return None
+        if entry.last_alert is not None and now - entry.last_alert < window:
+            return None
+        entry.last_alert = now
+        attempts = list(entry.seen)
+
+    # Scans without a gate (e.g. /tickets/scan/by-code) get no gate label.
+    gate_ids = list(dict.fromkeys(gate for _, gate, _ in attempts if gate is not None))
+    gate_names = []
+    for gate in gate_ids:
+        access = get_gate_access(gate)
+        gate_names.append(access.gate_name if access else f'Gate #{gate}')
+    entries = sum(1 for _, _, was_approved in attempts if was_approved)
+
+    alert = RealtimeAlert(
+        event_id=event_id,
+        alert_type='duplicate_entry',
+        alert_message=(
+            f'{label} scanned {len(attempts)} times within {window // 60} min ({entries} entries)'
+            + (f' at {", ".join(gate_names)}' if gate_names else '')
+        ),
+        pass_id=pass_id,
+        gate_id=gate_id,
+        severity='high' if len(gate_ids) > 1 else 'medium',
+    )
+    db.session.add(alert)
+    db.session.flush()
+    stage_publish(event_id, 'alert', alert_payload(alert))
+    return alert
+
@@ -0,0 +1,130 @@
+import os
+import threading
+import time
+from collections import namedtuple
+
+from database import db
+from models import Event, Gate, GateAccessRule
+
+
+# Compiled entries are rebuilt in-process whenever gates change here; the TTL
+# bounds how long another worker can keep serving an outdated rule set.
+GATE_ACCESS_CACHE_TTL_SECONDS = int(os.getenv('GATE_ACCESS_CACHE_TTL', 30))
+# Unknown gate ids are remembered for the same TTL, so scans naming a bogus
+# gate do not recompile on every request; the set is cleared when it overflows.
+GATE_ACCESS_MAX_MISSES = int(os.getenv('GATE_ACCESS_MAX_MISSES', 10000))
+
+_lock = threading.Lock()
+_matrix = {}  # gate_id -> GateAccessEntry
+_misses = {}  # gate_id -> monotonic time it was found missing
+
+
+class GateAccessEntry(namedtuple('GateAccessEntry', [
+    'gate_id', 'event_id', 'gate_name', 'is_active',
+    'unrestricted', 'allowed', 'denied', 'compiled_at'
+])):
+    """
+    Compiled GateAccessRule rows of one gate.
+    - unrestricted => gate has no rules configured (legacy: all pass types allowed)
+    - allowed / denied => frozensets of pass_type_id with can_access True / False
+    """
+
+    def check(self, pass_type_id):
+        """Return (allowed: bool, message: str) for a pass type at this gate."""
+        if pass_type_id in self.allowed:
+            return True, "Gate access allowed"
+        if pass_type_id in self.denied:
+            return False, "Access denied for this pass type at this gate"
+        if self.unrestricted:
+            # Legacy fallback: if a gate has zero rules configured, allow all pass types.
+            # This keeps older data usable while still enforcing explicit rules once configured.
+            return True, "Gate access allowed (no explicit rules configured)"
+        return False, "No access rule for this pass type at this gate"
+
+
+def compile_gates(gate_ids=None):
+    """
+    (Re)compile access entries from Gate + GateAccessRule rows.
+    gate_ids=None compiles every gate of active events.
+    """
+    gate_query = db.session.query(Gate.id, Gate.event_id, Gate.gate_name, Gate.is_active)
+    if gate_ids is None:
+        gate_query = gate_query.join(Event, Gate.event_id == Event.id).filter(Event.status == 'active')
+    else:
+        gate_ids = list(gate_ids)
+        if not gate_ids:
+            return
+        gate_query = gate_query.filter(Gate.id.in_(gate_ids))
+    gate_rows = gate_query.all()
+
+    rules_by_gate = {}
+    found_ids = [row[0] for row in gate_rows]
+    if found_ids:
+        rule_rows = (
+            db.session.query(GateAccessRule.gate_id, GateAccessRule.pass_type_id, GateAccessRule.can_access)
+            .filter(GateAccessRule.gate_id.in_(found_ids))
+        )
+        for gate_id, pass_type_id, can_access in rule_rows:
+            rules_by_gate.setdefault(gate_id, []).append((pass_type_id, can_access))
+
+    now = time.monotonic()
+    compiled = {}
+    for gate_id, event_id, gate_name, is_active in gate_rows:
+        rules = rules_by_gate.get(gate_id, [])
+        compiled[gate_id] = GateAccessEntry(
+            gate_id=gate_id,
+            event_id=event_id,
+            gate_name=gate_name,
+            is_active=bool(is_active),
+            unrestricted=not rules,
+            allowed=frozenset(pt_id for pt_id, can_access in rules if can_access),
+            denied=frozenset(pt_id for pt_id, can_access in rules if not can_access),
+            compiled_at=now,
+        )
+
+    with _lock:
+        if gate_ids is None:
+            _matrix.clear()
+            _misses.clear()
+        else:
+            for gate_id in gate_ids:
+                if gate_id not in compiled:
+                    _matrix.pop(gate_id, None)
+                    if len(_misses) >= GATE_ACCESS_MAX_MISSES:
+                        _misses.clear()
+                    _misses[gate_id] = now
+        for gate_id in compiled:
+            _misses.pop(gate_id, None)
+        _matrix.update(compiled)
+
+
+def refresh_gate(gate_id):
+    """Recompile one gate after it was created or its settings or rules changed."""
+    compile_gates([gate_id])
+
+
+def forget_gate(gate_id):
+    """Drop a deleted gate from the matrix."""
+    with _lock:
+        _matrix.pop(gate_id, None)
+        _misses[gate_id] = time.monotonic()
+
+
+def warm_gate_access():
+    """Compile all gates of active events. Called once at startup."""
+    compile_gates()
+    return len(_matrix)
+
+
+def get_gate_access(gate_id):
+    """Return the compiled GateAccessEntry for gate_id (or None if the gate does not exist)."""
+    now = time.monotonic()
+    entry = _matrix.get(gate_id)
+    if entry is None:
+        missed_at = _misses.get(gate_id)
+        if missed_at is not None and now - missed_at <= GATE_ACCESS_CACHE_TTL_SECONDS:
+            return None
+    elif now - entry.compiled_at <= GATE_ACCESS_CACHE_TTL_SECONDS:
+        return entry
+    refresh_gate(gate_id)
+    return _matrix.get(gate_id)
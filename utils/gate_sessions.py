@@ -0,0 +1,152 @@
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import namedtuple
+
+from flask import current_app
+
+from models import Event, Gate
+from utils.scanner_access import user_can_scan_gate
+
+
+# A gate session pins (scanner, gate, event) after one full authorization check.
+# Tokens are signed, so any worker can verify them; each worker keeps the pinned
+# context and re-runs the gate/scope check at most every GATE_SESSION_REVALIDATE
+# seconds, which bounds how long a revocation on another worker goes unseen.
+GATE_SESSION_TTL_SECONDS = int(os.getenv('GATE_SESSION_TTL', 12 * 3600))
+GATE_SESSION_REVALIDATE_SECONDS = int(os.getenv('GATE_SESSION_REVALIDATE', 60))
+GATE_SESSION_PREFIX = 'GS1'
+
+GateSession = namedtuple('GateSession', [
+    'user_id', 'gate_id', 'event_id', 'gate_name', 'event_name', 'issued_at', 'expires_at', 'checked_at'
+])
+
+_lock = threading.Lock()
+_sessions = {}     # token -> GateSession
+_revocations = {}  # ('gate', id) / ('event', id) / ('user', id) / ('user_event', uid, eid) -> revoked at (epoch ms)
+
+
+def _sign(body):
+    key = hashlib.sha256(b'gate-session:' + current_app.config['SECRET_KEY'].encode('utf-8')).digest()
+    digest = hmac.new(key, body.encode('utf-8'), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:16]).decode('ascii').rstrip('=')
+
+
+def open_gate_session(user, gate):
+    """Issue a session token for a gate the user was just authorized for."""
+    issued_at = int(time.time() * 1000)
+    expires_at = issued_at // 1000 + GATE_SESSION_TTL_SECONDS
+    body = f'{GATE_SESSION_PREFIX}.{user.id}.{gate.id}.{gate.event_id}.{issued_at}.{expires_at}'
+    token = f'{body}.{_sign(body)}'
+
+    event = Event.query.get(gate.event_id)
+    session = GateSession(
+        user_id=user.id,
+        gate_id=gate.id,
+        event_id=gate.event_id,
+        gate_name=gate.gate_name,
+        event_name=event.event_name if event else f'Event #{gate.event_id}',
+        issued_at=issued_at,
+        expires_at=expires_at,
+        checked_at=time.monotonic(),
+    )
+    with _lock:
+        now = time.time()
+        for stale_token in [t for t, s in _sessions.items() if s.expires_at < now]:
+            _sessions.pop(stale_token, None)
+        _sessions[token] = session
+    return token, session
+
+
+def _is_revoked(user_id, gate_id, event_id, issued_at):
+    keys = (('gate', gate_id), ('event', event_id), ('user', user_id), ('user_event', user_id, event_id))
+    return any(_revocations.get(key, 0) >= issued_at for key in keys)
+
+
+def _forget(token):
+    with _lock:
+        _sessions.pop(token, None)
+
+
+def resolve_gate_session(token, user):
+    """
+    Return (GateSession, None) for a valid session of `user`, or
+    (None, (body, status_code)) when the token is invalid, expired or revoked.
+    """
+    invalid = (None, ({"success": False, "message": "Invalid or expired gate session", "session_expired": True}, 401))
+
+    parts = (token or '').strip().split('.')
+    if len(parts) != 7 or parts[0] != GATE_SESSION_PREFIX:
+        return invalid
+    try:
+        user_id, gate_id, event_id, issued_at, expires_at = (int(part) for part in parts[1:6])
+    except ValueError:
+        return invalid
+    if not hmac.compare_digest(_sign('.'.join(parts[:6])), parts[6]):
+        return invalid
+    if time.time() > expires_at or _is_revoked(user_id, gate_id, event_id, issued_at):
+        _forget(token)
+        return invalid
+    if user_id != user.id:
+        return None, ({"success": False, "message": "Gate session belongs to another user"}, 403)
+
+    session = _sessions.get(token)
+    if session and time.monotonic() - session.checked_at <= GATE_SESSION_REVALIDATE_SECONDS:
+        return session, None
+
+    # Unknown to this worker or due for revalidation: repeat the full gate check once.
+    gate = Gate.query.get(gate_id)
+    if not gate or not gate.is_active or gate.event_id != event_id:
+        _forget(token)
+        return None, ({"success": False, "message": "Gate not found or inactive", "session_expired": True}, 400)
+    if not user_can_scan_gate(user, gate):
+        _forget(token)
+        return None, ({"success": False, "message": "You are not assigned to this gate.", "session_expired": True}, 403)
+
+    if session:
+        session = session._replace(checked_at=time.monotonic())
+    else:
+        event = Event.query.get(event_id)
+        session = GateSession(
+            user_id=user_id,
+            gate_id=gate_id,
+            event_id=event_id,
+            gate_name=gate.gate_name,
+            event_name=event.event_name if event else f'Event #{event_id}',
+            issued_at=issued_at,
+            expires_at=expires_at,
+            checked_at=time.monotonic(),
+        )
+    with _lock:
+        _sessions[token] = session
+    return session, None
+
+
+def revoke_gate_sessions(gate_id=None, event_id=None, user_id=None):
+    """
+    Revoke sessions issued before now, in this worker (other workers pick it up
+    on their next revalidation).
+    - gate_id => sessions of that gate
+    - event_id => sessions of that event (with user_id: that user's sessions of the event)
+    - user_id => all sessions of that user
+    """
+    now = int(time.time() * 1000)
+    if user_id is not None and event_id is not None:
+        key = ('user_event', user_id, event_id)
+    elif gate_id is not None:
+        key = ('gate', gate_id)
+    elif event_id is not None:
+        key = ('event', event_id)
+    elif user_id is not None:
+        key = ('user', user_id)
+    else:
+        return
+
+    with _lock:
+        _revocations[key] = now
+        for token, session in list(_sessions.items()):
+            if _is_revoked(session.user_id, session.gate_id, session.event_id, session.issued_at):
+                _sessions.pop(token, None)
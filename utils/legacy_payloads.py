@@ -0,0 +1,143 @@
+import json
+import logging
+import os
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from database import db
+from models import canonical_code, payload_digest, EventPass, LegacyPassAlias
+
+
+logger = logging.getLogger(__name__)
+
+# Once migrate_legacy_payloads.py has run, set this to False: legacy payloads are
+# then resolved through legacy_pass_aliases only (no per-scan JSON parse / decrypt).
+LEGACY_DECRYPT_FALLBACK = os.getenv('LEGACY_DECRYPT_FALLBACK', 'True') == 'True'
+
+# Plain JSON and Fernet tokens (version byte 0x80 -> "gAAAAA") from old QR generation.
+LEGACY_PAYLOAD_PREFIXES = ('{', 'gAAAAA')
+
+
+def load_legacy_cipher():
+    """Fernet for old encrypted QR payloads, or None when ENCRYPTION_KEY is unset/invalid."""
+    key = os.getenv("ENCRYPTION_KEY", "").strip()
+    if not key:
+        return None
+    try:
+        return Fernet(key.encode())
+    except Exception:
+        return None
+
+
+def is_legacy_payload(code):
+    return bool(code) and code.startswith(LEGACY_PAYLOAD_PREFIXES)
+
+
+def _scanned_form(payload):
+    """The payload as /validate sees it after _normalize_scanned_code (no whitespace)."""
+    return ''.join(payload.split())
+
+
+def _payload_reference(plaintext):
+    """Return ('code', pass_code) / ('id', pass_id) from a decoded JSON payload, or None."""
+    try:
+        payload = json.loads(plaintext)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(payload, dict):
+        return None
+    if payload.get("pass_code"):
+        return 'code', canonical_code(str(payload["pass_code"]))
+    if payload.get("pass_id"):
+        try:
+            return 'id', int(payload["pass_id"])
+        except (ValueError, TypeError):
+            return None
+    return None
+
+
+def _decode(encrypted_data, cipher):
+    """Yield (source, payload text, reference) for every legacy form of a stored payload."""
+    if encrypted_data.startswith('{'):
+        reference = _payload_reference(encrypted_data)
+        if reference:
+            yield 'json', encrypted_data, reference
+        return
+
+    if cipher is None or not encrypted_data.startswith(LEGACY_PAYLOAD_PREFIXES):
+        return
+    try:
+        plaintext = cipher.decrypt(encrypted_data.encode()).decode()
+    except (InvalidToken, ValueError):
+        return
+    reference = _payload_reference(plaintext)
+    if reference:
+        # The encrypted token and its plaintext JSON (scanned from older plain QRs) both alias.
+        yield 'fernet', encrypted_data, reference
+        yield 'json', plaintext, reference
+
+
+def migrate_legacy_payloads(batch_size=500, cipher=None):
+    """
+    Decode every legacy JSON / Fernet payload in EventPass.encrypted_data and
+    record digest -> pass_id in legacy_pass_aliases. Safe to re-run.
+    Returns counts of scanned rows, created aliases and undecodable payloads.
+    """
+    cipher = cipher or load_legacy_cipher()
+    stats = {'scanned': 0, 'aliases': 0, 'existing': 0, 'undecodable': 0, 'unresolved': 0}
+    last_id = 0
+
+    while True:
+        rows = (
+            db.session.query(EventPass.id, EventPass.pass_code, EventPass.encrypted_data)
+            .filter(EventPass.id > last_id)
+            .order_by(EventPass.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        candidates = []
+        for pass_id, pass_code, encrypted_data in rows:
+            if not encrypted_data or encrypted_data == pass_code or not is_legacy_payload(encrypted_data):
+                continue
+            stats['scanned'] += 1
+            decoded = list(_decode(encrypted_data, cipher))
+            if not decoded:
+                stats['undecodable'] += 1
+            candidates.extend((pass_id, source, text, reference) for source, text, reference in decoded)
+
+        codes = {ref[1] for _, _, _, ref in candidates if ref[0] == 'code'}
+        ids = {ref[1] for _, _, _, ref in candidates if ref[0] == 'id'}
+        by_code = dict(
+            db.session.query(EventPass.pass_code_key, EventPass.id).filter(EventPass.pass_code_key.in_(codes))
+        ) if codes else {}
+        known_ids = {
+            pass_id for pass_id, in db.session.query(EventPass.id).filter(EventPass.id.in_(ids))
+        } if ids else set()
+
+        digests = {payload_digest(_scanned_form(text)) for _, _, text, _ in candidates}
+        existing = {
+            digest for digest, in db.session.query(LegacyPassAlias.payload_digest)
+            .filter(LegacyPassAlias.payload_digest.in_(digests))
+        } if digests else set()
+
+        for row_pass_id, source, text, (kind, value) in candidates:
+            digest = payload_digest(_scanned_form(text))
+            if digest in existing:
+                stats['existing'] += 1
+                continue
+            target = by_code.get(value) if kind == 'code' else (value if value in known_ids else None)
+            if target is None:
+                stats['unresolved'] += 1
+                continue
+            db.session.add(LegacyPassAlias(payload_digest=digest, pass_id=target, source=source))
+            existing.add(digest)
+            stats['aliases'] += 1
+
+        db.session.commit()
+        logger.info('Legacy payload migration: up to pass %d, %r', last_id, stats)
+
+    return stats
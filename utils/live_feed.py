@@ -0,0 +1,165 @@
+import json
+import os
+import queue
+import threading
+from datetime import datetime
+
+from flask import g
+
+
+# In-process pub/sub for the dashboard SSE stream. Each subscriber gets a
+# bounded queue; a slow client loses its oldest messages instead of blocking
+# the publisher (the scan path). Subscribers only see what their own worker
+# publishes, so dashboards keep a slow polling fallback.
+LIVE_FEED_QUEUE_SIZE = int(os.getenv('LIVE_FEED_QUEUE_SIZE', 256))
+LIVE_FEED_HEARTBEAT_SECONDS = float(os.getenv('LIVE_FEED_HEARTBEAT', 15))
+# An open stream holds a worker thread for as long as the dashboard stays open,
+# so streams need threaded (gthread) or gevent workers. This caps the streams of
+# one process across all events, keeping threads free for scans; over the cap
+# (or with 0, e.g. under sync workers) dashboards poll instead.
+LIVE_FEED_MAX_SUBSCRIBERS = int(os.getenv('LIVE_FEED_MAX_SUBSCRIBERS', 8))
+
+_lock = threading.Lock()
+_subscribers = {}  # event_id -> set(queue.Queue)
+_subscriber_count = 0
+
+# Consumed-set feed (GET /gates/offline/consumed/<event_id>): the database is the
+# source of truth, this condition only wakes the worker's long-polls early after
+# a local commit flipped a pass or ticket to consumed.
+_consumed = threading.Condition()
+_consumed_versions = {}  # event_id -> number of commits that consumed something
+
+
+def subscribe(event_id):
+    """Register a subscriber queue for an event; None when this process is at capacity."""
+    global _subscriber_count
+    with _lock:
+        if _subscriber_count >= LIVE_FEED_MAX_SUBSCRIBERS:
+            return None
+        q = queue.Queue(maxsize=LIVE_FEED_QUEUE_SIZE)
+        _subscribers.setdefault(event_id, set()).add(q)
+        _subscriber_count += 1
+        return q
+
+
+def unsubscribe(event_id, q):
+    global _subscriber_count
+    with _lock:
+        queues = _subscribers.get(event_id)
+        if queues is not None and q in queues:
+            queues.discard(q)
+            _subscriber_count -= 1
+            if not queues:
+                _subscribers.pop(event_id, None)
+
+
+def publish(event_id, kind, data):
+    """Push a message to every subscriber of an event. Never blocks."""
+    with _lock:
+        queues = list(_subscribers.get(event_id, ()))
+    if not queues:
+        return 0
+
+    message = (kind, data)
+    for q in queues:
+        try:
+            q.put_nowait(message)
+        except queue.Full:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                pass
+    return len(queues)
+
+
+def stage_publish(event_id, kind, data):
+    """Hold a message until the current transaction commits."""
+    g.setdefault('staged_publishes', []).append((event_id, kind, data))
+
+
+def release_staged_publishes():
+    for event_id, kind, data in g.pop('staged_publishes', None) or ():
+        publish(event_id, kind, data)
+    consumed = g.pop('staged_consumed', None)
+    if consumed:
+        notify_consumed(consumed)
+
+
+def discard_staged_publishes():
+    g.pop('staged_publishes', None)
+    g.pop('staged_consumed', None)
+
+
+def stage_consumed(event_id):
+    """Wake the event's consumed-feed waiters once the current transaction commits."""
+    g.setdefault('staged_consumed', set()).add(event_id)
+
+
+def notify_consumed(event_ids):
+    with _consumed:
+        for event_id in event_ids:
+            _consumed_versions[event_id] = _consumed_versions.get(event_id, 0) + 1
+        _consumed.notify_all()
+
+
+def consumed_version(event_id):
+    with _consumed:
+        return _consumed_versions.get(event_id, 0)
+
+
+def wait_consumed(event_id, version, timeout):
+    """Block until the event's consumed version moves past `version` or `timeout` passes."""
+    with _consumed:
+        return _consumed.wait_for(lambda: _consumed_versions.get(event_id, 0) != version, timeout)
+
+
+def alert_payload(alert):
+    return {
+        'id': alert.id,
+        'type': alert.alert_type,
+        'message': alert.alert_message,
+        'severity': alert.severity,
+        'created_at': alert.created_at.isoformat() if alert.created_at else None,
+        'pass_id': alert.pass_id,
+        'gate_id': alert.gate_id
+    }
+
+
+def publish_alert_acknowledged(event_id, alert_id, acknowledged_by):
+    publish(event_id, 'alert_ack', {'id': alert_id, 'acknowledged_by': acknowledged_by})
+
+
+def publish_scan_outcome(event_id, gate_id, body, status_code):
+    """Publish the result of a committed scan (no participant details)."""
+    pass_info = body.get('pass_info') or {}
+    publish(event_id, 'scan', {
+        'gate_id': gate_id,
+        'success': bool(body.get('success')),
+        'status': status_code,
+        'message': body.get('message'),
+        'pass_type': pass_info.get('pass_type'),
+        'at': datetime.utcnow().isoformat(),
+    })
+
+
+def _frame(kind, data):
+    return f"event: {kind}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream(event_id, q):
+    """SSE generator for a subscribed queue; unsubscribes when the client goes away."""
+    try:
+        yield f"retry: 5000\n{_frame('ready', {'event_id': event_id})}"
+        while True:
+            try:
+                kind, data = q.get(timeout=LIVE_FEED_HEARTBEAT_SECONDS)
+            except queue.Empty:
+                yield ": heartbeat\n\n"
+                continue
+            yield _frame(kind, data)
+    finally:
+        unsubscribe(event_id, q)
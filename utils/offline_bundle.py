@@ -0,0 +1,316 @@
+import base64
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from database import db
+from models import canonical_code, EventPass, Gate, GateAccessRule, PassType, Ticket, TicketBatch
+
+
+# Compact offline bundles for scanner bootstrap (?format=columnar|sqlite on the
+# offline download). Pass rows are streamed as plain tuples, never hydrated as
+# ORM objects. The output is gzipped with a fixed mtime, so identical data gives
+# identical bytes and the sha256 of the body can serve as the ETag.
+OFFLINE_BUNDLE_FORMATS = ('columnar', 'sqlite')
+OFFLINE_BUNDLE_STREAM_SIZE = int(os.getenv('OFFLINE_BUNDLE_STREAM_SIZE', 5000))
+OFFLINE_BUNDLE_VERSION = 1
+# Delta cursors are epoch milliseconds of updated_at. Rows are re-sent from
+# OVERLAP seconds before the cursor, so a transaction that committed late with an
+# earlier updated_at is not missed; clients upsert by id, so repeats are harmless.
+OFFLINE_DELTA_OVERLAP_SECONDS = int(os.getenv('OFFLINE_DELTA_OVERLAP_SECONDS', 120))
+
+PASS_COLUMNS = (
+    'id', 'pass_code', 'pass_code_key', 'encrypted_data', 'participant_name',
+    'pass_type_id', 'is_validated', 'validation_count',
+)
+TICKET_COLUMNS = ('id', 'ticket_code_hash', 'barcode_hash', 'status')
+
+# Tickets ship as a hashed code set instead of rows: one entry per canonical
+# ticket_code and barcode, an 8-byte BLAKE2b digest of the code, sorted so the
+# device can binary-search it, plus a parallel status byte. Raw codes never
+# leave the server; at 8 bytes a false match needs ~2^32 tickets in one event.
+TICKET_HASH_BYTES = 8
+TICKET_STATUS_BITS = {'used': 1, 'expired': 2}  # 0 = available
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def offline_cursor(moment=None):
+    """Cursor (epoch ms, UTC) for `moment`, default now."""
+    return int(((moment or datetime.utcnow()) - _EPOCH).total_seconds() * 1000)
+
+
+def parse_offline_cursor(value):
+    """Naive UTC datetime for a cursor string; raises ValueError when malformed."""
+    millis = int(value)
+    if millis < 0:
+        raise ValueError('negative cursor')
+    return _EPOCH + timedelta(milliseconds=millis)
+
+
+def _pass_rows(event_id, changed_since=None):
+    """Yield pass tuples in PASS_COLUMNS order; encrypted_data is None when it equals pass_code."""
+    stmt = (
+        select(
+            EventPass.id, EventPass.pass_code, EventPass.pass_code_key, EventPass.encrypted_data,
+            EventPass.participant_name, EventPass.pass_type_id, EventPass.is_validated,
+            EventPass.validation_count,
+        )
+        .where(EventPass.event_id == event_id)
+        .order_by(EventPass.id)
+        .execution_options(yield_per=OFFLINE_BUNDLE_STREAM_SIZE)
+    )
+    if changed_since is not None:
+        stmt = stmt.where(EventPass.updated_at >= changed_since)
+    for row in db.session.execute(stmt):
+        pass_id, code, code_key, payload, name, type_id, validated, count = row
+        yield (
+            pass_id, code, code_key, None if payload == code else payload, name,
+            type_id, 1 if validated else 0, count or 0,
+        )
+
+
+def ticket_code_hash(code):
+    """Truncated BLAKE2b digest of canonical_code(code), as used in the ticket hash set."""
+    return hashlib.blake2b(canonical_code(code).encode('utf-8'), digest_size=TICKET_HASH_BYTES).digest()
+
+
+def _ticket_rows(event_id, changed_since=None):
+    """Yield (id, ticket_code hash, barcode hash, status bits) per ticket of the event."""
+    stmt = (
+        select(Ticket.id, Ticket.ticket_code_key, Ticket.barcode_key, Ticket.status)
+        .join(TicketBatch, TicketBatch.id == Ticket.batch_id)
+        .where(TicketBatch.event_id == event_id)
+        .order_by(Ticket.id)
+        .execution_options(yield_per=OFFLINE_BUNDLE_STREAM_SIZE)
+    )
+    if changed_since is not None:
+        stmt = stmt.where(Ticket.updated_at >= changed_since)
+    for ticket_id, code_key, barcode_key, status in db.session.execute(stmt):
+        yield ticket_id, ticket_code_hash(code_key), ticket_code_hash(barcode_key), TICKET_STATUS_BITS.get(status, 0)
+
+
+def _ticket_hash_entries(event_id):
+    """Sorted (hash, status bits) pairs, one per distinct ticket code or barcode."""
+    entries = {}
+    for _, code_hash, barcode_hash, bits in _ticket_rows(event_id):
+        entries[code_hash] = bits
+        entries[barcode_hash] = bits
+    return sorted(entries.items())
+
+
+def ticket_hash_set(event_id):
+    """
+    The event's tickets as a hashed code set: 'hashes' is base64 of the sorted
+    concatenated digests, 'status' base64 of one status byte per digest.
+    """
+    entries = _ticket_hash_entries(event_id)
+    return {
+        'count': len(entries),
+        'hash': f'blake2b-{TICKET_HASH_BYTES * 8}',
+        'hash_bytes': TICKET_HASH_BYTES,
+        'key': 'trimmed, uppercased ticket_code or barcode (UTF-8)',
+        'status_bits': TICKET_STATUS_BITS,
+        'hashes': base64.b64encode(b''.join(digest for digest, _ in entries)).decode('ascii'),
+        'status': base64.b64encode(bytes(bits for _, bits in entries)).decode('ascii'),
+    }
+
+
+def _gate_rows(event_id):
+    gates = db.session.execute(
+        select(Gate.id, Gate.gate_name, Gate.gate_type, Gate.is_active)
+        .where(Gate.event_id == event_id)
+        .order_by(Gate.id)
+    ).all()
+    allowed = {}
+    rules = db.session.execute(
+        select(GateAccessRule.gate_id, GateAccessRule.pass_type_id)
+        .join(Gate, Gate.id == GateAccessRule.gate_id)
+        .where(Gate.event_id == event_id, GateAccessRule.can_access.is_(True))
+        .order_by(GateAccessRule.gate_id, GateAccessRule.pass_type_id)
+    )
+    for gate_id, pass_type_id in rules:
+        allowed.setdefault(gate_id, []).append(pass_type_id)
+    return [
+        {
+            'id': gate_id,
+            'name': name,
+            'type': gate_type,
+            'is_active': bool(is_active),
+            'allowed_pass_types': allowed.get(gate_id, []),
+        }
+        for gate_id, name, gate_type, is_active in gates
+    ]
+
+
+def _pass_type_names(event_id):
+    rows = db.session.execute(
+        select(PassType.id, PassType.type_name)
+        .where(PassType.id.in_(select(EventPass.pass_type_id).where(EventPass.event_id == event_id)))
+        .order_by(PassType.id)
+    )
+    return {type_id: name for type_id, name in rows}
+
+
+def _event_meta(event):
+    return {
+        'id': event.id,
+        'name': event.event_name,
+        'date': event.event_date.strftime('%Y-%m-%d') if event.event_date else None,
+        'time': event.event_time.strftime('%H:%M:%S') if event.event_time else None,
+        'location': event.location,
+    }
+
+
+def _columns(rows, names):
+    columns = {name: [] for name in names}
+    appenders = [columns[name].append for name in names]
+    for row in rows:
+        for append, value in zip(appenders, row):
+            append(value)
+    return columns
+
+
+def _columnar_bundle(event):
+    columns = _columns(_pass_rows(event.id), PASS_COLUMNS)
+
+    document = {
+        'format': 'columnar',
+        'version': OFFLINE_BUNDLE_VERSION,
+        'event': _event_meta(event),
+        'gates': _gate_rows(event.id),
+        'pass_types': {str(type_id): name for type_id, name in _pass_type_names(event.id).items()},
+        # encrypted_data is null wherever it equals pass_code.
+        'passes': {'count': len(columns['id']), 'columns': columns},
+        'tickets': ticket_hash_set(event.id),
+    }
+    return json.dumps(document, separators=(',', ':')).encode('utf-8')
+
+
+def _sqlite_bundle(event):
+    fd, path = tempfile.mkstemp(suffix='.sqlite')
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(path)
+        try:
+            conn.executescript("""
+                PRAGMA journal_mode = OFF;
+                PRAGMA synchronous = OFF;
+                CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+                CREATE TABLE passes (
+                    id INTEGER PRIMARY KEY,
+                    pass_code TEXT NOT NULL,
+                    pass_code_key TEXT,
+                    encrypted_data TEXT,
+                    participant_name TEXT,
+                    pass_type_id INTEGER,
+                    is_validated INTEGER NOT NULL DEFAULT 0,
+                    validation_count INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE TABLE gates (id INTEGER PRIMARY KEY, name TEXT, type TEXT, is_active INTEGER);
+                CREATE TABLE gate_access (gate_id INTEGER, pass_type_id INTEGER, PRIMARY KEY (gate_id, pass_type_id));
+                CREATE TABLE pass_types (id INTEGER PRIMARY KEY, name TEXT);
+                CREATE TABLE tickets (code_hash BLOB PRIMARY KEY, status INTEGER NOT NULL) WITHOUT ROWID;
+            """)
+            meta = dict(
+                _event_meta(event), format='sqlite', version=OFFLINE_BUNDLE_VERSION,
+                ticket_hash=f'blake2b-{TICKET_HASH_BYTES * 8}', ticket_status_bits=json.dumps(TICKET_STATUS_BITS),
+            )
+            conn.executemany(
+                'INSERT INTO meta (key, value) VALUES (?, ?)',
+                [(key, None if value is None else str(value)) for key, value in meta.items()]
+            )
+
+            insert = f'INSERT INTO passes ({", ".join(PASS_COLUMNS)}) VALUES ({", ".join("?" * len(PASS_COLUMNS))})'
+            chunk = []
+            for row in _pass_rows(event.id):
+                chunk.append(row)
+                if len(chunk) >= OFFLINE_BUNDLE_STREAM_SIZE:
+                    conn.executemany(insert, chunk)
+                    chunk = []
+            if chunk:
+                conn.executemany(insert, chunk)
+
+            for gate in _gate_rows(event.id):
+                conn.execute(
+                    'INSERT INTO gates (id, name, type, is_active) VALUES (?, ?, ?, ?)',
+                    (gate['id'], gate['name'], gate['type'], 1 if gate['is_active'] else 0)
+                )
+                conn.executemany(
+                    'INSERT INTO gate_access (gate_id, pass_type_id) VALUES (?, ?)',
+                    [(gate['id'], type_id) for type_id in gate['allowed_pass_types']]
+                )
+            conn.executemany('INSERT INTO pass_types (id, name) VALUES (?, ?)', _pass_type_names(event.id).items())
+            conn.executemany('INSERT INTO tickets (code_hash, status) VALUES (?, ?)', _ticket_hash_entries(event.id))
+
+            # Indexes after the bulk insert; scanners look passes up by canonical code.
+            conn.execute('CREATE INDEX ix_passes_pass_code_key ON passes (pass_code_key)')
+            conn.execute('CREATE INDEX ix_passes_pass_code ON passes (pass_code)')
+            conn.commit()
+            conn.execute('VACUUM')
+        finally:
+            conn.close()
+
+        with open(path, 'rb') as handle:
+            return handle.read()
+    finally:
+        os.remove(path)
+
+
+def build_offline_bundle(event, bundle_format):
+    """
+    Return (gzipped bytes, sha256 hex of those bytes, filename) for the event's
+    offline bundle in `bundle_format` (one of OFFLINE_BUNDLE_FORMATS).
+    """
+    if bundle_format == 'sqlite':
+        raw, filename = _sqlite_bundle(event), f'offline_db_event_{event.id}.sqlite.gz'
+    else:
+        raw, filename = _columnar_bundle(event), f'offline_db_event_{event.id}.json.gz'
+
+    body = gzip.compress(raw, compresslevel=6, mtime=0)
+    return body, hashlib.sha256(body).hexdigest(), filename
+
+
+def build_offline_delta(event, since, cursor, bundle_format):
+    """
+    Return (body bytes, content type) with the passes and tickets of `event` changed
+    since the `since` cursor, plus every gate with its rules (gate and rule deletions
+    leave no rows behind, so gates are always sent in full). `bundle_format` is 'json'
+    (rows as objects) or 'columnar' (gzipped, one array per column).
+    """
+    changed_since = parse_offline_cursor(since) - timedelta(seconds=OFFLINE_DELTA_OVERLAP_SECONDS)
+    passes = _pass_rows(event.id, changed_since)
+    # Hex digests here; they are the entries of the bundle's ticket hash set.
+    tickets = (
+        (ticket_id, code_hash.hex(), barcode_hash.hex(), bits)
+        for ticket_id, code_hash, barcode_hash, bits in _ticket_rows(event.id, changed_since)
+    )
+    if bundle_format == 'columnar':
+        passes = _columns(passes, PASS_COLUMNS)
+        tickets = _columns(tickets, TICKET_COLUMNS)
+    else:
+        passes = [dict(zip(PASS_COLUMNS, row)) for row in passes]
+        tickets = [dict(zip(TICKET_COLUMNS, row)) for row in tickets]
+
+    document = {
+        'format': f'{bundle_format}-delta',
+        'version': OFFLINE_BUNDLE_VERSION,
+        'event': _event_meta(event),
+        'since': int(since),
+        'cursor': cursor,
+        'gates': _gate_rows(event.id),
+        'pass_types': {str(type_id): name for type_id, name in _pass_type_names(event.id).items()},
+        'passes': passes,
+        'tickets': tickets,
+        'ticket_status_bits': TICKET_STATUS_BITS,
+    }
+    raw = json.dumps(document, separators=(',', ':')).encode('utf-8')
+    if bundle_format == 'columnar':
+        return gzip.compress(raw, compresslevel=6, mtime=0), 'application/gzip'
+    return raw, 'application/json'
@@ -0,0 +1,68 @@
+from collections import namedtuple
+from itertools import groupby
+from operator import itemgetter
+
+
+# Deterministic merge of offline scans: per pass, the earliest successful scan
+# (uploaded or already stored) is the admission; every later success becomes a
+# duplicate. The outcome does not depend on upload order, and re-uploads are
+# no-ops because stored scans are deduped before merging.
+PassConflict = namedtuple('PassConflict', ['pass_id', 'admitted_at', 'duplicates'])
+
+
+class MergePlan:
+    """What merge_offline_scans decided for one upload."""
+
+    def __init__(self):
+        self.admitted = set()  # pass ids whose first admission is in this upload
+        self.superseded = {}   # pass id -> admission time; stored later successes become duplicates
+        self.conflicts = []    # PassConflict per pass with new duplicates
+
+
+def duplicate_message(admitted_at):
+    return f"Duplicate admission (first admitted {admitted_at.strftime('%Y-%m-%d %H:%M:%S')})"
+
+
+def merge_offline_scans(records, pass_validated, stored_admissions):
+    """
+    Classify new offline scan records in one sorted, grouped pass (O(n log n)).
+
+    records: new records with pass_id, validation_time, validation_status, index
+    pass_validated: pass id -> is_validated as currently stored
+    stored_admissions: pass id -> earliest stored successful validation_time
+
+    Later successes are rewritten in place to status 'duplicate'; each record
+    gets 'admits' = True when it is the pass's first admission ever.
+    """
+    plan = MergePlan()
+    ordered = sorted(records, key=itemgetter('pass_id', 'validation_time', 'index'))
+
+    for pass_id, group in groupby(ordered, key=itemgetter('pass_id')):
+        successes = [r for r in group if r['validation_status'] == 'success']
+        if not successes:
+            continue
+
+        first = successes[0]
+        stored_at = stored_admissions.get(pass_id)
+        if stored_at is not None and stored_at <= first['validation_time']:
+            admitted_at, duplicates = stored_at, successes
+        elif stored_at is None and pass_validated.get(pass_id):
+            # Admitted online without a (written) success log yet: that admission stands.
+            admitted_at, duplicates = None, successes
+        else:
+            admitted_at, duplicates = first['validation_time'], successes[1:]
+            if stored_at is not None:
+                plan.superseded[pass_id] = admitted_at
+            else:
+                first['admits'] = True
+                plan.admitted.add(pass_id)
+
+        for record in duplicates:
+            record['validation_status'] = 'duplicate'
+            record['validation_message'] = (
+                duplicate_message(admitted_at) if admitted_at else 'Duplicate admission (already validated)'
+            )
+        if duplicates or pass_id in plan.superseded:
+            plan.conflicts.append(PassConflict(pass_id, admitted_at, duplicates))
+
+    return plan
@@ -0,0 +1,251 @@
+import atexit
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, func, insert, or_, select, update
+
+from database import db
+from models import canonical_code, OfflineValidationQueue
+from utils.offline_sync import parse_offline_validations, store_offline_records
+
+
+logger = logging.getLogger(__name__)
+
+# Offline sync uploads are appended to offline_validation_queue. Clients that
+# opt in to an async response get 202 and a background thread per worker drains
+# pending rows in batches; the thread is only started by the server (python
+# app.py, or OFFLINE_SYNC_WORKER=True under a WSGI server), never by scripts
+# that merely import the app. Rows are claimed with a lease, so several workers
+# can drain side by side and rows of a worker that died mid-batch are picked up
+# again once it expires.
+OFFLINE_SYNC_WORKER = os.getenv('OFFLINE_SYNC_WORKER', 'False') == 'True'
+OFFLINE_QUEUE_BATCH_SIZE = int(os.getenv('OFFLINE_QUEUE_BATCH_SIZE', 1000))
+OFFLINE_QUEUE_POLL_SECONDS = float(os.getenv('OFFLINE_QUEUE_POLL_SECONDS', 2))
+OFFLINE_QUEUE_CLAIM_TIMEOUT_SECONDS = int(os.getenv('OFFLINE_QUEUE_CLAIM_TIMEOUT', 300))
+OFFLINE_QUEUE_MAX_ATTEMPTS = int(os.getenv('OFFLINE_QUEUE_MAX_ATTEMPTS', 5))
+
+_worker = None
+_queue_table = OfflineValidationQueue.__table__
+
+
+def enqueue_offline_upload(items, user_id, ip_address=None, wake=True):
+    """
+    Validate an upload and append its valid items as pending queue rows (one commit).
+    Return (upload_id, results) where results holds the rejected items (None elsewhere).
+    wake=False leaves the rows to the caller (inline processing).
+    """
+    records, results = parse_offline_validations(items, user_id, ip_address)
+    upload_id = uuid.uuid4().hex
+    if records:
+        db.session.execute(insert(OfflineValidationQueue), [
+            {
+                'pass_code': r['pass_code'],
+                'validator_id': r['validator_id'],
+                'validation_status': r['validation_status'],
+                'validation_message': r['validation_message'],
+                'gate_id': r['gate_id'],
+                'gate_access_granted': r['gate_access_granted'],
+                'gate_access_message': r['gate_access_message'],
+                'ip_address': r['ip_address'],
+                'validation_time': r['validation_time'],
+                'sync_status': 'pending',
+                'upload_id': upload_id,
+                'item_index': r['index'],
+                'uploaded_by': user_id,
+                'attempts': 0,
+            }
+            for r in records
+        ])
+    db.session.commit()
+    if wake and _worker is not None and records:
+        _worker.wake()
+    return upload_id, results
+
+
+def _claim(batch_size, upload_id=None):
+    """Lease up to batch_size pending rows to a new claim token; return the claimed rows."""
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=OFFLINE_QUEUE_CLAIM_TIMEOUT_SECONDS)
+    claimable = (
+        select(OfflineValidationQueue.id)
+        .where(
+            OfflineValidationQueue.sync_status == 'pending',
+            or_(OfflineValidationQueue.claimed_at.is_(None), OfflineValidationQueue.claimed_at < stale),
+        )
+        .order_by(OfflineValidationQueue.id)
+        .limit(batch_size)
+    )
+    if upload_id is not None:
+        claimable = claimable.where(OfflineValidationQueue.upload_id == upload_id)
+    ids = db.session.execute(claimable).scalars().all()
+    if not ids:
+        db.session.commit()
+        return []
+
+    token = uuid.uuid4().hex
+    # Conditional on the same predicate, so two drains never hold the same row.
+    db.session.execute(
+        update(_queue_table)
+        .where(
+            _queue_table.c.id.in_(ids),
+            _queue_table.c.sync_status == 'pending',
+            or_(_queue_table.c.claimed_at.is_(None), _queue_table.c.claimed_at < stale),
+        )
+        .values(claimed_by=token, claimed_at=now, attempts=func.coalesce(_queue_table.c.attempts, 0) + 1)
+    )
+    db.session.commit()
+    return db.session.execute(
+        select(OfflineValidationQueue).where(OfflineValidationQueue.claimed_by == token)
+        .order_by(OfflineValidationQueue.id)
+    ).scalars().all()
+
+
+def _record(row):
+    return {
+        'index': row.id,
+        'item': row.item_index,
+        'pass_code': row.pass_code,
+        'pass_key': canonical_code(row.pass_code),
+        'validator_id': row.validator_id,
+        'validation_time': row.validation_time,
+        'validation_status': row.validation_status,
+        'validation_message': row.validation_message,
+        'ip_address': row.ip_address,
+        'gate_id': row.gate_id,
+        'gate_access_granted': True if row.gate_access_granted is None else row.gate_access_granted,
+        'gate_access_message': row.gate_access_message,
+    }
+
+
+def _settle(attempts, results):
+    """Mark claimed rows synced / failed, or release them for a retry."""
+    now = datetime.utcnow()
+    outcomes = []
+    for row_id, tries in attempts.items():
+        result = results.get(row_id) or {'status': 'error', 'message': 'Not processed'}
+        if result['status'] in ('synced', 'duplicate'):
+            outcomes.append({'row_id': row_id, 'state': 'synced', 'done_at': now, 'error': None})
+        elif result['status'] in ('not_found', 'invalid') or (tries or 0) >= OFFLINE_QUEUE_MAX_ATTEMPTS:
+            outcomes.append({'row_id': row_id, 'state': 'failed', 'done_at': None, 'error': result.get('message')})
+        else:
+            outcomes.append({'row_id': row_id, 'state': 'pending', 'done_at': None, 'error': result.get('message')})
+
+    db.session.execute(
+        update(_queue_table)
+        .where(_queue_table.c.id == bindparam('row_id'))
+        .values(
+            sync_status=bindparam('state'),
+            synced_at=bindparam('done_at'),
+            last_error=bindparam('error'),
+            claimed_by=None,
+            claimed_at=None,
+        ),
+        outcomes
+    )
+    db.session.commit()
+
+
+def drain_offline_queue(batch_size=OFFLINE_QUEUE_BATCH_SIZE, upload_id=None):
+    """
+    Process one batch of pending rows (optionally of one upload).
+    Return {row id: result} for the rows processed; empty when nothing was pending.
+    """
+    rows = _claim(batch_size, upload_id)
+    if not rows:
+        return {}
+
+    # Plain copies up front: the chunk commits in store_offline_records expire the rows.
+    records = [_record(row) for row in rows]
+    attempts = {row.id: row.attempts for row in rows}
+    results = {}
+    try:
+        store_offline_records(records, results)
+    except Exception:
+        db.session.rollback()
+        logger.exception('Offline queue batch of %d rows failed', len(records))
+    _settle(attempts, results)
+    return results
+
+
+def offline_upload_status(upload_id):
+    """Counts per sync_status and the failed/retrying items of one upload, or None if unknown."""
+    rows = db.session.execute(
+        select(
+            OfflineValidationQueue.item_index, OfflineValidationQueue.sync_status,
+            OfflineValidationQueue.attempts, OfflineValidationQueue.last_error,
+            OfflineValidationQueue.uploaded_by,
+        )
+        .where(OfflineValidationQueue.upload_id == upload_id)
+        .order_by(OfflineValidationQueue.item_index)
+    ).all()
+    if not rows:
+        return None
+
+    counts = {'pending': 0, 'synced': 0, 'failed': 0}
+    problems = []
+    for item_index, sync_status, attempts, last_error, _ in rows:
+        counts[sync_status] = counts.get(sync_status, 0) + 1
+        if last_error:
+            problems.append({
+                'index': item_index, 'sync_status': sync_status, 'attempts': attempts, 'message': last_error,
+            })
+    return {
+        'upload_id': upload_id,
+        'uploaded_by': rows[0][4],
+        'total': len(rows),
+        'counts': counts,
+        'complete': counts['pending'] == 0,
+        'errors': problems,
+    }
+
+
+class OfflineQueueWorker:
+    """Background thread that drains offline_validation_queue."""
+
+    def __init__(self, app, poll_interval=OFFLINE_QUEUE_POLL_SECONDS):
+        self.app = app
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='offline-queue-drain', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    while not self._stop.is_set() and drain_offline_queue():
+                        pass
+            except Exception:
+                logger.exception('Offline queue drain failed')
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=5)
+
+
+def init_offline_queue_worker(app, enabled=OFFLINE_SYNC_WORKER):
+    """Start the background drain if enabled (OFFLINE_SYNC_WORKER by default)."""
+    global _worker
+    if not enabled or _worker is not None:
+        return _worker
+    _worker = OfflineQueueWorker(app).start()
+    atexit.register(_worker.stop)
+    return _worker
+
+
+def offline_worker_enabled():
+    return _worker is not None
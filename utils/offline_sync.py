@@ -0,0 +1,364 @@
+import logging
+import os
+from datetime import datetime, timezone
+
+from itertools import groupby
+from operator import itemgetter
+
+from sqlalchemy import bindparam, func, insert, select, update
+
+from database import db
+from models import canonical_code, EventPass, Gate, GateValidationLog, RealtimeAlert, User, ValidationLog
+from utils.duplicate_detector import duplicate_alerts_enabled
+from utils.gate_access import get_gate_access
+from utils.live_feed import (
+    alert_payload, discard_staged_publishes, release_staged_publishes, stage_consumed, stage_publish
+)
+from utils.offline_merge import duplicate_message, merge_offline_scans
+
+
+logger = logging.getLogger(__name__)
+
+# Uploads are resolved and written in chunks; each chunk commits on its own, so
+# one bad chunk only fails its own items and a long upload never holds a single
+# giant transaction.
+OFFLINE_SYNC_CHUNK_SIZE = int(os.getenv('OFFLINE_SYNC_CHUNK_SIZE', 500))
+OFFLINE_SYNC_MAX_ITEMS = int(os.getenv('OFFLINE_SYNC_MAX_ITEMS', 20000))
+
+VALIDATION_STATUSES = ('success', 'failed', 'duplicate')
+LOG_COLUMNS = ('pass_id', 'validator_id', 'validation_time', 'validation_status', 'validation_message', 'ip_address')
+
+
+def _chunks(items, size=OFFLINE_SYNC_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _parse_time(value):
+    parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _optional_int(value):
+    return None if value is None or value == '' else int(value)
+
+
+def _parse_item(item, default_validator_id, default_ip):
+    """Return (record, None) or (None, error message) for one uploaded validation."""
+    if not isinstance(item, dict):
+        return None, 'Validation must be an object'
+
+    pass_code = str(item.get('pass_code') or '').strip()
+    if not pass_code:
+        return None, 'pass_code is required'
+
+    status = item.get('validation_status')
+    if status not in VALIDATION_STATUSES:
+        return None, f"validation_status must be one of: {', '.join(VALIDATION_STATUSES)}"
+
+    try:
+        validation_time = _parse_time(item['validation_time'])
+    except (KeyError, TypeError, ValueError):
+        return None, 'validation_time must be an ISO-8601 timestamp'
+
+    try:
+        validator_id = _optional_int(item.get('validator_id'))
+        gate_id = _optional_int(item.get('gate_id'))
+    except (TypeError, ValueError):
+        return None, 'validator_id and gate_id must be integers'
+
+    return {
+        'pass_code': pass_code,
+        'pass_key': canonical_code(pass_code),
+        'validator_id': validator_id if validator_id is not None else default_validator_id,
+        'validation_time': validation_time,
+        'validation_status': status,
+        'validation_message': item.get('validation_message'),
+        'ip_address': item.get('ip_address') or default_ip,
+        'gate_id': gate_id,
+        'gate_access_granted': bool(item.get('gate_access_granted', True)),
+        'gate_access_message': item.get('gate_access_message'),
+    }, None
+
+
+def _existing_ids(column, ids):
+    found = set()
+    ids = sorted(ids)
+    for chunk in _chunks(ids):
+        found.update(db.session.execute(select(column).where(column.in_(chunk))).scalars())
+    return found
+
+
+def _resolve_passes(pass_keys):
+    """canonical pass code -> (pass id, event id, pass code, is_validated), one IN query per chunk."""
+    resolved = {}
+    for chunk in _chunks(sorted(pass_keys)):
+        rows = db.session.execute(
+            select(EventPass.pass_code_key, EventPass.id, EventPass.event_id, EventPass.pass_code,
+                   EventPass.is_validated)
+            .where(EventPass.pass_code_key.in_(chunk))
+        )
+        for key, pass_id, event_id, pass_code, validated in rows:
+            resolved[key] = (pass_id, event_id, pass_code, bool(validated))
+    return resolved
+
+
+def _stored_admissions(pass_ids):
+    """pass id -> earliest stored successful validation_time, one grouped query per chunk."""
+    admissions = {}
+    for chunk in _chunks(sorted(pass_ids)):
+        admissions.update(db.session.execute(
+            select(ValidationLog.pass_id, func.min(ValidationLog.validation_time))
+            .where(ValidationLog.pass_id.in_(chunk), ValidationLog.validation_status == 'success')
+            .group_by(ValidationLog.pass_id)
+        ).all())
+    return admissions
+
+
+def _pass_group_chunks(records, size=OFFLINE_SYNC_CHUNK_SIZE):
+    """Chunks of records that never split one pass's scans, so a pass merges atomically."""
+    chunk = []
+    ordered = sorted(records, key=itemgetter('pass_id', 'validation_time', 'index'))
+    for _, group in groupby(ordered, key=itemgetter('pass_id')):
+        chunk.extend(group)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _dedupe_key(record):
+    return (record['pass_id'], record['gate_id'], record['validation_time'], record['validator_id'])
+
+
+def _already_synced(records):
+    """Dedupe keys of these records that an earlier upload already stored."""
+    existing = set()
+    for chunk in _chunks(records):
+        times = [r['validation_time'] for r in chunk]
+        rows = db.session.execute(
+            select(ValidationLog.pass_id, GateValidationLog.gate_id, ValidationLog.validation_time,
+                   ValidationLog.validator_id)
+            .outerjoin(GateValidationLog, GateValidationLog.validation_log_id == ValidationLog.id)
+            .where(
+                ValidationLog.pass_id.in_({r['pass_id'] for r in chunk}),
+                ValidationLog.validation_time.between(min(times), max(times)),
+            )
+        )
+        existing.update(tuple(row) for row in rows)
+    return existing
+
+
+def _write_chunk(chunk, plan, passes):
+    """Insert logs and apply merge decisions for one chunk of new records; return the log ids."""
+    # One multi-row INSERT ... RETURNING. Asking for parameter order would make
+    # SQLite insert row by row, so ids are matched back by the returned content
+    # (rows with identical content are interchangeable).
+    returned = db.session.execute(
+        insert(ValidationLog).returning(ValidationLog.id, *(getattr(ValidationLog, name) for name in LOG_COLUMNS)),
+        [{name: r[name] for name in LOG_COLUMNS} for r in chunk]
+    ).all()
+    ids_by_content = {}
+    for log_id, *content in returned:
+        ids_by_content.setdefault(tuple(content), []).append(log_id)
+    log_ids = [ids_by_content[tuple(r[name] for name in LOG_COLUMNS)].pop() for r in chunk]
+
+    gate_rows = [
+        {
+            'validation_log_id': log_id,
+            'gate_id': r['gate_id'],
+            'gate_access_granted': r['gate_access_granted'],
+            'gate_access_message': r['gate_access_message'],
+        }
+        for r, log_id in zip(chunk, log_ids)
+        if r['gate_id'] is not None
+    ]
+    if gate_rows:
+        db.session.execute(insert(GateValidationLog), gate_rows)
+
+    admitted = [{'pass_id': r['pass_id']} for r in chunk if r.get('admits')]
+    if admitted:
+        for event_id in {passes[row['pass_id']][1] for row in admitted}:
+            stage_consumed(event_id)
+        table = EventPass.__table__
+        db.session.execute(
+            update(table)
+            .where(table.c.id == bindparam('pass_id'), table.c.is_validated.isnot(True))
+            .values(is_validated=True, validation_count=func.coalesce(table.c.validation_count, 0) + 1),
+            admitted
+        )
+
+    chunk_pass_ids = {r['pass_id'] for r in chunk}
+    superseded = {
+        pass_id: admitted_at for pass_id, admitted_at in plan.superseded.items() if pass_id in chunk_pass_ids
+    }
+    reclassified = _supersede_stored(superseded, set(log_ids)) if superseded else {}
+
+    for conflict in plan.conflicts:
+        if conflict.pass_id in chunk_pass_ids:
+            _raise_conflict_alert(conflict, passes[conflict.pass_id], reclassified.get(conflict.pass_id, []))
+
+    db.session.commit()
+    release_staged_publishes()
+    return log_ids
+
+
+def _supersede_stored(superseded, new_log_ids):
+    """
+    An uploaded scan predates the stored admission of these passes (pass id ->
+    admission time): their later stored successes become duplicates, with the
+    message and gate access rewritten to match. Return pass id -> gate ids of
+    the re-classified logs (None for logs without a gate).
+    """
+    rows = db.session.execute(
+        select(ValidationLog.id, ValidationLog.pass_id, ValidationLog.validation_time, GateValidationLog.gate_id)
+        .outerjoin(GateValidationLog, GateValidationLog.validation_log_id == ValidationLog.id)
+        .where(ValidationLog.pass_id.in_(superseded), ValidationLog.validation_status == 'success')
+    ).all()
+
+    reclassified = {}
+    updates = []
+    for log_id, pass_id, validation_time, gate_id in rows:
+        admitted_at = superseded[pass_id]
+        if log_id in new_log_ids or validation_time <= admitted_at:
+            continue
+        reclassified.setdefault(pass_id, []).append(gate_id)
+        updates.append({'b_log_id': log_id, 'b_message': duplicate_message(admitted_at)})
+    if not updates:
+        return reclassified
+
+    table = ValidationLog.__table__
+    db.session.execute(
+        update(table).where(table.c.id == bindparam('b_log_id'))
+        .values(validation_status='duplicate', validation_message=bindparam('b_message')),
+        updates
+    )
+    gate_table = GateValidationLog.__table__
+    db.session.execute(
+        update(gate_table)
+        .where(gate_table.c.validation_log_id.in_([row['b_log_id'] for row in updates]))
+        .values(gate_access_granted=False, gate_access_message='Duplicate scan')
+    )
+    return reclassified
+
+
+def _raise_conflict_alert(conflict, pass_info, reclassified_gates=()):
+    _, event_id, pass_code, _ = pass_info
+    if not duplicate_alerts_enabled(event_id):
+        return
+
+    gate_ids = list(dict.fromkeys(
+        gate_id for gate_id in [r['gate_id'] for r in conflict.duplicates] + list(reclassified_gates)
+        if gate_id is not None
+    ))
+    gate_names = []
+    for gate_id in gate_ids:
+        access = get_gate_access(gate_id)
+        gate_names.append(access.gate_name if access else f'Gate #{gate_id}')
+    first_admission = (
+        conflict.admitted_at.strftime('%Y-%m-%d %H:%M:%S') if conflict.admitted_at else 'online'
+    )
+    entries = len(conflict.duplicates) + len(reclassified_gates) + 1
+
+    alert = RealtimeAlert(
+        event_id=event_id,
+        alert_type='duplicate_entry',
+        alert_message=(
+            f'Pass {pass_code} admitted {entries} times across offline sync '
+            f'(first admission {first_admission}'
+            + (f'; duplicates at {", ".join(gate_names)}' if gate_names else '') + ')'
+        ),
+        pass_id=conflict.pass_id,
+        gate_id=gate_ids[0] if gate_ids else None,
+        severity='high' if len(gate_ids) > 1 else 'medium',
+    )
+    db.session.add(alert)
+    db.session.flush()
+    stage_publish(event_id, 'alert', alert_payload(alert))
+
+
+def parse_offline_validations(items, default_validator_id, default_ip=None):
+    """
+    Parse uploaded items without touching the DB. Return (records, results):
+    results has an 'invalid' entry per rejected item and None for parsed ones.
+    """
+    results = [None] * len(items)
+    records = []
+    for index, item in enumerate(items):
+        record, error = _parse_item(item, default_validator_id, default_ip)
+        if error:
+            results[index] = {'index': index, 'status': 'invalid', 'message': error}
+        else:
+            record['index'] = record['item'] = index
+            records.append(record)
+    return records, results
+
+
+def store_offline_records(records, results):
+    """
+    Resolve, dedupe, merge and write parsed records set-wise, filling
+    results[record['index']] with {'index', 'status', ...}, status one of
+    synced / duplicate / not_found / invalid / error.
+
+    Records repeating (pass, gate, validation_time, validator) of an earlier
+    record or of an earlier upload are reported as duplicates and not stored again.
+    Successful scans are merged per pass (see utils.offline_merge): only the
+    earliest admits, later ones are stored as 'duplicate' and raise an alert.
+    """
+    def result(record, status, **extra):
+        results[record['index']] = dict({'index': record['item'], 'status': status}, **extra)
+
+    valid_validators = _existing_ids(User.id, {r['validator_id'] for r in records})
+    valid_gates = _existing_ids(Gate.id, {r['gate_id'] for r in records if r['gate_id'] is not None})
+    passes_by_key = _resolve_passes({r['pass_key'] for r in records})
+
+    pending = []
+    for r in records:
+        if r['validator_id'] not in valid_validators:
+            result(r, 'invalid', message='Unknown validator_id')
+        elif r['gate_id'] is not None and r['gate_id'] not in valid_gates:
+            result(r, 'invalid', message='Unknown gate_id')
+        elif r['pass_key'] not in passes_by_key:
+            result(r, 'not_found', message='Pass not found')
+        else:
+            r['pass_id'] = passes_by_key[r['pass_key']][0]
+            pending.append(r)
+
+    stored = _already_synced(pending) if pending else set()
+    first_item = {}
+    new_records = []
+    for r in pending:
+        key = _dedupe_key(r)
+        if key in stored:
+            result(r, 'duplicate', message='Already synced')
+        elif key in first_item:
+            result(r, 'duplicate', message=f'Same validation as item {first_item[key]}')
+        else:
+            first_item[key] = r['item']
+            new_records.append(r)
+
+    passes = {info[0]: info for info in passes_by_key.values()}
+    plan = merge_offline_scans(
+        new_records,
+        {pass_id: info[3] for pass_id, info in passes.items()},
+        _stored_admissions({r['pass_id'] for r in new_records}),
+    )
+
+    for chunk in _pass_group_chunks(new_records):
+        try:
+            log_ids = _write_chunk(chunk, plan, passes)
+        except Exception:
+            db.session.rollback()
+            discard_staged_publishes()
+            logger.exception('Offline sync chunk of %d validations failed', len(chunk))
+            for r in chunk:
+                result(r, 'error', message='Could not store validation')
+            continue
+        for r, log_id in zip(chunk, log_ids):
+            result(r, 'synced', validation_log_id=log_id, validation_status=r['validation_status'])
+
+    return results
+
@@ -0,0 +1,74 @@
+import base64
+import hashlib
+import hmac
+import os
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from flask import current_app
+
+
+# Opt-in signed QR payloads:
+#   PT1.<event_id>.<pass_id>.<pass_type_id>.<expires epoch, 0 = none>.<signature>
+# The signature is a truncated HMAC-SHA256 under a per-event key derived from
+# PASS_TOKEN_SECRET (or SECRET_KEY). Tokens are uppercase alphanumerics plus '.',
+# so they stay in the compact QR alphanumeric mode and survive canonical_code().
+SIGNED_PASS_TOKENS = os.getenv('SIGNED_PASS_TOKENS', 'False') == 'True'
+PASS_TOKEN_PREFIX = 'PT1'
+PASS_TOKEN_SIGNATURE_BYTES = 10
+
+PassToken = namedtuple('PassToken', ['event_id', 'pass_id', 'pass_type_id', 'expires_at'])
+
+
+def signed_tokens_enabled():
+    return SIGNED_PASS_TOKENS
+
+
+def is_pass_token(code):
+    return bool(code) and code[:len(PASS_TOKEN_PREFIX) + 1].upper() == f'{PASS_TOKEN_PREFIX}.'
+
+
+def _master_secret():
+    secret = os.getenv('PASS_TOKEN_SECRET') or current_app.config['SECRET_KEY']
+    return secret.encode('utf-8')
+
+
+def event_token_key(event_id):
+    """Per-event signing key, so a key handed to one event's scanners can't sign another event's passes."""
+    return hmac.new(_master_secret(), f'pass-token:{event_id}'.encode('utf-8'), hashlib.sha256).digest()
+
+
+def _sign(event_id, body):
+    digest = hmac.new(event_token_key(event_id), body.encode('utf-8'), hashlib.sha256).digest()
+    return base64.b32encode(digest[:PASS_TOKEN_SIGNATURE_BYTES]).decode('ascii').rstrip('=')
+
+
+def issue_pass_token(pass_obj):
+    """Signed token for a flushed EventPass (needs pass_obj.id)."""
+    expires = 0
+    if pass_obj.expires_at:
+        expires = int(pass_obj.expires_at.replace(tzinfo=timezone.utc).timestamp())
+    body = f'{PASS_TOKEN_PREFIX}.{pass_obj.event_id}.{pass_obj.id}.{pass_obj.pass_type_id}.{expires}'
+    return f'{body}.{_sign(pass_obj.event_id, body)}'
+
+
+def verify_pass_token(code):
+    """
+    Return (PassToken, None) for an authentic token, or (None, message) when it is
+    malformed or the signature does not match. No DB access.
+    """
+    parts = code.strip().upper().split('.')
+    if len(parts) != 6 or parts[0] != PASS_TOKEN_PREFIX:
+        return None, "Malformed pass token"
+
+    try:
+        event_id, pass_id, pass_type_id, expires = (int(part) for part in parts[1:5])
+    except ValueError:
+        return None, "Malformed pass token"
+
+    body = '.'.join(parts[:5])
+    if not hmac.compare_digest(_sign(event_id, body), parts[5]):
+        return None, "Invalid pass token signature"
+
+    expires_at = datetime.utcfromtimestamp(expires) if expires else None
+    return PassToken(event_id, pass_id, pass_type_id, expires_at), None
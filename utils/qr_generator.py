@@ -53,17 +53,18 @@ def generate_pass_code(event_id, pass_type, participant_id):
     return code
 
 
-def create_event_pass_qr(pass_code, event_name, participant_name, pass_type):
+def create_event_pass_qr(pass_code, event_name, participant_name, pass_type, payload=None):
     """
     Best practice:
-    QR encodes ONLY pass_code (opaque token).
+    QR encodes ONLY pass_code (opaque token), or a signed pass token when given
+    as payload (see utils/pass_tokens.py).
     Validation does all checks server-side using DB lookups.
     Returns: (qr_code_path, qr_payload)
     """
     filename = f"pass_{pass_code}.png"
 
-    # QR payload contains only pass_code
-    qr_payload = pass_code
+    # QR payload contains only pass_code (or the signed token)
+    qr_payload = payload or pass_code
 
     qr_path = generate_qr_code(qr_payload, filename)
 
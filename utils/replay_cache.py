@@ -0,0 +1,94 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import request
+
+
+# Recent scan results per (user, endpoint, idempotency key), so a retried scan
+# returns its original response instead of "already validated". Per process:
+# a retry that lands on another worker is validated normally.
+REPLAY_CACHE_TTL_SECONDS = int(os.getenv('REPLAY_CACHE_TTL', 300))
+REPLAY_CACHE_MAX_ENTRIES = int(os.getenv('REPLAY_CACHE_MAX_ENTRIES', 10000))
+# How long a retry waits for the original request when both arrive together.
+REPLAY_WAIT_SECONDS = float(os.getenv('REPLAY_WAIT_SECONDS', 5))
+IDEMPOTENCY_KEY_MAX_LENGTH = 128
+
+_lock = threading.Lock()
+_results = OrderedDict()  # (user_id, scope, key) -> (expires_at, body, status_code)
+_in_flight = {}           # (user_id, scope, key) -> threading.Event
+
+
+def scan_idempotency_key(data):
+    """Idempotency-Key header or idempotency_key body field (None when absent/invalid)."""
+    key = request.headers.get('Idempotency-Key') or (data or {}).get('idempotency_key')
+    if not key:
+        return None
+    key = str(key).strip()
+    if not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        return None
+    return key
+
+
+def _cached(cache_key, now):
+    entry = _results.get(cache_key)
+    if entry is None:
+        return None
+    if entry[0] < now:
+        _results.pop(cache_key, None)
+        return None
+    _results.move_to_end(cache_key)
+    return entry[1], entry[2]
+
+
+def claim_replay(user_id, scope, key):
+    """
+    Return (replayed, claimed). replayed is the (body, status_code) of an earlier
+    request with the same key, or None. claimed is True when this request now
+    owns the key's in-flight slot and must call settle_replay when done.
+    A retry arriving while the original is still running waits for its result.
+    """
+    cache_key = (user_id, scope, key)
+    deadline = time.monotonic() + REPLAY_WAIT_SECONDS
+    while True:
+        with _lock:
+            cached = _cached(cache_key, time.monotonic())
+            if cached is not None:
+                return cached, False
+            pending = _in_flight.get(cache_key)
+            if pending is None:
+                _in_flight[cache_key] = threading.Event()
+                return None, True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not pending.wait(remaining):
+            # Original request is stuck; process this one normally. The slot stays
+            # the original's, so this request must not settle it.
+            return None, False
+
+
+def remember_replay(user_id, scope, key, body, status_code):
+    """Cache a committed result (server errors are never replayed)."""
+    if status_code >= 500:
+        return
+    with _lock:
+        _results[(user_id, scope, key)] = (time.monotonic() + REPLAY_CACHE_TTL_SECONDS, body, status_code)
+        _results.move_to_end((user_id, scope, key))
+        while len(_results) > REPLAY_CACHE_MAX_ENTRIES:
+            _results.popitem(last=False)
+
+
+def settle_replay(user_id, scope, key, body=None, status_code=None):
+    """Store the result of a request that claimed the key (if any) and wake waiting retries."""
+    if body is not None:
+        remember_replay(user_id, scope, key, body, status_code)
+    with _lock:
+        pending = _in_flight.pop((user_id, scope, key), None)
+    if pending is not None:
+        pending.set()
+
+
+def lookup_replay(user_id, scope, key):
+    """Cached (body, status_code) for a key without claiming it, or None."""
+    with _lock:
+        return _cached((user_id, scope, key), time.monotonic())
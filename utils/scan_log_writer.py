@@ -0,0 +1,235 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from flask import g
+from sqlalchemy import insert
+
+from database import db
+from models import ValidationLog, GateValidationLog, TicketGateValidationLog
+
+
+logger = logging.getLogger(__name__)
+
+# Opt-in: audit rows are queued in-process and written in batches by a
+# background thread. Pass/ticket state changes always stay synchronous.
+SCAN_LOG_WRITE_BEHIND = os.getenv('SCAN_LOG_WRITE_BEHIND', 'False') == 'True'
+SCAN_LOG_QUEUE_SIZE = int(os.getenv('SCAN_LOG_QUEUE_SIZE', 10000))
+SCAN_LOG_BATCH_SIZE = int(os.getenv('SCAN_LOG_BATCH_SIZE', 200))
+SCAN_LOG_FLUSH_INTERVAL_SECONDS = float(os.getenv('SCAN_LOG_FLUSH_INTERVAL', 0.5))
+SCAN_LOG_MAX_RETRIES = 3
+
+_writer = None
+
+
+def pass_scan_record(validation, gate):
+    """Audit record for a pass scan: ValidationLog kwargs + GateValidationLog kwargs."""
+    return {'kind': 'pass', 'validation': validation, 'gate': gate}
+
+
+def ticket_scan_record(ticket_log):
+    """Audit record for a ticket scan: TicketGateValidationLog kwargs."""
+    return {'kind': 'ticket', 'ticket_log': ticket_log}
+
+
+def write_scan_logs(records):
+    """
+    Insert a batch of audit records in the current session and commit.
+    ValidationLog rows go through one batched flush (ids needed for gate logs),
+    gate and ticket logs through executemany inserts.
+    """
+    pass_records = [r for r in records if r['kind'] == 'pass']
+    ticket_rows = [r['ticket_log'] for r in records if r['kind'] == 'ticket']
+
+    if pass_records:
+        validation_logs = [ValidationLog(**r['validation']) for r in pass_records]
+        db.session.add_all(validation_logs)
+        db.session.flush()
+
+        gate_rows = [
+            dict(r['gate'], validation_log_id=log.id)
+            for r, log in zip(pass_records, validation_logs)
+            if r.get('gate')
+        ]
+        if gate_rows:
+            db.session.execute(insert(GateValidationLog), gate_rows)
+
+    if ticket_rows:
+        db.session.execute(insert(TicketGateValidationLog), ticket_rows)
+
+    db.session.commit()
+
+
+class ScanLogWriter:
+    """Bounded queue of audit records drained by one background thread."""
+
+    def __init__(self, app, maxsize=SCAN_LOG_QUEUE_SIZE, batch_size=SCAN_LOG_BATCH_SIZE,
+                 flush_interval=SCAN_LOG_FLUSH_INTERVAL_SECONDS):
+        self.app = app
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='scan-log-writer', daemon=True)
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'enqueued': 0,
+            'written': 0,
+            'batches': 0,
+            'inline_writes': 0,
+            'failed': 0,
+            'max_depth': 0,
+        }
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _bump(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def submit(self, records):
+        """
+        Queue records for the background writer.
+        When the queue is full the records are written inline (back-pressure
+        instead of dropping audit rows).
+        """
+        pending = list(records)
+        while pending:
+            try:
+                self.queue.put_nowait(pending[0])
+            except queue.Full:
+                break
+            pending.pop(0)
+            self._bump('enqueued')
+
+        depth = self.queue.qsize()
+        with self._stats_lock:
+            if depth > self._stats['max_depth']:
+                self._stats['max_depth'] = depth
+
+        if pending:
+            self._bump('inline_writes', len(pending))
+            self._write(pending)
+
+    def _drain(self, first=None):
+        batch = [first] if first is not None else []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_once(self, batch):
+        # A fresh app context gets its own scoped session, so an inline write
+        # never commits or rolls back the request's session.
+        with self.app.app_context():
+            try:
+                write_scan_logs(batch)
+            except Exception:
+                db.session.rollback()
+                raise
+
+    def _write(self, batch):
+        for attempt in range(1, SCAN_LOG_MAX_RETRIES + 1):
+            try:
+                self._write_once(batch)
+                self._bump('written', len(batch))
+                self._bump('batches')
+                return True
+            except Exception as exc:
+                error = exc
+                if attempt < SCAN_LOG_MAX_RETRIES:
+                    time.sleep(0.1 * attempt)
+
+        if len(batch) == 1:
+            self._bump('failed')
+            logger.error('Dropping scan audit record after %d attempts: %r',
+                         SCAN_LOG_MAX_RETRIES, batch[0], exc_info=error)
+            return False
+
+        # One bad row must not sink the batch: write row by row, dropping only what fails.
+        written = 0
+        for record in batch:
+            try:
+                self._write_once([record])
+                written += 1
+            except Exception:
+                self._bump('failed')
+                logger.exception('Dropping scan audit record: %r', record)
+        self._bump('written', written)
+        self._bump('batches')
+        return written == len(batch)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                first = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            self._write(self._drain(first))
+
+    def flush(self):
+        """Write everything still queued (used on shutdown)."""
+        while True:
+            batch = self._drain()
+            if not batch:
+                return
+            self._write(batch)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['queue_depth'] = self.queue.qsize()
+        stats['queue_capacity'] = self.queue.maxsize
+        return stats
+
+
+def init_scan_log_writer(app):
+    """Start the background writer if SCAN_LOG_WRITE_BEHIND is enabled."""
+    global _writer
+    if not SCAN_LOG_WRITE_BEHIND or _writer is not None:
+        return _writer
+    _writer = ScanLogWriter(app).start()
+    atexit.register(_writer.stop)
+    return _writer
+
+
+def write_behind_enabled():
+    return _writer is not None
+
+
+def stage_scan_log(record):
+    """Hold an audit record until the scan transaction commits."""
+    g.setdefault('staged_scan_logs', []).append(record)
+
+
+def release_staged_scan_logs():
+    """Hand staged records to the writer. Call right after a successful commit."""
+    records = g.pop('staged_scan_logs', None)
+    if records and _writer is not None:
+        _writer.submit(records)
+
+
+def discard_staged_scan_logs():
+    """Forget staged records of a rolled-back scan."""
+    g.pop('staged_scan_logs', None)
+
+
+def scan_log_pipeline_stats():
+    if _writer is None:
+        return {'enabled': False}
+    stats = _writer.stats()
+    stats['enabled'] = True
+    return stats
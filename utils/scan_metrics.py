@@ -0,0 +1,129 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from flask import g
+from flask_login import current_user
+
+
+logger = logging.getLogger(__name__)
+
+SLOW_SCAN_THRESHOLD_MS = float(os.getenv('SLOW_SCAN_THRESHOLD_MS', 250))
+# Samples kept per (gate, stage); percentiles are computed over this rolling window.
+SCAN_METRICS_WINDOW = int(os.getenv('SCAN_METRICS_WINDOW', 1024))
+
+_lock = threading.Lock()
+_samples = {}  # gate_id -> {stage: deque(ms)}
+_slow_scans = {'count': 0}
+
+
+class ScanTrace:
+    """Per-request stage timings (milliseconds) of one scan."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.gate_id = None
+
+    def add(self, stage, elapsed_ms):
+        self.stages[stage] = self.stages.get(stage, 0.0) + elapsed_ms
+
+    def total_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+
+def start_scan_trace():
+    g.scan_trace = ScanTrace()
+    return g.scan_trace
+
+
+@contextmanager
+def scan_stage(stage):
+    """Time a block under `stage` in the active scan trace (no-op without one)."""
+    trace = g.get('scan_trace')
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(stage, (time.perf_counter() - started) * 1000)
+
+
+def set_scan_gate(gate_id):
+    trace = g.get('scan_trace')
+    if trace is not None:
+        trace.gate_id = gate_id
+
+
+def _record(gate_id, stage, value):
+    window = _samples.setdefault(gate_id, {}).get(stage)
+    if window is None:
+        window = _samples[gate_id][stage] = deque(maxlen=SCAN_METRICS_WINDOW)
+    window.append(value)
+
+
+def finish_scan_trace(status_code, message=None):
+    """Fold the active trace into the per-gate histograms and log it if slow."""
+    trace = g.pop('scan_trace', None)
+    if trace is None:
+        return None
+
+    total_ms = trace.total_ms()
+    with _lock:
+        for stage, elapsed_ms in trace.stages.items():
+            _record(trace.gate_id, stage, elapsed_ms)
+        _record(trace.gate_id, 'total', total_ms)
+
+    if total_ms >= SLOW_SCAN_THRESHOLD_MS:
+        with _lock:
+            _slow_scans['count'] += 1
+        logger.warning('slow scan %s', json.dumps({
+            'gate_id': trace.gate_id,
+            'user_id': getattr(current_user, 'id', None),
+            'status': status_code,
+            'message': message,
+            'total_ms': round(total_ms, 2),
+            'stages_ms': {stage: round(ms, 2) for stage, ms in trace.stages.items()},
+        }))
+    return total_ms
+
+
+def _percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def scan_latency_stats():
+    """p50/p95/p99/max per gate and stage over the rolling window."""
+    with _lock:
+        snapshot = {
+            gate_id: {stage: sorted(window) for stage, window in stages.items() if window}
+            for gate_id, stages in _samples.items()
+        }
+        slow_count = _slow_scans['count']
+
+    gates = {}
+    for gate_id, stages in snapshot.items():
+        gates[str(gate_id) if gate_id is not None else 'unknown'] = {
+            stage: {
+                'count': len(values),
+                'p50_ms': round(_percentile(values, 50), 2),
+                'p95_ms': round(_percentile(values, 95), 2),
+                'p99_ms': round(_percentile(values, 99), 2),
+                'max_ms': round(values[-1], 2),
+            }
+            for stage, values in stages.items()
+        }
+
+    return {
+        'slow_scan_threshold_ms': SLOW_SCAN_THRESHOLD_MS,
+        'window': SCAN_METRICS_WINDOW,
+        'slow_scans': slow_count,
+        'gates': gates,
+    }
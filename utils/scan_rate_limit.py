@@ -0,0 +1,164 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import request
+
+
+# In-process token buckets for the scan endpoints, keyed by scanner (user id)
+# and by client IP. Every scan takes a token from the "scan" budget; scans of
+# unknown codes (404) are also charged to a much smaller "miss" budget, so a
+# code-guessing loop is cut off long before a busy gate is. /validate/batch takes
+# one scan token per request and charges every unknown code in it as a miss.
+#   <limit>: "<tokens per second>/<burst>"
+SCAN_RATE_LIMIT_ENABLED = os.getenv('SCAN_RATE_LIMIT_ENABLED', 'True') == 'True'
+# Hard cap on tracked buckets; the least recently used bucket is evicted.
+SCAN_RATE_LIMIT_MAX_KEYS = int(os.getenv('SCAN_RATE_LIMIT_MAX_KEYS', 10000))
+# Number of reverse proxies in front of the app. 0 keys on the socket address;
+# N keys on the X-Forwarded-For entry appended by the outermost trusted proxy
+# (entries further left are client-supplied and never used).
+SCAN_RATE_TRUSTED_PROXIES = int(os.getenv('SCAN_RATE_TRUSTED_PROXIES', 0))
+
+
+def _limit(name, default):
+    rate, burst = os.getenv(name, default).split('/')
+    return float(rate), float(burst)
+
+
+# Every scanner of a venue may sit behind one NAT address, so the per-IP budgets
+# only catch a runaway address; the per-user budgets do the real limiting.
+SCAN_RATE_LIMITS = {
+    ('user', 'scan'): _limit('SCAN_RATE_USER', '5/20'),
+    ('user', 'miss'): _limit('SCAN_RATE_USER_MISS', '0.5/15'),
+    ('ip', 'scan'): _limit('SCAN_RATE_IP', '250/1000'),
+    ('ip', 'miss'): _limit('SCAN_RATE_IP_MISS', '10/200'),
+}
+
+_lock = threading.Lock()
+_buckets = OrderedDict()  # (scope, identity, budget) -> [tokens, refreshed_at], least recently used first
+_counters = {'allowed': 0, 'throttled': 0, 'misses': 0}
+_throttled_by = {f'{scope}_{budget}': 0 for scope, budget in SCAN_RATE_LIMITS}
+
+
+def _request_ip():
+    if SCAN_RATE_TRUSTED_PROXIES > 0:
+        forwarded = [part.strip() for part in request.headers.get('X-Forwarded-For', '').split(',')]
+        if len(forwarded) >= SCAN_RATE_TRUSTED_PROXIES and forwarded[-SCAN_RATE_TRUSTED_PROXIES]:
+            return forwarded[-SCAN_RATE_TRUSTED_PROXIES]
+    return request.remote_addr or 'unknown'
+
+
+def _refill(key, now):
+    rate, burst = SCAN_RATE_LIMITS[key[0], key[2]]
+    bucket = _buckets.get(key)
+    if bucket is None:
+        while len(_buckets) >= SCAN_RATE_LIMIT_MAX_KEYS:
+            _buckets.popitem(last=False)
+        bucket = _buckets[key] = [burst, now]
+    else:
+        _buckets.move_to_end(key)
+        bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+    return bucket
+
+
+def _identities(user_id):
+    return (('user', user_id), ('ip', _request_ip()))
+
+
+def _waits(user_id, budgets, now):
+    """Seconds to wait per exhausted '<scope>_<budget>' of the current scanner and IP."""
+    waits = {}
+    for scope, identity in _identities(user_id):
+        for budget in budgets:
+            tokens = _refill((scope, identity, budget), now)[0]
+            if tokens < 1:
+                rate = SCAN_RATE_LIMITS[scope, budget][0]
+                waits[f'{scope}_{budget}'] = (1 - tokens) / rate if rate > 0 else 3600
+    return waits
+
+
+def _throttle(waits):
+    _counters['throttled'] += 1
+    for reason in waits:
+        _throttled_by[reason] += 1
+    return max(waits.values())
+
+
+def check_scan_rate(user_id):
+    """
+    Take one scan token for the current scanner and client IP.
+    Return None when allowed, or the number of seconds to wait when throttled.
+    Nothing is charged for a throttled scan.
+    """
+    if not SCAN_RATE_LIMIT_ENABLED:
+        return None
+
+    now = time.monotonic()
+    with _lock:
+        waits = _waits(user_id, ('scan', 'miss'), now)
+        if waits:
+            return _throttle(waits)
+
+        for scope, identity in _identities(user_id):
+            # Re-fetch: a tight key cap may have evicted the bucket while the others refilled.
+            _refill((scope, identity, 'scan'), now)[0] -= 1
+        _counters['allowed'] += 1
+    return None
+
+
+def check_miss_budget(user_id):
+    """
+    Return None while the current scanner and client IP may still scan unknown
+    codes, or the number of seconds until they may. Nothing is charged.
+    """
+    if not SCAN_RATE_LIMIT_ENABLED:
+        return None
+
+    now = time.monotonic()
+    with _lock:
+        waits = _waits(user_id, ('miss',), now)
+        return _throttle(waits) if waits else None
+
+
+def record_scan_outcome(user_id, status_code):
+    """Charge a scan of an unknown code against the miss budgets."""
+    if not SCAN_RATE_LIMIT_ENABLED or status_code != 404:
+        return
+
+    now = time.monotonic()
+    with _lock:
+        for scope, identity in _identities(user_id):
+            bucket = _refill((scope, identity, 'miss'), now)
+            bucket[0] = max(bucket[0] - 1, 0)
+        _counters['misses'] += 1
+
+
+def throttled_body(retry_after):
+    """(body, headers) of the 429 response for a throttled scan."""
+    seconds = max(1, math.ceil(retry_after))
+    body = {
+        "success": False,
+        "message": "Too many scans from this scanner. Please wait a moment and try again.",
+        "rate_limited": True,
+        "retry_after": seconds,
+    }
+    return body, {'Retry-After': str(seconds)}
+
+
+def scan_rate_limit_stats():
+    with _lock:
+        return {
+            'enabled': SCAN_RATE_LIMIT_ENABLED,
+            'limits': {
+                f'{scope}_{budget}': {'per_second': rate, 'burst': burst}
+                for (scope, budget), (rate, burst) in SCAN_RATE_LIMITS.items()
+            },
+            'allowed': _counters['allowed'],
+            'throttled': _counters['throttled'],
+            'throttled_by': dict(_throttled_by),
+            'misses': _counters['misses'],
+            'tracked_buckets': len(_buckets),
+        }
@@ -1,7 +1,21 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
 from database import db
 from models import Event, Gate, EventScannerAssignment
 
 
+# Scanner assignments rarely change during an event; cache the resolved gate
+# scope per (user_id, event_id) so consecutive scans don't reload it.
+SCANNER_SCOPE_CACHE_TTL_SECONDS = int(os.getenv('SCANNER_SCOPE_CACHE_TTL', 60))
+SCANNER_SCOPE_CACHE_MAX_ENTRIES = 4096
+
+_scope_cache_lock = threading.Lock()
+_scope_cache = OrderedDict()  # (user_id, event_id) -> (expires_at, scope), oldest first
+
+
 def get_scannable_active_events(user, event_wide_only=False):
     """
     Return active events this user can scan.
@@ -65,16 +79,59 @@ def user_can_scan_event(user, event):
     ).first() is not None
 
 
+def invalidate_gate_scope(user_id=None, event_id=None):
+    """
+    Drop cached gate scopes.
+    - user_id + event_id => one entry
+    - user_id only => all events of that user
+    - event_id only => all users of that event
+    - neither => everything
+    """
+    with _scope_cache_lock:
+        if user_id is None and event_id is None:
+            _scope_cache.clear()
+            return
+
+        for key in list(_scope_cache.keys()):
+            cached_user_id, cached_event_id = key
+            if user_id is not None and cached_user_id != user_id:
+                continue
+            if event_id is not None and cached_event_id != event_id:
+                continue
+            _scope_cache.pop(key, None)
+
+
 def user_gate_scope_for_event(user, event_id):
     """
     Return gate scope:
     - None => full event gate access
     - empty set => no access
     - set(gate_ids) => access to those gates only
+    Results are cached per (user, event) for SCANNER_SCOPE_CACHE_TTL seconds.
     """
     if user.role == 'admin':
         return None
 
+    key = (user.id, event_id)
+    cached = _scope_cache.get(key)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+
+    scope = _load_gate_scope(user, event_id)
+    now = time.monotonic()
+    with _scope_cache_lock:
+        _scope_cache.pop(key, None)
+        if len(_scope_cache) >= SCANNER_SCOPE_CACHE_MAX_ENTRIES:
+            for stale_key in [k for k, (expires_at, _) in _scope_cache.items() if expires_at <= now]:
+                _scope_cache.pop(stale_key, None)
+            # Still full: evict the oldest entries.
+            while len(_scope_cache) >= SCANNER_SCOPE_CACHE_MAX_ENTRIES:
+                _scope_cache.popitem(last=False)
+        _scope_cache[key] = (now + SCANNER_SCOPE_CACHE_TTL_SECONDS, scope)
+    return scope
+
+
+def _load_gate_scope(user, event_id):
     event = Event.query.get(event_id)
     if event and event.organizer_id == user.id:
         return None
@@ -86,12 +143,12 @@ def user_gate_scope_for_event(user, event_id):
     ).all()
 
     if not rows:
-        return set()
+        return frozenset()
 
     if any(row.gate_id is None for row in rows):
         return None
 
-    return {row.gate_id for row in rows if row.gate_id is not None}
+    return frozenset(row.gate_id for row in rows if row.gate_id is not None)
 
 
 def user_can_scan_gate(user, gate):
@@ -0,0 +1,114 @@
+import logging
+
+from sqlalchemy import inspect, text
+
+from database import db
+from models import payload_digest
+
+
+logger = logging.getLogger(__name__)
+
+# db.create_all() only creates missing tables. Columns/indexes added to
+# existing tables are applied here (idempotent, safe to run on every start).
+COLUMN_UPGRADES = [
+    # (table, column, DDL type)
+    ('event_passes', 'pass_code_key', 'VARCHAR(255)'),
+    ('tickets', 'ticket_code_key', 'VARCHAR(255)'),
+    ('tickets', 'barcode_key', 'VARCHAR(255)'),
+    ('event_passes', 'encrypted_data_digest', 'VARCHAR(64)'),
+    ('event_passes', 'updated_at', 'DATETIME'),
+    ('tickets', 'updated_at', 'DATETIME'),
+    ('gates', 'updated_at', 'DATETIME'),
+    ('gate_access_rules', 'updated_at', 'DATETIME'),
+    ('offline_validation_queue', 'gate_access_granted', 'BOOLEAN'),
+    ('offline_validation_queue', 'gate_access_message', 'TEXT'),
+    ('offline_validation_queue', 'ip_address', 'VARCHAR(45)'),
+    ('offline_validation_queue', 'upload_id', 'VARCHAR(32)'),
+    ('offline_validation_queue', 'item_index', 'INTEGER'),
+    ('offline_validation_queue', 'uploaded_by', 'INTEGER'),
+    ('offline_validation_queue', 'attempts', 'INTEGER DEFAULT 0'),
+    ('offline_validation_queue', 'last_error', 'TEXT'),
+    ('offline_validation_queue', 'claimed_by', 'VARCHAR(32)'),
+    ('offline_validation_queue', 'claimed_at', 'DATETIME'),
+]
+
+BACKFILLS = [
+    "UPDATE event_passes SET pass_code_key = UPPER(TRIM(pass_code)) WHERE pass_code_key IS NULL",
+    "UPDATE tickets SET ticket_code_key = UPPER(TRIM(ticket_code)) WHERE ticket_code_key IS NULL",
+    "UPDATE tickets SET barcode_key = UPPER(TRIM(barcode)) WHERE barcode_key IS NULL",
+    "UPDATE event_passes SET updated_at = COALESCE(created_at, CURRENT_TIMESTAMP) WHERE updated_at IS NULL",
+    "UPDATE tickets SET updated_at = COALESCE(scanned_at, created_at, CURRENT_TIMESTAMP) WHERE updated_at IS NULL",
+    "UPDATE gates SET updated_at = COALESCE(created_at, CURRENT_TIMESTAMP) WHERE updated_at IS NULL",
+    "UPDATE gate_access_rules SET updated_at = COALESCE(created_at, CURRENT_TIMESTAMP) WHERE updated_at IS NULL",
+]
+
+INDEX_UPGRADES = [
+    # (index name, table, columns, unique) - names match SQLAlchemy's ix_<table>_<column>
+    ('ix_event_passes_pass_code_key', 'event_passes', ['pass_code_key'], True),
+    ('ix_tickets_ticket_code_key', 'tickets', ['ticket_code_key'], True),
+    ('ix_tickets_barcode_key', 'tickets', ['barcode_key'], True),
+    ('ix_event_passes_encrypted_data_digest', 'event_passes', ['encrypted_data_digest'], False),
+    ('ix_event_passes_updated_at', 'event_passes', ['updated_at'], False),
+    ('ix_tickets_updated_at', 'tickets', ['updated_at'], False),
+    ('ix_gates_updated_at', 'gates', ['updated_at'], False),
+    ('ix_gate_access_rules_updated_at', 'gate_access_rules', ['updated_at'], False),
+    ('ix_validation_logs_pass_id', 'validation_logs', ['pass_id'], False),
+    ('ix_offline_validation_queue_sync_status', 'offline_validation_queue', ['sync_status'], False),
+    ('ix_offline_validation_queue_upload_id', 'offline_validation_queue', ['upload_id'], False),
+    ('ix_event_passes_created_at', 'event_passes', ['created_at'], False),
+    ('ix_tickets_created_at', 'tickets', ['created_at'], False),
+]
+
+BACKFILL_CHUNK_SIZE = 1000
+
+
+def _backfill_encrypted_data_digest(conn):
+    """SHA-256 isn't available in SQLite SQL, so digests are computed in Python in chunks."""
+    while True:
+        rows = conn.execute(text(
+            "SELECT id, encrypted_data FROM event_passes "
+            "WHERE encrypted_data_digest IS NULL AND encrypted_data IS NOT NULL "
+            f"LIMIT {BACKFILL_CHUNK_SIZE}"
+        )).fetchall()
+        if not rows:
+            return
+        conn.execute(
+            text("UPDATE event_passes SET encrypted_data_digest = :digest WHERE id = :id"),
+            [{'id': row_id, 'digest': payload_digest(data)} for row_id, data in rows]
+        )
+
+
+def upgrade_schema():
+    """Add missing columns, backfill them and create missing indexes."""
+    inspector = inspect(db.engine)
+    tables = set(inspector.get_table_names())
+
+    with db.engine.begin() as conn:
+        for table, column, ddl_type in COLUMN_UPGRADES:
+            if table not in tables:
+                continue
+            existing = {col['name'] for col in inspector.get_columns(table)}
+            if column not in existing:
+                logger.info('Adding column %s.%s', table, column)
+                conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl_type}'))
+
+        for statement in BACKFILLS:
+            conn.execute(text(statement))
+        _backfill_encrypted_data_digest(conn)
+
+    inspector = inspect(db.engine)
+    for name, table, columns, unique in INDEX_UPGRADES:
+        if table not in tables:
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table)}
+        if name in existing:
+            continue
+        logger.info('Creating index %s on %s', name, table)
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(text(
+                    f"CREATE {'UNIQUE ' if unique else ''}INDEX {name} ON {table} ({', '.join(columns)})"
+                ))
+        except Exception:
+            # e.g. legacy codes that only differ by case; lookups still work, just unindexed.
+            logger.exception('Could not create index %s on %s', name, table)
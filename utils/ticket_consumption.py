@@ -0,0 +1,43 @@
+from datetime import datetime
+
+from sqlalchemy import or_
+from sqlalchemy.orm.attributes import set_committed_value
+
+from database import db
+from models import Ticket
+
+
+def consume_ticket(ticket, scanned_by, scanned_at=None):
+    """
+    Mark a ticket as used with one conditional UPDATE (... WHERE status = 'available').
+    Exactly one concurrent caller wins, across threads and worker processes.
+
+    Return True if this call consumed the ticket. On False the ticket's
+    status/scanned_by/scanned_at are refreshed so callers can report why.
+    """
+    scanned_at = scanned_at or datetime.utcnow()
+    rows = (
+        db.session.query(Ticket)
+        .filter(
+            Ticket.id == ticket.id,
+            or_(Ticket.status == 'available', Ticket.status.is_(None))
+        )
+        .update(
+            {
+                Ticket.status: 'used',
+                Ticket.scanned_by: scanned_by,
+                Ticket.scanned_at: scanned_at,
+            },
+            synchronize_session=False,
+        )
+    )
+
+    if rows == 0:
+        db.session.refresh(ticket, ['status', 'scanned_by', 'scanned_at'])
+        return False
+
+    # Mirror the UPDATE on the loaded object without marking it dirty.
+    set_committed_value(ticket, 'status', 'used')
+    set_committed_value(ticket, 'scanned_by', scanned_by)
+    set_committed_value(ticket, 'scanned_at', scanned_at)
+    return True